@@ -0,0 +1,96 @@
+"""Peak memory and GC time of SensorData chunks as models vs column arrays.
+
+    python -m benchmarks.columnar [--rows N] [--chunk-size N]
+"""
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+import typing
+from datetime import datetime, timedelta
+from migrator.domain import models as m
+from migrator.domain.columnar import SensorDataBatch, to_dicts
+
+
+def rows(offset: int, count: int) -> typing.List[typing.Dict[str, typing.Any]]:
+    """Fresh row values, as a cursor would hand them out"""
+    start = datetime(2024, 1, 1)
+    return [
+        {
+            "id": i,
+            "user_plant_id": 1,
+            "timestamp": start + timedelta(minutes=15 * i),
+            "temperature": 18 + i % 97 / 10,
+            "humidity": 0.4 + i % 13 / 100,
+            "moisture": 30 + i % 41 / 4,
+            "light": float(i % 2000),
+            "moisture_voltage": 1.5 + i % 7 / 100,
+            "location": "indoor",
+        }
+        for i in range(offset, offset + count)
+    ]
+
+
+def as_models(chunk: typing.List[typing.Dict[str, typing.Any]]):
+    return [m.SensorData(sensor="sensor-1", sensor_id=1, **row) for row in chunk]
+
+
+def as_batch(chunk: typing.List[typing.Dict[str, typing.Any]]):
+    return SensorDataBatch.from_rows(chunk, sensor="sensor-1", sensor_id=1)
+
+
+def run(load, count: int, chunk_size: int) -> typing.Dict[str, float]:
+    """Load a whole sensor's rows chunk by chunk and serialize every chunk,
+    keeping them alive so the peak is what a sensor's rows cost in memory"""
+    gc_seconds = [0.0]
+    started = {}
+
+    def on_gc(phase, info):
+        if phase == "start":
+            started["at"] = time.perf_counter()
+        elif "at" in started:
+            gc_seconds[0] += time.perf_counter() - started.pop("at")
+
+    gc.collect()
+    gc.callbacks.append(on_gc)
+    tracemalloc.start()
+    began = time.perf_counter()
+    try:
+        chunks = []
+        items = 0
+        for start in range(0, count, chunk_size):
+            chunk = load(rows(start, min(chunk_size, count - start)))
+            chunks.append(chunk)
+            items += sum(1 for _ in to_dicts(chunk))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        seconds = time.perf_counter() - began
+        tracemalloc.stop()
+        gc.callbacks.remove(on_gc)
+    return {
+        "items": items,
+        "peak_mib": round(peak / 2**20, 1),
+        "gc_seconds": round(gc_seconds[0], 3),
+        "seconds": round(seconds, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+    print(
+        json.dumps(
+            {
+                "models": run(as_models, args.rows, args.chunk_size),
+                "columnar": run(as_batch, args.rows, args.chunk_size),
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Rows/sec reading archive tables row by row vs through COPY.
+
+Reads (never deletes) everything under the cutoff from the database in
+DATABASE_URI, which has to be PostgreSQL for the COPY path.
+
+    python -m benchmarks.extraction [--tables sensor_data,...] [--upto ISO]
+"""
+import argparse
+import json
+import time
+import typing
+from datetime import datetime
+from core.settings import PostgresDatabase
+from migrator.adapters import orm as o
+from migrator.repository.postgres import SqlRepo
+
+
+def extract(source: o.ArchiveSource, upto: datetime, copy: bool, chunk_size: int):
+    with PostgresDatabase() as conn:
+        repo = SqlRepo(conn, copy_tables=[source.name] if copy else [])
+        started = time.perf_counter()
+        rows = sum(
+            len(chunk)
+            for _, chunk in repo.stream_owners(
+                source, source.upto(upto), chunk_size=chunk_size
+            )
+        )
+        return rows, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tables", default="sensor_data,user_plant_score")
+    parser.add_argument("--upto", default=datetime.utcnow().isoformat())
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    args = parser.parse_args()
+    sources = {
+        source.name: source for source in o.sensor_sources + o.user_plant_sources
+    }
+    results: typing.List[typing.Dict[str, typing.Any]] = []
+    for name in args.tables.split(","):
+        result: typing.Dict[str, typing.Any] = {"table": name}
+        for path, copy in (("rows", False), ("copy", True)):
+            rows, seconds = extract(
+                sources[name], datetime.fromisoformat(args.upto), copy, args.chunk_size
+            )
+            result[f"{path}_rows"] = rows
+            result[f"{path}_rows_per_sec"] = round(rows / seconds) if seconds else None
+        if result["rows_rows_per_sec"] and result["copy_rows_per_sec"]:
+            result["speedup"] = round(
+                result["copy_rows_per_sec"] / result["rows_rows_per_sec"], 2
+            )
+        results.append(result)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
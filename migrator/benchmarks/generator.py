@@ -0,0 +1,329 @@
+"""Fill a local database with synthetic sensor history for scale tests.
+
+Readings follow daily cycles with noise, each sensor reporting at its own
+interval (1-15 minutes) with occasional outages, and sensors differ in
+volume (log-normal, see ``Profile.skew``). Daily summaries are aggregated
+from the readings and every user plant gets hourly rows in the five score
+tables, rolled scores NULL until enough history exists and now and then
+after. Ids grow with time across owners, as they do in production.
+
+The same profile and seed always give the same rows. PostgreSQL is loaded
+with COPY ... FROM STDIN, anything else with batched INSERTs.
+
+    python -m benchmarks.generator --database URL|sqlite[:DIR]
+        [--sensors 1000] [--readings 10000] [--skew 1.0] [--seed 0]
+"""
+import argparse
+import heapq
+import io
+import json
+import math
+import os
+import random
+import time
+import typing
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+
+
+# A COPY statement is sent per this much text, INSERTs go in batches of rows
+_COPY_BUFFER_BYTES = 16 << 20
+_INSERT_BATCH = 5000
+_SENSOR_COLUMNS = ("temperature", "humidity", "moisture", "light", "moisture_voltage")
+
+
+@dataclass(slots=True)
+class Profile:
+    sensors: int = 100
+    # Mean readings per sensor and scores per user plant and score table
+    readings: int = 1000
+    user_plants: typing.Optional[int] = None
+    scores: typing.Optional[int] = None
+    # Sigma of the log-normal volume per sensor/user plant, 0 gives every one
+    # exactly the mean
+    skew: float = 1.0
+    min_interval_minutes: int = 1
+    max_interval_minutes: int = 15
+    # Chance after every reading/score that the device goes quiet for a while
+    gap_rate: float = 0.001
+    # Readings of sensors not (yet) assigned to a user plant
+    unassigned_rate: float = 0.05
+    seed: int = 0
+    start: datetime = datetime(2024, 1, 1)
+
+    def __post_init__(self):
+        if self.user_plants is None:
+            self.user_plants = self.sensors
+        if self.scores is None:
+            self.scores = self.readings // 4
+
+
+def _rng(profile: Profile, *key: typing.Any) -> random.Random:
+    """Random source of one owner/table, independent of generation order"""
+    return random.Random(":".join(map(str, (profile.seed, *key))))
+
+
+def volumes(
+    rng: random.Random, owners: int, mean: int, skew: float
+) -> typing.List[int]:
+    """Rows per owner, log-normal around ``mean``"""
+    if skew <= 0:
+        return [mean] * owners
+    # exp(N(0, s)) has mean exp(s^2 / 2)
+    scale = mean / math.exp(skew**2 / 2)
+    return [max(1, round(scale * rng.lognormvariate(0, skew))) for _ in range(owners)]
+
+
+def _gap(rng: random.Random, profile: Profile) -> timedelta:
+    if rng.random() < profile.gap_rate:
+        return timedelta(seconds=rng.randint(3600, 3 * 24 * 3600))
+    return timedelta(0)
+
+
+def _readings(
+    profile: Profile, sensor_id: int, user_plant_id: typing.Optional[int], count: int
+) -> typing.Iterator[tuple]:
+    """(timestamp, sensor_id, user_plant_id, *values, location) of a sensor"""
+    rng = _rng(profile, "sensor_readings", sensor_id)
+    interval = timedelta(
+        minutes=rng.randint(profile.min_interval_minutes, profile.max_interval_minutes)
+    )
+    timestamp = profile.start + timedelta(minutes=rng.uniform(0, 30 * 24 * 60))
+    timestamp = timestamp.replace(microsecond=0)
+    location = rng.choice(("indoor", "indoor", "outdoor"))
+    moisture = rng.uniform(20, 60)
+    humidity = rng.uniform(0.3, 0.7)
+    for _ in range(count):
+        hour = timestamp.hour + timestamp.minute / 60
+        daylight = max(0.0, math.sin(math.pi * (hour - 6) / 12))
+        # Soil dries out until the plant is watered
+        moisture = moisture - rng.uniform(0, 0.05)
+        if moisture < 15 or rng.random() < 0.0005:
+            moisture = rng.uniform(45, 60)
+        humidity = min(0.95, max(0.1, humidity + rng.gauss(0, 0.01)))
+        values = [
+            round(18 + 6 * daylight + rng.gauss(0, 0.8), 2),
+            round(humidity, 3),
+            round(moisture, 2),
+            float(round(20000 * daylight * rng.uniform(0.6, 1.0))),
+            round(1.0 + moisture / 50 + rng.gauss(0, 0.02), 3),
+        ]
+        # Now and then a probe reports nothing
+        if rng.random() < 0.01:
+            values[rng.randrange(len(values))] = None
+        yield (timestamp, sensor_id, user_plant_id, *values, location)
+        timestamp += interval + _gap(rng, profile)
+
+
+def _scores(
+    profile: Profile, table: str, user_plant_id: int, count: int
+) -> typing.Iterator[tuple]:
+    """(timestamp, user_plant_id, score, rolled score, usable) of a user plant"""
+    rng = _rng(profile, table, user_plant_id)
+    # Same schedule in every score table, the scores are computed together
+    schedule = _rng(profile, "scores", user_plant_id)
+    timestamp = profile.start + timedelta(hours=schedule.randrange(0, 30 * 24))
+    score = rng.random()
+    for index in range(count):
+        score = min(1.0, max(0.0, score + rng.gauss(0, 0.05)))
+        # Rolled scores need a day of history, and are skipped when the
+        # readings behind them were incomplete
+        rolled = None
+        if index >= 24 and rng.random() < 0.7:
+            rolled = round(min(1.0, max(0.0, score + rng.gauss(0, 0.02))), 3)
+        yield (timestamp, user_plant_id, round(score, 3), rolled, rng.random() < 0.9)
+        timestamp += timedelta(hours=1) + _gap(schedule, profile)
+
+
+class _Loader:
+    """Bulk loads rows into a table in its column order"""
+
+    def __init__(self, conn, table, columns: typing.Sequence[str]):
+        self.conn = conn
+        self.table = table
+        self.columns = list(columns)
+        self.copy = conn.engine.url.get_backend_name() == "postgresql"
+
+    def load(self, rows: typing.Iterable[typing.Sequence[typing.Any]]) -> int:
+        if self.copy:
+            return self._copy(rows)
+        count, batch = 0, []
+        for row in rows:
+            batch.append(dict(zip(self.columns, row)))
+            if len(batch) >= _INSERT_BATCH:
+                self.conn.execute(self.table.insert(), batch)
+                count, batch = count + len(batch), []
+        if batch:
+            self.conn.execute(self.table.insert(), batch)
+            count += len(batch)
+        return count
+
+    def _copy(self, rows: typing.Iterable[typing.Sequence[typing.Any]]) -> int:
+        from migrator.repository.pgcopy import format_row
+
+        columns = ", ".join(f'"{name}"' for name in self.columns)
+        statement = f"COPY {self.table.fullname} ({columns}) FROM STDIN"
+        cursor = self.conn.connection.cursor()
+        buffer, count = io.StringIO(), 0
+        try:
+            for row in rows:
+                buffer.write(format_row(row))
+                count += 1
+                if buffer.tell() >= _COPY_BUFFER_BYTES:
+                    buffer.seek(0)
+                    cursor.copy_expert(statement, buffer)
+                    buffer = io.StringIO()
+            if buffer.tell():
+                buffer.seek(0)
+                cursor.copy_expert(statement, buffer)
+        finally:
+            cursor.close()
+        return count
+
+
+def generate(engine, profile: Profile) -> typing.Dict[str, int]:
+    """Load the profile's data into the (empty) tables of ``engine``, returns
+    rows per archive table"""
+    from migrator.adapters import orm as o
+
+    counts: typing.Dict[str, int] = {}
+    rng = _rng(profile, "volumes")
+    readings = volumes(rng, profile.sensors, profile.readings, profile.skew)
+    scores = volumes(rng, profile.user_plants, profile.scores, profile.skew)
+    plants = _rng(profile, "plants")
+    assigned = {
+        sensor_id: (
+            (sensor_id - 1) % profile.user_plants + 1
+            if profile.user_plants and plants.random() >= profile.unassigned_rate
+            else None
+        )
+        for sensor_id in range(1, profile.sensors + 1)
+    }
+    postgres = engine.url.get_backend_name() == "postgresql"
+    with engine.begin() as conn:
+        if postgres:
+            conn.exec_driver_sql("SET LOCAL synchronous_commit = off")
+        _Loader(conn, o.user_plants_table, ["id", "personal_name"]).load(
+            (id_, f"plant-{id_}") for id_ in range(1, profile.user_plants + 1)
+        )
+        _Loader(conn, o.sensor_table, ["id", "sensor_id"]).load(
+            (id_, f"sensor-{id_:06d}") for id_ in range(1, profile.sensors + 1)
+        )
+        # Sensor days are summed up while the readings stream by
+        days: typing.Dict[typing.Tuple[int, typing.Any], list] = {}
+
+        def summed(rows: typing.Iterator[tuple]) -> typing.Iterator[tuple]:
+            for row in rows:
+                key = (row[1], row[0].date())
+                day = days.get(key)
+                if day is None:
+                    day = days[key] = [row[2], row[-1]] + [0.0, 0] * 5
+                for index, value in enumerate(row[3:8]):
+                    if value is not None:
+                        day[2 + 2 * index] += value
+                        day[3 + 2 * index] += 1
+                yield row
+
+        streams = [
+            _readings(profile, sensor_id, assigned[sensor_id], count)
+            for sensor_id, count in enumerate(readings, start=1)
+        ]
+        counts[o.sensor_data_source.name] = _Loader(
+            conn,
+            o.sensor_readings_table,
+            ["id", "sensor_id", "user_plant_id", "timestamp", *_SENSOR_COLUMNS]
+            + ["location"],
+        ).load(
+            (id_, row[1], row[2], row[0], *row[3:])
+            for id_, row in enumerate(
+                summed(heapq.merge(*streams, key=lambda row: row[0])), start=1
+            )
+        )
+        counts[o.daily_data_summary_source.name] = _Loader(
+            conn,
+            o.daily_data_summary_table,
+            ["id", "sensor_id", "user_plant_id", "date", *_SENSOR_COLUMNS[:4]]
+            + ["location"],
+        ).load(
+            (
+                id_,
+                sensor_id,
+                day[0],
+                date,
+                *(
+                    round(day[2 + 2 * index] / day[3 + 2 * index], 3)
+                    if day[3 + 2 * index]
+                    else None
+                    for index in range(4)
+                ),
+                day[1],
+            )
+            for id_, ((sensor_id, date), day) in enumerate(
+                sorted(days.items(), key=lambda item: (item[0][1], item[0][0])),
+                start=1,
+            )
+        )
+        for source in o.user_plant_sources:
+            streams = [
+                _scores(profile, source.table.name, user_plant_id, count)
+                for user_plant_id, count in enumerate(scores, start=1)
+            ]
+            counts[source.name] = _Loader(
+                conn,
+                source.table,
+                ["id", "user_plant_id", "timestamp"]
+                + [column.name for column in source.table.c][3:],
+            ).load(
+                (id_, row[1], row[0], *row[2:])
+                for id_, row in enumerate(
+                    heapq.merge(*streams, key=lambda row: row[0]), start=1
+                )
+            )
+        if postgres:
+            # Archive queries are planned on fresh statistics
+            conn.exec_driver_sql("ANALYZE")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database", default="sqlite", help="sqlite[:DIR] or URL")
+    defaults = Profile()
+    for name, value in asdict(defaults).items():
+        if name in ("start", "user_plants", "scores"):
+            continue
+        parser.add_argument(
+            f"--{name.replace('_', '-')}", type=type(value), default=value
+        )
+    parser.add_argument("--user-plants", type=int, default=None)
+    parser.add_argument("--scores", type=int, default=None)
+    parser.add_argument("--start", type=datetime.fromisoformat, default=defaults.start)
+    args = vars(parser.parse_args())
+    database = args.pop("database")
+    # core.settings builds a DynamoDB resource on import, which needs a region
+    os.environ.setdefault("X_AWS_REGION", "us-east-1")
+    from benchmarks import standins
+
+    engine = standins.use_database(database)
+    standins.create_tables(engine)
+    profile = Profile(**args)
+    started = time.perf_counter()
+    counts = generate(engine, profile)
+    seconds = time.perf_counter() - started
+    print(
+        json.dumps(
+            {
+                "database": str(engine.url),
+                "profile": asdict(profile),
+                "rows": counts,
+                "seconds": round(seconds, 3),
+                "rows_per_sec": round(sum(counts.values()) / seconds),
+            },
+            indent=2,
+            default=str,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
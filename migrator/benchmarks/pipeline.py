@@ -0,0 +1,308 @@
+"""Rows/sec, peak RSS and per stage latency of archive runs on local stand-ins.
+
+Every case runs in a fresh process against freshly generated data (see
+benchmarks.generator) on local stand-ins (benchmarks.standins), so its
+peak RSS is its own. A case either runs
+``archive_data`` end to end or, with --stages, calls each stage on its own
+for every sensor/user plant: SqlRepo.fetch, to_dict, DynamoRepo.save and
+SqlRepo.delete. Results are printed as JSON and, with --output, saved with
+the run's parameters so a later run can be checked against them with
+--compare.
+
+    python -m benchmarks.pipeline [--sensors 10,100] [--rows 960]
+        [--chunk-sizes 500,5000] [--modes stream,chunked,bulk,pipeline] [--stages]
+        [--database sqlite|URL] [--dynamodb-endpoint URL]
+        [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import typing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from benchmarks import generator, standins
+
+
+def _ints(value: str) -> typing.List[int]:
+    return [int(item) for item in value.split(",") if item]
+
+
+def peak_rss_mib() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+
+def _setup(case: typing.Dict[str, typing.Any]) -> typing.Dict[str, int]:
+    standins.start_dynamodb(case["dynamodb_endpoint"])
+    engine = standins.use_database(case["database"])
+    standins.create_tables(engine)
+    standins.create_dynamodb_tables()
+    return generator.generate(
+        engine,
+        generator.Profile(
+            sensors=case["sensors"],
+            readings=case["rows"],
+            user_plants=case["user_plants"],
+            scores=case["scores"],
+            skew=case["skew"],
+            seed=case["seed"],
+        ),
+    )
+
+
+def _stage_summary(stages: typing.Dict[str, typing.Any], rows: int):
+    """Stage totals across tables, with rows/sec as if the stage ran alone"""
+    summary = {}
+    for stage, entry in stages.items():
+        tables = entry["tables"].values()
+        summary[stage] = {
+            "seconds": entry["seconds"],
+            "share": entry["share"],
+            "calls": sum(timer["calls"] for timer in tables),
+            "p50": max(timer["p50"] for timer in tables),
+            "p95": max(timer["p95"] for timer in tables),
+            "rows_per_sec": round(rows / entry["seconds"])
+            if entry["seconds"]
+            else None,
+        }
+    return summary
+
+
+def run_archive(case: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+    """``archive_data`` over everything seeded"""
+    seeded = _setup(case)
+    from migrator.services import ArchiveOptions, archive_data
+
+    with tempfile.NamedTemporaryFile(suffix=".json") as report_file:
+        options = ArchiveOptions(
+            mode=case["mode"],
+            chunk_size=case["chunk_size"],
+            workers=case["workers"],
+            write_concurrency=case["write_concurrency"],
+            memory_budget=case["memory_budget"],
+            metrics=f"json:{report_file.name}",
+        )
+        started = time.perf_counter()
+        summary = archive_data(standins.CUTOFF, options=options)
+        seconds = time.perf_counter() - started
+        report = json.load(open(report_file.name))
+    rows = sum(seeded.values())
+    if summary.rows != rows or summary.failed_sensors or summary.failed_user_plants:
+        raise RuntimeError(
+            f"Archived {summary.rows} of {rows} rows, failed sensors "
+            f"{summary.failed_sensors}, user plants {summary.failed_user_plants}"
+        )
+    return {
+        "rows_total": rows,
+        "seconds": round(seconds, 3),
+        "rows_per_sec": round(rows / seconds),
+        "peak_rss_mib": peak_rss_mib(),
+        "peak_in_flight_bytes": summary.memory["peak"],
+        "stages": _stage_summary(report["stages"], rows),
+    }
+
+
+def run_stages(case: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+    """Each stage on its own, timed per sensor/user plant and table"""
+    seeded = _setup(case)
+    from core.metrics import Metrics
+    from core.settings import PostgresDatabase, dynamodb_resource
+    from migrator.adapters import orm as o
+    from migrator.domain.columnar import to_dicts
+    from migrator.repository.dynamodb import DynamoRepo
+    from migrator.repository.postgres import SqlRepo
+
+    metrics = Metrics()
+    dynamo_repo = DynamoRepo(
+        dynamodb_resource, concurrency=case["write_concurrency"], packed=[]
+    )
+    started = time.perf_counter()
+    with PostgresDatabase() as conn:
+        repo = SqlRepo(conn)
+        owners = [
+            *((sensor, o.sensor_sources) for sensor in repo.get_sensors()),
+            *((plant, o.user_plant_sources) for plant in repo.get_user_plants()),
+        ]
+        for owner, sources in owners:
+            for source in sources:
+                upto = source.upto(standins.CUTOFF)
+                with metrics.time("select", source.name):
+                    data = repo.fetch(source, owner, upto)
+                with metrics.time("serialize", source.name):
+                    items = list(to_dicts(data))
+                # Writes the serialized items, so writing is timed on its own
+                with metrics.time("write", source.name):
+                    dynamo_repo._write(dynamo_repo.tables[source.name], items)
+                with conn.begin(), metrics.time("delete", source.name):
+                    repo.delete(source, owner, upto)
+    dynamo_repo.close()
+    seconds = time.perf_counter() - started
+    rows = sum(seeded.values())
+    report = metrics.report()
+    return {
+        "rows_total": rows,
+        "seconds": round(seconds, 3),
+        "rows_per_sec": round(rows / seconds),
+        "peak_rss_mib": peak_rss_mib(),
+        "stages": _stage_summary(report["stages"], rows),
+        "tables": {stage: entry["tables"] for stage, entry in report["stages"].items()},
+    }
+
+
+def run_case(case: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+    run = run_stages if case["kind"] == "stages" else run_archive
+    return {**case_key(case), **run(case)}
+
+
+def case_key(case: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+    """What identifies a case across runs"""
+    return {
+        name: case[name]
+        for name in (
+            "kind",
+            "mode",
+            "sensors",
+            "rows",
+            "skew",
+            "chunk_size",
+            "memory_budget",
+            "database",
+        )
+    }
+
+
+def _git_revision() -> typing.Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(
+    results: typing.List[typing.Dict[str, typing.Any]],
+    baseline: typing.List[typing.Dict[str, typing.Any]],
+) -> typing.List[typing.Dict[str, typing.Any]]:
+    """rows/sec and peak RSS of every case against the same case in
+    ``baseline``, as ratios (above 1 is faster / bigger)"""
+    previous = {
+        json.dumps(case_key(result), sort_keys=True): result for result in baseline
+    }
+    changes = []
+    for result in results:
+        before = previous.get(json.dumps(case_key(result), sort_keys=True))
+        if before is None:
+            continue
+        changes.append(
+            {
+                **case_key(result),
+                "rows_per_sec": round(
+                    result["rows_per_sec"] / before["rows_per_sec"], 3
+                ),
+                "peak_rss_mib": round(
+                    result["peak_rss_mib"] / before["peak_rss_mib"], 3
+                ),
+            }
+        )
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sensors", default="10", help="comma separated")
+    parser.add_argument(
+        "--rows", default="960", help="readings per sensor, comma separated"
+    )
+    parser.add_argument("--chunk-sizes", default="5000", help="comma separated")
+    parser.add_argument("--modes", default="stream,chunked,bulk,pipeline")
+    parser.add_argument(
+        "--stages", action="store_true", help="time stages on their own instead"
+    )
+    parser.add_argument(
+        "--user-plants", type=int, default=None, help="defaults to sensors"
+    )
+    parser.add_argument(
+        "--scores", type=int, default=None, help="per user plant, defaults to rows/4"
+    )
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--write-concurrency", type=int, default=1)
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        default=0,
+        help="bytes, see ARCHIVE_MEMORY_BUDGET_BYTES",
+    )
+    parser.add_argument(
+        "--skew", type=float, default=0.0, help="of rows per owner, see generator"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--database", default="sqlite", help="sqlite or a scratch PostgreSQL URL"
+    )
+    parser.add_argument("--dynamodb-endpoint", default=None, help="DynamoDB Local")
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--compare", default=None)
+    args = parser.parse_args()
+    modes = ["stages"] if args.stages else args.modes.split(",")
+    cases = [
+        {
+            "kind": "stages" if args.stages else "archive",
+            "mode": mode,
+            "sensors": sensors,
+            "rows": rows,
+            "chunk_size": chunk_size,
+            "user_plants": sensors if args.user_plants is None else args.user_plants,
+            "scores": rows // 4 if args.scores is None else args.scores,
+            "workers": args.workers,
+            "write_concurrency": args.write_concurrency,
+            "memory_budget": args.memory_budget,
+            "skew": args.skew,
+            "seed": args.seed,
+            "database": args.database,
+            "dynamodb_endpoint": args.dynamodb_endpoint,
+        }
+        for mode, sensors, rows, chunk_size in itertools.product(
+            modes, _ints(args.sensors), _ints(args.rows), _ints(args.chunk_sizes)
+        )
+    ]
+    results = []
+    for case in cases:
+        # A process per case, spawned so nothing is inherited from the last
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=get_context("spawn")
+        ) as pool:
+            results.append(pool.submit(run_case, case).result())
+        print(json.dumps(results[-1]), file=sys.stderr)
+    output: typing.Dict[str, typing.Any] = {
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "arguments": vars(args),
+        "results": results,
+    }
+    if args.compare:
+        with open(args.compare) as baseline:
+            output["compared_to"] = args.compare
+            output["changes"] = compare(results, json.load(baseline)["results"])
+    if args.output:
+        with open(args.output, "w") as out:
+            json.dump(output, out, indent=2)
+    print(json.dumps(output, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Items/sec of the compiled serializers against per-row reflection.
+
+    python -m benchmarks.serializer [--rows N] [--repeat N]
+"""
+import argparse
+import json
+import timeit
+import typing
+from dataclasses import fields
+from datetime import datetime, timedelta
+from migrator.domain import models as m
+
+
+def reflective_to_dict(item: m.Base) -> dict:
+    """What Base.to_dict did before serializers were compiled"""
+    return {
+        field.name: m.Base._clean_for_dynamodb(getattr(item, field.name))
+        for field in fields(item)
+    }
+
+
+def sensor_data(rows: int) -> typing.List[m.SensorData]:
+    start = datetime(2024, 1, 1)
+    return [
+        m.SensorData(
+            id=i,
+            sensor="sensor-1",
+            sensor_id=1,
+            user_plant_id=1,
+            timestamp=start + timedelta(minutes=15 * i),
+            temperature=21.5 + i % 7,
+            humidity=0.43,
+            moisture=31.25,
+            light=1200.0,
+            moisture_voltage=1.73,
+            location="indoor",
+        )
+        for i in range(rows)
+    ]
+
+
+def scores(cls: type, rows: int) -> typing.List[m.Base]:
+    start = datetime(2024, 1, 1)
+    names = [field.name for field in fields(cls)]
+    values = {
+        "id": 0,
+        "user_plant": "plant-1",
+        "user_plant_id": 1,
+        "timestamp": start,
+    }
+    items = []
+    for i in range(rows):
+        row = {}
+        for name in names:
+            if name in values:
+                row[name] = values[name]
+            elif name.endswith("usable"):
+                row[name] = True
+            elif "rolled" in name:
+                row[name] = None if i % 3 else 0.71
+            else:
+                row[name] = 0.5 + i % 10 / 100
+        row["id"] = i
+        row["timestamp"] = start + timedelta(hours=i)
+        items.append(cls(**row))
+    return items
+
+
+def measure(items: typing.List[m.Base], fn, repeat: int) -> float:
+    best = min(
+        timeit.repeat(lambda: [fn(item) for item in items], number=1, repeat=repeat)
+    )
+    return len(items) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    datasets = {"SensorData": sensor_data(args.rows)}
+    for cls in [
+        m.UserPlantScore,
+        m.UserPlantTemperatureScore,
+        m.UserPlantHumidityScore,
+        m.UserPlantLightScore,
+        m.UserPlantMoistureScore,
+    ]:
+        datasets[cls.__name__] = scores(cls, args.rows)
+    results = []
+    for name, items in datasets.items():
+        compiled = type(items[0]).serializer()
+        assert all(compiled(item) == reflective_to_dict(item) for item in items)
+        before = measure(items, reflective_to_dict, args.repeat)
+        after = measure(items, compiled, args.repeat)
+        results.append(
+            {
+                "model": name,
+                "reflective_items_per_sec": round(before),
+                "compiled_items_per_sec": round(after),
+                "speedup": round(after / before, 2),
+            }
+        )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
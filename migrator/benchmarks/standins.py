@@ -0,0 +1,149 @@
+"""Local stand-ins for the archive's databases, for benchmarks.
+
+DynamoDB is moto's in-memory implementation unless an endpoint (DynamoDB
+Local) is given. Postgres is either a scratch database given by URL or,
+by default, SQLite with the ``depot`` schema attached as a second file;
+SQLite has no COPY nor DELETE ... RETURNING, so the copy path and move mode
+need the real thing.
+
+``start_dynamodb`` has to run before ``core.settings`` is imported, which
+is why the archive modules are only imported in the functions below.
+"""
+import os
+import tempfile
+import typing
+from datetime import datetime
+from core import exceptions as exc
+
+
+# Later than anything benchmarks.generator produces, archiving everything
+CUTOFF = datetime(2100, 1, 1)
+
+
+def start_dynamodb(endpoint: typing.Optional[str] = None):
+    """Point boto3 at DynamoDB Local or an in-memory moto backend"""
+    os.environ.setdefault("X_AWS_REGION", "us-east-1")
+    if endpoint:
+        # Picked up by boto3 >= 1.28 for every DynamoDB client
+        os.environ["AWS_ENDPOINT_URL_DYNAMODB"] = endpoint
+        os.environ.setdefault("AWS_ACCESS_KEY_ID", "local")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "local")
+        return None
+    try:
+        import moto
+    except ImportError as e:
+        raise exc.WillowException(
+            "In-memory DynamoDB needs moto installed, or pass a DynamoDB endpoint"
+        ) from e
+    os.environ["AWS_ACCESS_KEY_ID"] = "testing"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "testing"
+    mock = moto.mock_aws()
+    mock.start()
+    return mock
+
+
+def create_dynamodb_tables():
+    """(Re)create the archive tables, on demand so nothing is throttled"""
+    from core import settings
+
+    resource = settings.dynamodb_resource
+    keys = {
+        settings.DYNAMODB_SENSOR_DATA_PACKED_TABLE: [
+            ("sensor_id", "HASH", "N"),
+            ("bucket", "RANGE", "S"),
+        ]
+    }
+    names = [
+        settings.DYNAMODB_SENSOR_DATA_TABLE,
+        settings.DYNAMODB_SENSOR_DATA_PACKED_TABLE,
+        settings.DYNAMODB_DAILY_SENSOR_DATA_TABLE,
+        settings.DYNAMODB_PLANT_SCORE_TABLE,
+        settings.DYNAMODB_PLANT_TEMPERATURE_SCORE_TABLE,
+        settings.DYNAMODB_PLANT_HUMIDITY_SCORE_TABLE,
+        settings.DYNAMODB_PLANT_LIGHT_SCORE_TABLE,
+        settings.DYNAMODB_PLANT_MOISTURE_SCORE_TABLE,
+    ]
+    existing = {table.name for table in resource.tables.all()}
+    for name in names:
+        if name in existing:
+            resource.Table(name).delete()
+            resource.Table(name).wait_until_not_exists()
+        key = keys.get(name, [("id", "HASH", "N")])
+        resource.create_table(
+            TableName=name,
+            KeySchema=[
+                {"AttributeName": attr, "KeyType": kind} for attr, kind, _ in key
+            ],
+            AttributeDefinitions=[
+                {"AttributeName": attr, "AttributeType": type_}
+                for attr, _, type_ in key
+            ],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        resource.Table(name).wait_until_exists()
+
+
+def sqlite_engine(directory: typing.Optional[str] = None):
+    """SQLite engine with the depot schema attached, in a temporary directory
+    unless one is given"""
+    import sqlalchemy as sa
+    from sqlalchemy.pool import QueuePool
+    from core.settings import DATABASE_POOL_SIZE
+
+    directory = directory or tempfile.mkdtemp(prefix="willow-bench-")
+    engine = sa.create_engine(
+        f"sqlite:///{directory}/public.db",
+        poolclass=QueuePool,
+        pool_size=DATABASE_POOL_SIZE,
+        connect_args={"check_same_thread": False},
+    )
+
+    @sa.event.listens_for(engine, "connect")
+    def attach(dbapi_connection, _):
+        dbapi_connection.execute(f"ATTACH DATABASE '{directory}/depot.db' AS depot")
+        # Readers and the deleting connection of bulk mode work concurrently
+        dbapi_connection.execute("PRAGMA journal_mode=WAL")
+        dbapi_connection.execute("PRAGMA depot.journal_mode=WAL")
+        dbapi_connection.execute("PRAGMA busy_timeout=10000")
+
+    return engine
+
+
+def use_database(url: str = "sqlite"):
+    """Make ``url`` the database archive runs use, "sqlite" or "sqlite:DIR"
+    standing for SQLite files in a temporary directory or in DIR"""
+    import sqlalchemy as sa
+    from core import settings
+
+    if url == "sqlite" or url.startswith("sqlite:") and not url.startswith("sqlite://"):
+        directory = url[len("sqlite:") :] or None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        settings.engine = sqlite_engine(directory)
+    else:
+        settings.engine = sa.create_engine(url, pool_size=settings.DATABASE_POOL_SIZE)
+    return settings.engine
+
+
+def create_tables(engine):
+    """Create the tables archive runs read, emptying them if they exist.
+
+    Foreign keys are left out, they reference tables the archive never
+    touches. Only ever point this at a scratch database.
+    """
+    import sqlalchemy as sa
+    from sqlalchemy.schema import CreateTable
+    from core.sql import SQL_METADATA
+    from migrator.adapters import orm  # noqa: F401, defines the tables
+
+    with engine.begin() as conn:
+        if engine.url.get_backend_name() == "postgresql":
+            conn.execute(sa.text("CREATE SCHEMA IF NOT EXISTS depot"))
+        inspector = sa.inspect(conn)
+        for table in SQL_METADATA.tables.values():
+            if not inspector.has_table(table.name, schema=table.schema):
+                conn.execute(CreateTable(table, include_foreign_key_constraints=[]))
+            elif engine.url.get_backend_name() == "postgresql":
+                conn.execute(sa.text(f"TRUNCATE {table.fullname}"))
+            else:
+                conn.execute(table.delete())
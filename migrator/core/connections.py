@@ -2,6 +2,7 @@ import logging
 import typing
 from mypy_boto3_dynamodb.service_resource import Table
 from core import exceptions as exc
+from core.dynamo import BatchWriter
 import psycopg2
 import contextlib
 
@@ -42,6 +43,28 @@ class PostgresConnection:
             raise
         self.conn.close()
 
+    def copy_expert(self, query, file: typing.BinaryIO):
+        """``COPY (query) TO STDOUT`` in text format into ``file``"""
+        compiled = query.compile(
+            dialect=self.engine.dialect,
+            compile_kwargs={"render_postcompile": True},
+        )
+        cursor = self.conn.connection.cursor()
+        try:
+            sql = cursor.mogrify(str(compiled), compiled.params).decode()
+            cursor.copy_expert(f"COPY ({sql}) TO STDOUT", file)
+        except psycopg2.extensions.QueryCanceledError:
+            # Nothing more runs in an aborted transaction
+            self.conn.connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def cancel(self):
+        """Cancel the statement the connection is running, from another
+        thread"""
+        self.conn.connection.cancel()
+
     def execute(self, query, values=None):
         if values is not None:
             self._execute = self.conn.execute(query, values)
@@ -66,9 +89,9 @@ class PostgresConnection:
 
 
 class DynamoDBWrite:
-
-    def __init__(self, get_dynamo_table: typing.Callable[[], Table]):
+    def __init__(self, get_dynamo_table: typing.Callable[[], Table], **writer_options):
         self.table = get_dynamo_table()
+        self.writer = BatchWriter(self.table, **writer_options)
 
     def __enter__(self):
         return self
@@ -81,5 +104,7 @@ class DynamoDBWrite:
         if query == "put_item":
             for value in values:
                 self.table.put_item(Item=value)
+        elif query == "batch_write_item":
+            return self.writer.write(values)
         else:
             raise exc.WillowException(f"Invalid query: {query} for DynamoDBWrite")
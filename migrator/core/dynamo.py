@@ -0,0 +1,364 @@
+import logging
+import random
+import threading
+import time
+import typing
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from botocore.exceptions import ClientError
+from mypy_boto3_dynamodb.service_resource import DynamoDBServiceResource, Table
+from core import exceptions as exc
+from core.metrics import get_metrics
+
+
+LOGGER = logging.getLogger(__name__)
+
+# BatchWriteItem accepts at most 25 put/delete requests per call
+MAX_BATCH_SIZE = 25
+# Errors DynamoDB answers with when a table or the account is over its limits
+THROTTLING_ERRORS = (
+    "ProvisionedThroughputExceededException",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+)
+
+
+@dataclass(slots=True)
+class WriteResult:
+    written: int = 0
+    retried: int = 0
+    duplicates: int = 0
+    requests: int = 0
+    # Requests that were (partly) throttled and write capacity units consumed
+    throttled: int = 0
+    consumed: float = 0.0
+
+    def __iadd__(self, other: "WriteResult") -> "WriteResult":
+        self.written += other.written
+        self.retried += other.retried
+        self.duplicates += other.duplicates
+        self.requests += other.requests
+        self.throttled += other.throttled
+        self.consumed += other.consumed
+        return self
+
+
+@dataclass(slots=True)
+class PreparedChunk:
+    """A chunk serialized ahead of writing, see ArchiveSink.prepare"""
+
+    table: str
+    rows: int
+    # Whatever the sink sends, DynamoDB items or encoded files
+    items: typing.List[typing.Any] = field(default_factory=list)
+    # Approximate memory the items hold, see core.utils.budget
+    nbytes: int = 0
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(max_delay, base_delay * (2**attempt)))
+
+
+class RateLimiter:
+    """Write rate of one table in write capacity units (WCU) per second.
+
+    A token bucket holding ``burst`` seconds of the current rate paces the
+    requests, every request taking as many tokens as its items are expected
+    to consume (a running average of the consumed capacity reported back).
+    The rate follows AIMD: it grows by ``increase`` after every request that
+    went through and is cut by ``decrease`` when one is throttled, at most
+    once per ``cooldown`` seconds so concurrent writers hitting the same
+    limit only halve it once. It stays between ``min_rate`` and ``max_rate``.
+    """
+
+    def __init__(
+        self,
+        max_rate: float,
+        rate: typing.Optional[float] = None,
+        min_rate: float = 1.0,
+        increase: typing.Optional[float] = None,
+        decrease: float = 0.5,
+        burst: float = 1.0,
+        cooldown: float = 1.0,
+        clock: typing.Callable[[], float] = time.monotonic,
+        sleep: typing.Callable[[float], None] = time.sleep,
+    ):
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.rate = min(rate or max_rate, max_rate)
+        self.increase = increase or max(max_rate / 100, 1.0)
+        self.decrease = decrease
+        self.burst = burst
+        self.cooldown = cooldown
+        self.clock = clock
+        self.sleep = sleep
+        # 1KB items cost one WCU each, corrected as consumption is reported
+        self.units_per_item = 1.0
+        self._tokens = self.rate * burst
+        self._updated = clock()
+        self._throttled_at: typing.Optional[float] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_table(cls, table: Table, on_demand_rate: float, **options) -> "RateLimiter":
+        """Limiter capped at the table's provisioned WCU, or ``on_demand_rate``
+        (or the table's own maximum) for on-demand tables"""
+        try:
+            description = table.meta.client.describe_table(TableName=table.name)[
+                "Table"
+            ]
+        except Exception as e:
+            LOGGER.warning(
+                f"Could not describe {table.name}, assuming on demand: {str(e)}"
+            )
+            return cls(on_demand_rate, **options)
+        billing = description.get("BillingModeSummary", {}).get("BillingMode")
+        if billing == "PAY_PER_REQUEST":
+            # -1 or missing means no maximum was set on the table
+            maximum = description.get("OnDemandThroughput", {}).get(
+                "MaxWriteRequestUnits", -1
+            )
+            max_rate = maximum if maximum > 0 else on_demand_rate
+        else:
+            max_rate = description["ProvisionedThroughput"]["WriteCapacityUnits"]
+        LOGGER.info(
+            f"Writing to {table.name} ({billing or 'PROVISIONED'}) "
+            f"at up to {max_rate} WCU/s"
+        )
+        return cls(max_rate, **options)
+
+    def acquire(self, items: int) -> float:
+        """Wait until ``items`` can be written, returns the units taken"""
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(
+                self.rate * self.burst,
+                self._tokens + (now - self._updated) * self.rate,
+            )
+            self._updated = now
+            units = items * self.units_per_item
+            # Tokens go negative rather than making large requests wait for a
+            # full bucket, the debt is what the caller sleeps off
+            self._tokens -= units
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            self.sleep(wait)
+        return units
+
+    def record(self, units: float, written: int, consumed: float, throttled: bool):
+        """Feed back the outcome of a request that took ``units``"""
+        with self._lock:
+            if written and consumed:
+                self.units_per_item += 0.2 * (consumed / written - self.units_per_item)
+            # Return what was taken but not consumed (throttled items included)
+            self._tokens += units - consumed
+            if not throttled:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+                return
+            now = self.clock()
+            if self._throttled_at is None or now - self._throttled_at >= self.cooldown:
+                self._throttled_at = now
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self._tokens = min(self._tokens, 0.0)
+                LOGGER.info(f"Throttled, write rate lowered to {self.rate:.0f} WCU/s")
+
+
+class BatchWriter:
+    """Writes items to a table with BatchWriteItem.
+
+    Items are grouped into requests of ``batch_size``, items sharing a key
+    within a request are collapsed (last one wins, as BatchWriteItem rejects
+    duplicate keys) and ``UnprocessedItems`` are re-sent with exponential
+    backoff until ``max_retries`` is exhausted, as are whole requests
+    rejected by throttling. With a ``limiter`` requests are paced to the
+    table's write capacity.
+    """
+
+    def __init__(
+        self,
+        table: Table,
+        batch_size: int = MAX_BATCH_SIZE,
+        max_retries: int = 8,
+        base_delay: float = 0.05,
+        max_delay: float = 5.0,
+        key_names: typing.Optional[typing.Sequence[str]] = None,
+        limiter: typing.Optional[RateLimiter] = None,
+        label: typing.Optional[str] = None,
+    ):
+        if not 0 < batch_size <= MAX_BATCH_SIZE:
+            raise exc.WillowException(
+                f"Batch size must be between 1 and {MAX_BATCH_SIZE}, got {batch_size}"
+            )
+        self.table = table
+        self.client = table.meta.client
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._key_names = key_names
+        self.limiter = limiter
+        # Table name requests are timed under, the table's own by default
+        self.label = label or table.name
+        self._lock = threading.Lock()
+
+    @property
+    def key_names(self) -> typing.Sequence[str]:
+        with self._lock:
+            if self._key_names is None:
+                self._key_names = [
+                    key["AttributeName"] for key in self.table.key_schema
+                ]
+        return self._key_names
+
+    def batches(
+        self, items: typing.Iterable[typing.Dict[str, typing.Any]], result: WriteResult
+    ) -> typing.Iterator[typing.List[typing.Dict[str, typing.Any]]]:
+        """Group items into deduplicated batches of at most ``batch_size``"""
+        key_names = self.key_names
+        pending: typing.Dict[tuple, typing.Dict[str, typing.Any]] = {}
+        for item in items:
+            key = tuple(item.get(name) for name in key_names)
+            if key in pending:
+                result.duplicates += 1
+            pending[key] = item
+            if len(pending) >= self.batch_size:
+                yield list(pending.values())
+                pending = {}
+        if pending:
+            yield list(pending.values())
+
+    def send(self, batch: typing.List[typing.Dict[str, typing.Any]]) -> WriteResult:
+        """Send a single batch, retrying unprocessed items"""
+        result = WriteResult()
+        requests = [{"PutRequest": {"Item": item}} for item in batch]
+        attempt = 0
+        while True:
+            units = self.limiter.acquire(len(requests)) if self.limiter else 0.0
+            try:
+                with get_metrics().time("write", self.label):
+                    resp = self.client.batch_write_item(
+                        RequestItems={self.table.name: requests},
+                        ReturnConsumedCapacity="TOTAL",
+                    )
+            except ClientError as e:
+                if e.response["Error"]["Code"] not in THROTTLING_ERRORS:
+                    raise
+                resp = {"UnprocessedItems": {self.table.name: requests}}
+            result.requests += 1
+            unprocessed = resp.get("UnprocessedItems", {}).get(self.table.name, [])
+            consumed = sum(
+                capacity.get("CapacityUnits", 0.0)
+                for capacity in resp.get("ConsumedCapacity", [])
+            )
+            result.written += len(requests) - len(unprocessed)
+            result.consumed += consumed
+            if unprocessed:
+                result.throttled += 1
+            if self.limiter is not None:
+                self.limiter.record(
+                    units, len(requests) - len(unprocessed), consumed, bool(unprocessed)
+                )
+            if not unprocessed:
+                return result
+            if attempt >= self.max_retries:
+                raise exc.DbException(
+                    f"{len(unprocessed)} items left unprocessed in {self.table.name} "
+                    f"after {attempt} retries"
+                )
+            result.retried += len(unprocessed)
+            time.sleep(backoff_delay(attempt, self.base_delay, self.max_delay))
+            attempt += 1
+            requests = unprocessed
+
+    def write(
+        self, items: typing.Iterable[typing.Dict[str, typing.Any]]
+    ) -> WriteResult:
+        result = WriteResult()
+        for batch in self.batches(items, result):
+            result += self.send(batch)
+        return result
+
+
+class WritePool:
+    """Fans batches out over a pool of writer threads.
+
+    boto3 resources are not thread safe, so every worker builds its own
+    resource through ``get_resource`` on first use, sharing the rate limiter
+    of the writer it sends for. At most ``queue_depth``
+    batches are in flight (queued or being sent) at any time; producers block
+    until a slot frees up, which keeps memory bounded for large uploads.
+    """
+
+    def __init__(
+        self,
+        get_resource: typing.Callable[[], DynamoDBServiceResource],
+        concurrency: int,
+        queue_depth: typing.Optional[int] = None,
+        **writer_options,
+    ):
+        self.get_resource = get_resource
+        self.concurrency = concurrency
+        self.queue_depth = queue_depth or 2 * concurrency
+        self.writer_options = writer_options
+        self._local = threading.local()
+        self._slots = threading.BoundedSemaphore(self.queue_depth)
+        self._executor = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="dynamo-writer"
+        )
+
+    def _worker_writer(self, writer: BatchWriter) -> BatchWriter:
+        """This thread's copy of ``writer``"""
+        if not hasattr(self._local, "writers"):
+            self._local.resource = self.get_resource()
+            self._local.writers = {}
+        table_name = writer.table.name
+        if table_name not in self._local.writers:
+            self._local.writers[table_name] = BatchWriter(
+                self._local.resource.Table(table_name),
+                key_names=writer.key_names,
+                limiter=writer.limiter,
+                label=writer.label,
+                **self.writer_options,
+            )
+        return self._local.writers[table_name]
+
+    def _send(
+        self, writer: BatchWriter, batch: typing.List[typing.Dict[str, typing.Any]]
+    ) -> WriteResult:
+        return self._worker_writer(writer).send(batch)
+
+    def write(
+        self, writer: BatchWriter, items: typing.Iterable[typing.Dict[str, typing.Any]]
+    ) -> WriteResult:
+        """Batch ``items`` with ``writer`` and send the batches concurrently"""
+        result = WriteResult()
+        futures: typing.List[Future] = []
+        failed = threading.Event()
+
+        def done(future: Future):
+            self._slots.release()
+            if future.exception() is not None:
+                failed.set()
+
+        try:
+            for batch in writer.batches(items, result):
+                if failed.is_set():
+                    break
+                self._slots.acquire()
+                future = self._executor.submit(self._send, writer, batch)
+                future.add_done_callback(done)
+                futures.append(future)
+        finally:
+            errors = []
+            for future in futures:
+                if future.exception() is not None:
+                    errors.append(future.exception())
+                else:
+                    result += future.result()
+        if errors:
+            raise errors[0]
+        return result
+
+    def close(self):
+        self._executor.shutdown(wait=True)
@@ -12,3 +12,8 @@ class SunriseSunsetAPIError(Exception):
 
 class WillowException(Exception):
     pass
+
+
+class TimeBudgetExceeded(Exception):
+    """Raised at a chunk boundary once the run is out of time, args[0] holds
+    the rows moved before stopping"""
@@ -0,0 +1,315 @@
+import contextlib
+import json
+import logging
+import random
+import socket
+import sys
+import threading
+import time
+import typing
+from core import exceptions as exc
+
+
+LOGGER = logging.getLogger(__name__)
+
+# Samples kept per timer for percentiles, reservoir sampled past that
+MAX_SAMPLES = 2048
+# Stages an archive run is timed in, in pipeline order
+STAGES = ("select", "load", "serialize", "spool", "write", "delete")
+
+
+class Timer:
+    """Durations of one stage of one table"""
+
+    __slots__ = ("count", "total", "min", "max", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+        self.samples: typing.List[float] = []
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(seconds)
+        else:
+            index = random.randrange(self.count)
+            if index < MAX_SAMPLES:
+                self.samples[index] = seconds
+
+    def percentile(self, q: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def report(self) -> typing.Dict[str, float]:
+        return {
+            "seconds": round(self.total, 6),
+            "calls": self.count,
+            "min": round(self.min if self.count else 0.0, 6),
+            "p50": round(self.percentile(0.5), 6),
+            "p95": round(self.percentile(0.95), 6),
+            "max": round(self.max, 6),
+        }
+
+
+class Metrics:
+    """Counters and stage timers of an archive run, by table and entity.
+
+    Stages are timed per call (a query, a chunk, a request) rather than per
+    row, so recording stays cheap next to the work measured. Safe to share
+    between the threads of a run.
+    """
+
+    def __init__(self, clock: typing.Callable[[], float] = time.perf_counter):
+        self.clock = clock
+        self.started = time.time()
+        self._start = clock()
+        self.timers: typing.Dict[typing.Tuple[str, str], Timer] = {}
+        self.counters: typing.Dict[typing.Tuple[str, str], float] = {}
+        # (table, owner id) -> [rows, seconds]
+        self.entities: typing.Dict[typing.Tuple[str, int], typing.List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, table: str, seconds: float):
+        with self._lock:
+            timer = self.timers.get((stage, table))
+            if timer is None:
+                timer = self.timers[(stage, table)] = Timer()
+            timer.add(seconds)
+
+    @contextlib.contextmanager
+    def time(self, stage: str, table: str) -> typing.Iterator[None]:
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.observe(stage, table, self.clock() - start)
+
+    def timed(
+        self,
+        items: typing.Iterable[typing.Any],
+        stage: str,
+        table: str,
+        per_item: bool = True,
+    ) -> typing.Iterator[typing.Any]:
+        """Iterate ``items`` timing only the time spent producing them, as one
+        call per item or, for cheap items, a single call for all of them"""
+        iterator = iter(items)
+        total = 0.0
+        try:
+            while True:
+                start = self.clock()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    total += self.clock() - start
+                    return
+                elapsed = self.clock() - start
+                if per_item:
+                    self.observe(stage, table, elapsed)
+                else:
+                    total += elapsed
+                yield item
+        finally:
+            if not per_item:
+                self.observe(stage, table, total)
+            # Streams stopped early release their cursor or COPY right away
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+    def count(self, name: str, table: str, value: float = 1):
+        with self._lock:
+            key = (name, table)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def entity(self, table: str, owner_id: int, rows: int, seconds: float):
+        with self._lock:
+            totals = self.entities.setdefault((table, owner_id), [0, 0.0])
+            totals[0] += rows
+            totals[1] += seconds
+
+    def report(self, **extra) -> typing.Dict[str, typing.Any]:
+        """The run as a JSON serializable dict, ``extra`` keys added on top"""
+        with self._lock:
+            elapsed = self.clock() - self._start
+            stages: typing.Dict[str, typing.Any] = {}
+            for (stage, table), timer in sorted(self.timers.items()):
+                entry = stages.setdefault(stage, {"seconds": 0.0, "tables": {}})
+                entry["seconds"] += timer.total
+                entry["tables"][table] = timer.report()
+            staged = sum(entry["seconds"] for entry in stages.values()) or 1.0
+            for entry in stages.values():
+                entry["share"] = round(entry["seconds"] / staged, 4)
+                entry["seconds"] = round(entry["seconds"], 6)
+            counters: typing.Dict[str, typing.Any] = {}
+            for (name, table), value in sorted(self.counters.items()):
+                entry = counters.setdefault(name, {"total": 0, "tables": {}})
+                entry["total"] += value
+                entry["tables"][table] = value
+            entities = [
+                {
+                    "table": table,
+                    "owner_id": owner_id,
+                    "rows": rows,
+                    "seconds": round(seconds, 6),
+                }
+                for (table, owner_id), (rows, seconds) in sorted(self.entities.items())
+            ]
+        return {
+            **extra,
+            "started": self.started,
+            "elapsed": round(elapsed, 6),
+            "stages": dict(
+                sorted(
+                    stages.items(),
+                    key=lambda item: (
+                        STAGES.index(item[0]) if item[0] in STAGES else len(STAGES),
+                        item[0],
+                    ),
+                )
+            ),
+            "counters": counters,
+            "entities": entities,
+        }
+
+
+_current = Metrics()
+
+
+def get_metrics() -> Metrics:
+    """Metrics of the run in progress"""
+    return _current
+
+
+@contextlib.contextmanager
+def recording() -> typing.Iterator[Metrics]:
+    """Record into fresh metrics until the block exits"""
+    global _current
+    previous, _current = _current, Metrics()
+    try:
+        yield _current
+    finally:
+        _current = previous
+
+
+class Exporter(typing.Protocol):
+    def export(self, report: typing.Dict[str, typing.Any]) -> None:
+        ...
+
+
+class JsonExporter:
+    """Writes the whole run report as one JSON document, to stdout for "-" """
+
+    def __init__(self, path: str = "-"):
+        self.path = path
+
+    def export(self, report: typing.Dict[str, typing.Any]) -> None:
+        body = json.dumps(report, indent=2, default=str)
+        if self.path == "-":
+            print(body)
+            return
+        with open(self.path, "w") as out:
+            out.write(body)
+        LOGGER.info(f"Wrote run report to {self.path}")
+
+
+def _series(
+    report: typing.Dict[str, typing.Any]
+) -> typing.Iterator[typing.Tuple[str, str, float, str]]:
+    """(metric, table, value, unit) of a report, stage timers flattened"""
+    for stage, entry in report["stages"].items():
+        for table, timer in entry["tables"].items():
+            yield f"{stage}.seconds", table, timer["seconds"], "Seconds"
+            yield f"{stage}.calls", table, timer["calls"], "Count"
+            yield f"{stage}.p95", table, timer["p95"], "Seconds"
+    for name, entry in report["counters"].items():
+        for table, value in entry["tables"].items():
+            yield name, table, value, "Count"
+
+
+class EmfExporter:
+    """CloudWatch Embedded Metric Format, one line per table on ``stream``.
+
+    On Lambda stdout lines become metrics without any API call; locally any
+    writable stream (a file, io.StringIO) stands in.
+    """
+
+    def __init__(self, namespace: str, stream: typing.Optional[typing.TextIO] = None):
+        self.namespace = namespace
+        self.stream = stream
+
+    def export(self, report: typing.Dict[str, typing.Any]) -> None:
+        stream = self.stream or sys.stdout
+        by_table: typing.Dict[str, typing.Dict[str, typing.Tuple[float, str]]] = {}
+        for name, table, value, unit in _series(report):
+            by_table.setdefault(table, {})[name] = (value, unit)
+        timestamp = int(report["started"] * 1000)
+        for table, values in by_table.items():
+            line = {
+                "_aws": {
+                    "Timestamp": timestamp,
+                    "CloudWatchMetrics": [
+                        {
+                            "Namespace": self.namespace,
+                            "Dimensions": [["table"]],
+                            "Metrics": [
+                                {"Name": name, "Unit": unit}
+                                for name, (_, unit) in values.items()
+                            ],
+                        }
+                    ],
+                },
+                "table": table,
+                "run_id": report.get("run_id"),
+                **{name: value for name, (value, _) in values.items()},
+            }
+            stream.write(json.dumps(line) + "\n")
+        stream.flush()
+
+
+class StatsdExporter:
+    """Gauges over UDP in the DogStatsD format (``name:value|g|#table:x``).
+
+    Nothing is sent until the run ends, so a local ``nc -ul 8125`` is
+    enough of a stand-in for an agent.
+    """
+
+    def __init__(self, host: str, port: int, prefix: str):
+        self.address = (host, port)
+        self.prefix = prefix
+
+    def export(self, report: typing.Dict[str, typing.Any]) -> None:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            for name, table, value, _ in _series(report):
+                line = f"{self.prefix}.{name}:{value}|g|#table:{table}"
+                sock.sendto(line.encode(), self.address)
+
+
+def get_exporters(spec: str, namespace: str) -> typing.List[Exporter]:
+    """Exporters for a comma separated ``spec``, see ARCHIVE_METRICS in
+    core.settings"""
+    exporters: typing.List[Exporter] = []
+    for url in filter(None, (part.strip() for part in spec.split(","))):
+        if url == "json":
+            exporters.append(JsonExporter())
+        elif url.startswith("json:"):
+            exporters.append(JsonExporter(url[len("json:") :]))
+        elif url == "emf":
+            exporters.append(EmfExporter(namespace))
+        elif url.startswith("statsd://"):
+            host, _, port = url[len("statsd://") :].partition(":")
+            prefix = namespace.lower().replace("/", ".")
+            exporters.append(
+                StatsdExporter(host or "localhost", int(port or 8125), prefix)
+            )
+        else:
+            raise exc.WillowException(f"Invalid metrics exporter: {url}")
+    return exporters
@@ -10,3 +10,9 @@ class DbConnection(typing.Protocol):
     def fetchone(self) -> typing.Any: ...
 
     def fetchval(self, pos: int) -> typing.Any: ...
+
+    def begin(self) -> typing.ContextManager[DbConnection]: ...
+
+    def copy_expert(self, query, file: typing.BinaryIO) -> None: ...
+
+    def cancel(self) -> None: ...
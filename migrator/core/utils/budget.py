@@ -0,0 +1,150 @@
+import contextlib
+import sys
+import threading
+import time
+import typing
+
+
+# Chunks are cut to this share of the budget, so several fit in at once
+CHUNK_SHARE = 8
+# Rows read while the width of a table's rows is still unknown
+PROBE_ROWS = 100
+# Items looked at to estimate the size of a sequence of similar items
+SAMPLE_ITEMS = 8
+
+
+def estimate_nbytes(
+    items: typing.Sequence[typing.Any], size_of: typing.Callable[[typing.Any], int]
+) -> int:
+    """Approximate bytes of ``items`` from a few evenly spaced ones, rows of
+    one table being much alike"""
+    if not items:
+        return 0
+    sample = items[:: max(1, len(items) // SAMPLE_ITEMS)][:SAMPLE_ITEMS]
+    per_item = sum(size_of(item) for item in sample) / len(sample)
+    return int(per_item * len(items)) + sys.getsizeof(items)
+
+
+def dict_nbytes(item: typing.Dict[str, typing.Any]) -> int:
+    """Bytes of a flat dict and its values, keys being shared strings"""
+    return sys.getsizeof(item) + sum(sys.getsizeof(value) for value in item.values())
+
+
+class MemoryBudget:
+    """Bytes of archived rows held in memory at once, across threads.
+
+    ``acquire`` blocks while the bytes in flight would go over ``limit``,
+    unless nothing is in flight so that a single large chunk still moves.
+    The width of rows seen per table, or of their serialized items where
+    those are held too, sizes later chunks to a share of the limit. Without
+    a limit bytes are only counted, for the peak.
+    """
+
+    def __init__(
+        self,
+        limit: int = 0,
+        items_held: bool = False,
+        clock: typing.Callable[[], float] = time.monotonic,
+    ):
+        self.limit = limit
+        # Whether chunks are held serialized as well, so their item width
+        # has to be known before chunks grow past a probe
+        self.items_held = items_held
+        self.clock = clock
+        self.in_flight = 0
+        self.peak = 0
+        self.waits = 0
+        self.waited = 0.0
+        # Average bytes per row by table, loaded and serialized
+        self.row_bytes: typing.Dict[str, float] = {}
+        self.item_bytes: typing.Dict[str, float] = {}
+        self._cond = threading.Condition()
+
+    @property
+    def chunk_bytes(self) -> int:
+        """Most bytes a chunk should take, 0 without a limit"""
+        return self.limit // CHUNK_SHARE
+
+    def _observe(
+        self, widths: typing.Dict[str, float], table: str, rows: int, nbytes: int
+    ):
+        if not rows:
+            return
+        with self._cond:
+            width = nbytes / rows
+            previous = widths.get(table)
+            widths[table] = width if previous is None else (previous + width) / 2
+
+    def observe(self, table: str, rows: int, nbytes: int):
+        """Record the size of a loaded chunk"""
+        self._observe(self.row_bytes, table, rows, nbytes)
+
+    def observe_items(self, table: str, rows: int, nbytes: int):
+        """Record the size of a chunk serialized as a whole"""
+        self._observe(self.item_bytes, table, rows, nbytes)
+
+    def width(self, table: str) -> float:
+        """Bytes a row of ``table`` takes at most while being archived"""
+        return max(self.row_bytes.get(table, 0.0), self.item_bytes.get(table, 0.0))
+
+    def estimate(self, table: str, rows: int) -> int:
+        return int(self.width(table) * rows)
+
+    def chunk_rows(self, table: str, chunk_size: int) -> int:
+        """``chunk_size`` cut down to the rows of ``table`` that fit a chunk"""
+        if not self.limit:
+            return chunk_size
+        width = self.width(table)
+        if not width or self.items_held and table not in self.item_bytes:
+            return min(chunk_size, PROBE_ROWS)
+        return max(1, min(chunk_size, int(self.chunk_bytes // width)))
+
+    def acquire(self, nbytes: int):
+        with self._cond:
+            if self.limit and self.in_flight and self.in_flight + nbytes > self.limit:
+                self.waits += 1
+                start = self.clock()
+                self._cond.wait_for(
+                    lambda: not self.in_flight or self.in_flight + nbytes <= self.limit
+                )
+                self.waited += self.clock() - start
+            self._add(nbytes)
+
+    def adjust(self, delta: int):
+        """Account for held data growing or shrinking, never waiting"""
+        with self._cond:
+            self._add(delta)
+            if delta < 0:
+                self._cond.notify_all()
+
+    def release(self, nbytes: int):
+        self.adjust(-nbytes)
+
+    def _add(self, nbytes: int):
+        self.in_flight += nbytes
+        self.peak = max(self.peak, self.in_flight)
+
+    @contextlib.contextmanager
+    def held(self, nbytes: int) -> typing.Iterator[None]:
+        self.acquire(nbytes)
+        try:
+            yield
+        finally:
+            self.release(nbytes)
+
+    def report(self) -> typing.Dict[str, typing.Any]:
+        with self._cond:
+            return {
+                "limit": self.limit,
+                "peak": self.peak,
+                "waits": self.waits,
+                "waited": round(self.waited, 6),
+                "row_bytes": {
+                    table: round(width, 1)
+                    for table, width in sorted(self.row_bytes.items())
+                },
+                "item_bytes": {
+                    table: round(width, 1)
+                    for table, width in sorted(self.item_bytes.items())
+                },
+            }
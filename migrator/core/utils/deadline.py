@@ -0,0 +1,20 @@
+import time
+import typing
+
+
+class Deadline:
+    """Tells when less than ``margin_ms`` of the time budget is left"""
+
+    def __init__(self, remaining_ms: typing.Callable[[], int], margin_ms: int = 0):
+        self.remaining_ms = remaining_ms
+        self.margin_ms = margin_ms
+
+    @classmethod
+    def in_ms(cls, budget_ms: int, margin_ms: int = 0) -> "Deadline":
+        """Deadline ``budget_ms`` from now"""
+        end = time.monotonic() + budget_ms / 1000
+        return cls(lambda: int((end - time.monotonic()) * 1000), margin_ms)
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining_ms() <= self.margin_ms
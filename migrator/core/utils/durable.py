@@ -0,0 +1,11 @@
+import os
+
+
+def fsync_directory(path: str):
+    """Make files created, renamed or removed in the directory ``path``
+    survive a crash, which fsyncing the files alone does not"""
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -1,5 +1,10 @@
+import typing
 import sqlalchemy as sa
+from dataclasses import dataclass
+from datetime import date, datetime
 from core.sql import SQL_METADATA
+from migrator.domain import models as m
+from migrator.domain.columnar import SensorDataBatch
 
 
 sensor_table = sa.Table(
@@ -124,3 +129,129 @@ user_plant_score_table = sa.Table(
     sa.Column("score_usable", sa.Boolean()),
     sa.ForeignKeyConstraint(["user_plant_id"], ["user_plants_userplant.id"]),
 )
+
+
+@dataclass(frozen=True)
+class ArchiveSource:
+    """Maps an archivable table to the domain model its rows are loaded into.
+
+    ``owner`` is the column rows are archived by (sensor or user plant) and
+    ``cutoff`` the column compared against the archive cutoff. The owner
+    column is not selected; the model gets it from the sensor/user plant,
+    whose display name is ``owner_name``. Tables with a ``batch`` type can
+    be loaded column by column instead of as a list of models.
+    """
+
+    name: str
+    table: sa.Table
+    owner: sa.Column
+    cutoff: sa.Column
+    model: typing.Type[m.Base]
+    owner_name: sa.Column
+    owner_model: typing.Type[typing.Union[m.Sensor, m.UserPlant]]
+    batch: typing.Optional[typing.Type[SensorDataBatch]] = None
+
+    def make_owner(self, owner_id: int, name: str):
+        return self.owner_model(owner_id, name)
+
+    def upto(self, timestamp_upto: datetime) -> typing.Union[datetime, date]:
+        """Cutoff value for this table, date columns are compared by day"""
+        if isinstance(self.cutoff.type, sa.Date):
+            return timestamp_upto.date()
+        return timestamp_upto
+
+    def parse_cutoff(self, value: str) -> typing.Union[datetime, date]:
+        if isinstance(self.cutoff.type, sa.Date):
+            return date.fromisoformat(value)
+        return datetime.fromisoformat(value)
+
+    @property
+    def columns(self) -> typing.List[sa.Column]:
+        fields = set(self.model.__dataclass_fields__)
+        return [
+            column
+            for column in self.table.c
+            if column.name in fields and column is not self.owner
+        ]
+
+
+sensor_data_source = ArchiveSource(
+    name="sensor_data",
+    table=sensor_readings_table,
+    owner=sensor_readings_table.c.sensor_id,
+    cutoff=sensor_readings_table.c.timestamp,
+    model=m.SensorData,
+    owner_name=sensor_table.c.sensor_id,
+    owner_model=m.Sensor,
+    batch=SensorDataBatch,
+)
+
+daily_data_summary_source = ArchiveSource(
+    name="daily_data_summary",
+    table=daily_data_summary_table,
+    owner=daily_data_summary_table.c.sensor_id,
+    cutoff=daily_data_summary_table.c.date,
+    model=m.DailyDataSummary,
+    owner_name=sensor_table.c.sensor_id,
+    owner_model=m.Sensor,
+)
+
+user_plant_score_source = ArchiveSource(
+    name="user_plant_score",
+    table=user_plant_score_table,
+    owner=user_plant_score_table.c.user_plant_id,
+    cutoff=user_plant_score_table.c.timestamp,
+    model=m.UserPlantScore,
+    owner_name=user_plants_table.c.personal_name,
+    owner_model=m.UserPlant,
+)
+
+user_plant_temperature_score_source = ArchiveSource(
+    name="user_plant_temperature_score",
+    table=user_plant_temperature_score_table,
+    owner=user_plant_temperature_score_table.c.user_plant_id,
+    cutoff=user_plant_temperature_score_table.c.timestamp,
+    model=m.UserPlantTemperatureScore,
+    owner_name=user_plants_table.c.personal_name,
+    owner_model=m.UserPlant,
+)
+
+user_plant_humidity_score_source = ArchiveSource(
+    name="user_plant_humidity_score",
+    table=user_plant_humidity_score_table,
+    owner=user_plant_humidity_score_table.c.user_plant_id,
+    cutoff=user_plant_humidity_score_table.c.timestamp,
+    model=m.UserPlantHumidityScore,
+    owner_name=user_plants_table.c.personal_name,
+    owner_model=m.UserPlant,
+)
+
+user_plant_light_score_source = ArchiveSource(
+    name="user_plant_light_score",
+    table=user_plant_light_score_table,
+    owner=user_plant_light_score_table.c.user_plant_id,
+    cutoff=user_plant_light_score_table.c.timestamp,
+    model=m.UserPlantLightScore,
+    owner_name=user_plants_table.c.personal_name,
+    owner_model=m.UserPlant,
+)
+
+user_plant_moisture_score_source = ArchiveSource(
+    name="user_plant_moisture_score",
+    table=user_plant_moisture_score_table,
+    owner=user_plant_moisture_score_table.c.user_plant_id,
+    cutoff=user_plant_moisture_score_table.c.timestamp,
+    model=m.UserPlantMoistureScore,
+    owner_name=user_plants_table.c.personal_name,
+    owner_model=m.UserPlant,
+)
+
+sensor_sources = [sensor_data_source, daily_data_summary_source]
+
+user_plant_sources = [
+    user_plant_score_source,
+    user_plant_temperature_score_source,
+    user_plant_humidity_score_source,
+    user_plant_light_score_source,
+    user_plant_moisture_score_source,
+]
@@ -0,0 +1,238 @@
+import math
+import sys
+import typing
+from array import array
+from datetime import datetime, timedelta
+from decimal import Decimal
+from migrator.domain import models as m
+
+
+EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+# user_plant_id is nullable, ids are never negative
+_NULL_ID = -1
+FLOAT_COLUMNS = ("temperature", "humidity", "moisture", "light", "moisture_voltage")
+
+
+def _epoch_us(timestamp: datetime) -> int:
+    return (timestamp - EPOCH) // _MICROSECOND
+
+
+def _from_epoch_us(value: int) -> datetime:
+    return EPOCH + timedelta(microseconds=value)
+
+
+class SensorDataBatch:
+    """Chunk of sensor_data rows of one sensor, stored column by column.
+
+    Numbers live in typed arrays (timestamps as naive microseconds since the
+    epoch, missing floats as NaN) and the sensor and location strings are
+    shared, so a chunk costs a few bytes per value instead of a dataclass
+    and a boxed number per value. ``to_dicts`` serializes straight from the
+    columns; indexing or iterating gives SensorData views for code that
+    needs rows.
+    """
+
+    __slots__ = (
+        "sensor",
+        "sensor_id",
+        "id",
+        "user_plant_id",
+        "timestamp",
+        "temperature",
+        "humidity",
+        "moisture",
+        "light",
+        "moisture_voltage",
+        "location",
+        "locations",
+        "_location_codes",
+    )
+
+    def __init__(self, sensor: typing.Optional[str], sensor_id: int):
+        self.sensor = sensor
+        self.sensor_id = sensor_id
+        self.id = array("q")
+        self.user_plant_id = array("q")
+        self.timestamp = array("q")
+        self.temperature = array("d")
+        self.humidity = array("d")
+        self.moisture = array("d")
+        self.light = array("d")
+        self.moisture_voltage = array("d")
+        # Index into ``locations`` per row
+        self.location = array("I")
+        self.locations: typing.List[typing.Optional[str]] = []
+        self._location_codes: typing.Dict[typing.Optional[str], int] = {}
+
+    @classmethod
+    def from_rows(
+        cls,
+        rows: typing.Iterable[typing.Mapping[str, typing.Any]],
+        sensor: typing.Optional[str],
+        sensor_id: int,
+    ) -> "SensorDataBatch":
+        batch = cls(sensor, sensor_id)
+        batch.extend(rows)
+        return batch
+
+    @classmethod
+    def from_models(cls, items: typing.Sequence[m.SensorData]) -> "SensorDataBatch":
+        """Batch of rows that were loaded as models"""
+        batch = cls(items[0].sensor, items[0].sensor_id) if items else cls(None, 0)
+        batch.extend(
+            {name: getattr(item, name) for name in m.SensorData.__dataclass_fields__}
+            for item in items
+        )
+        return batch
+
+    def select(self, indices: typing.Sequence[int]) -> "SensorDataBatch":
+        """Batch of the rows at ``indices``, sharing the location strings"""
+        batch = SensorDataBatch(self.sensor, self.sensor_id)
+        for name in ("id", "user_plant_id", "timestamp", *FLOAT_COLUMNS, "location"):
+            column = getattr(self, name)
+            setattr(batch, name, array(column.typecode, [column[i] for i in indices]))
+        batch.locations = self.locations
+        batch._location_codes = self._location_codes
+        return batch
+
+    def append(self, row: typing.Mapping[str, typing.Any]):
+        self.id.append(row["id"])
+        user_plant_id = row["user_plant_id"]
+        self.user_plant_id.append(_NULL_ID if user_plant_id is None else user_plant_id)
+        self.timestamp.append(_epoch_us(row["timestamp"]))
+        for name in FLOAT_COLUMNS:
+            value = row[name]
+            getattr(self, name).append(math.nan if value is None else value)
+        location = row["location"]
+        code = self._location_codes.get(location)
+        if code is None:
+            code = self._location_codes[location] = len(self.locations)
+            self.locations.append(location)
+        self.location.append(code)
+
+    def extend(self, rows: typing.Iterable[typing.Mapping[str, typing.Any]]):
+        for row in rows:
+            self.append(row._mapping if hasattr(row, "_mapping") else row)
+
+    @property
+    def ids(self) -> array:
+        return self.id
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the columns, shared location strings counted once"""
+        columns = ("id", "user_plant_id", "timestamp", *FLOAT_COLUMNS, "location")
+        return sum(
+            getattr(self, name).itemsize * len(getattr(self, name)) for name in columns
+        ) + sum(sys.getsizeof(location) for location in self.locations)
+
+    def __len__(self) -> int:
+        return len(self.id)
+
+    def __getitem__(self, index: int) -> m.SensorData:
+        user_plant_id = self.user_plant_id[index]
+        return m.SensorData(
+            id=self.id[index],
+            sensor=self.sensor,
+            sensor_id=self.sensor_id,
+            user_plant_id=None if user_plant_id == _NULL_ID else user_plant_id,
+            timestamp=_from_epoch_us(self.timestamp[index]),
+            **{
+                name: None if math.isnan(value) else value
+                for name in FLOAT_COLUMNS
+                for value in [getattr(self, name)[index]]
+            },
+            location=self.locations[self.location[index]],
+        )
+
+    def __iter__(self) -> typing.Iterator[m.SensorData]:
+        return (self[index] for index in range(len(self)))
+
+    def column(self, name: str) -> typing.List[typing.Any]:
+        """Values of the SensorData field ``name`` of every row, without
+        building the rows"""
+        if name in FLOAT_COLUMNS:
+            return [
+                None if math.isnan(value) else value for value in getattr(self, name)
+            ]
+        if name == "timestamp":
+            return list(map(_from_epoch_us, self.timestamp))
+        if name == "user_plant_id":
+            return [
+                None if value == _NULL_ID else value for value in self.user_plant_id
+            ]
+        if name == "location":
+            locations = self.locations
+            return [locations[code] for code in self.location]
+        if name in ("sensor", "sensor_id"):
+            return [getattr(self, name)] * len(self)
+        if name == "id":
+            return list(self.id)
+        raise KeyError(name)
+
+    def to_dicts(self) -> typing.Iterator[typing.Dict[str, typing.Any]]:
+        """Items as SensorData.to_dict would give them, without the rows"""
+        # Readings repeat a lot, so equal floats share one Decimal. Missing
+        # values stay out of the cache, NaN is never equal to itself, and so
+        # do zeros, 0.0 and -0.0 being equal but not the same Decimal
+        decimals: typing.Dict[float, Decimal] = {}
+
+        def decimal(value: float) -> typing.Optional[Decimal]:
+            if value != value:
+                return None
+            if not value:
+                return Decimal(repr(value))
+            result = decimals.get(value)
+            if result is None:
+                result = decimals[value] = Decimal(repr(value))
+            return result
+
+        columns = zip(
+            self.id,
+            self.user_plant_id,
+            self.timestamp,
+            map(decimal, self.temperature),
+            map(decimal, self.humidity),
+            map(decimal, self.moisture),
+            map(decimal, self.light),
+            map(decimal, self.moisture_voltage),
+            self.location,
+        )
+        sensor, sensor_id, locations = self.sensor, self.sensor_id, self.locations
+        for id_, user_plant_id, ts, temp, hum, moist, light, volt, loc in columns:
+            timestamp = _from_epoch_us(ts)
+            yield {
+                "id": id_,
+                "sensor": sensor,
+                "sensor_id": sensor_id,
+                "user_plant_id": None if user_plant_id == _NULL_ID else user_plant_id,
+                "timestamp": (
+                    timestamp.isoformat(" ", "seconds")
+                    if timestamp.year >= 1000
+                    else timestamp.strftime("%Y-%m-%d %H:%M:%S")
+                ),
+                "temperature": temp,
+                "humidity": hum,
+                "moisture": moist,
+                "light": light,
+                "moisture_voltage": volt,
+                "location": locations[loc],
+            }
+
+
+Chunk = typing.Union[typing.List[m.Base], SensorDataBatch]
+
+
+def row_ids(chunk: Chunk) -> typing.Iterable[int]:
+    """Ids of the rows of a chunk, without building row views of a batch"""
+    if isinstance(chunk, SensorDataBatch):
+        return chunk.ids
+    return (item.id for item in chunk)
+
+
+def to_dicts(chunk: Chunk) -> typing.Iterator[typing.Dict[str, typing.Any]]:
+    """DynamoDB items of a chunk"""
+    if isinstance(chunk, SensorDataBatch):
+        return chunk.to_dicts()
+    return (item.to_dict() for item in chunk)
@@ -19,6 +19,53 @@ class UserPlant:
     personal_name: str
 
 
+def _field_type(annotation: typing.Any) -> typing.Any:
+    """``X`` for ``Optional[X]``, the annotation itself otherwise"""
+    args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+    if typing.get_origin(annotation) is typing.Union and len(args) == 1:
+        return args[0]
+    return annotation
+
+
+# Expressions converting ``v`` the way _clean_for_dynamodb does, with a fast
+# path for the declared type. isoformat matches the strftime format for naive
+# datetimes with four digit years. Other types are stored as they are.
+_CONVERSIONS = {
+    float: "Decimal(repr(v)) if v.__class__ is float else clean(v)",
+    datetime: (
+        'v.isoformat(" ", "seconds") if v.__class__ is datetime'
+        " and v.tzinfo is None and v.year >= 1000 else clean(v)"
+    ),
+    _date: "v.isoformat() if v.__class__ is date else clean(v)",
+}
+
+
+def compile_serializer(cls: type) -> typing.Callable[[typing.Any], dict]:
+    """Build ``to_dict`` for a Base subclass from its field types, so rows
+    are converted without looking up fields and types one value at a time"""
+    lines = ["def to_dict(self):"]
+    keys = []
+    for index, field in enumerate(fields(cls)):
+        conversion = _CONVERSIONS.get(_field_type(field.type))
+        if conversion is None:
+            keys.append(f"{field.name!r}: self.{field.name}")
+            continue
+        lines.append(f"    v = self.{field.name}")
+        lines.append(f"    v{index} = {conversion}")
+        keys.append(f"{field.name!r}: v{index}")
+    lines.append(f"    return {{{', '.join(keys)}}}")
+    namespace = {
+        "Decimal": Decimal,
+        "datetime": datetime,
+        "date": _date,
+        "clean": Base._clean_for_dynamodb,
+    }
+    exec("\n".join(lines), namespace)
+    to_dict = namespace["to_dict"]
+    to_dict.__qualname__ = f"{cls.__name__}.to_dict"
+    return to_dict
+
+
 @dataclass(slots=True)
 class Base:
 
@@ -32,11 +79,17 @@ class Base:
             return Decimal(str(item))
         return item
 
+    @classmethod
+    def serializer(cls) -> typing.Callable[[typing.Any], dict]:
+        """Compiled ``to_dict`` of the class, built on first use and kept
+        per class, a subclass has fields of its own"""
+        serializer = cls.__dict__.get("_serializer")
+        if serializer is None:
+            serializer = cls._serializer = compile_serializer(cls)
+        return serializer
+
     def to_dict(self):
-        return {
-            field.name: self._clean_for_dynamodb(getattr(self, field.name))
-            for field in fields(self)
-        }
+        return type(self).serializer()(self)
 
 
 @dataclass(slots=True)
@@ -121,3 +174,44 @@ class UserPlantScore(Base):
     score: float
     rolled_score: typing.Optional[float]
     score_usable: bool
+
+
+@dataclass(slots=True)
+class PendingRows:
+    """Rows of one table waiting to be archived for a sensor/user plant"""
+
+    rows: int
+    first: typing.Union[datetime, _date]
+    last: typing.Union[datetime, _date]
+
+
+@dataclass(slots=True)
+class Checkpoint:
+    """Archive progress of one table for a sensor/user plant.
+
+    Every row up to the ``(cutoff, id)`` watermark has been archived and
+    deleted; ``done`` marks the table as finished for ``run_id``.
+    """
+
+    table: str
+    owner_id: int
+    run_id: str
+    cutoff: typing.Optional[str] = None
+    id: typing.Optional[int] = None
+    done: bool = False
+
+
+@dataclass(slots=True)
+class Partition:
+    """Range partition of an archive table, ``None`` bounds are unbounded.
+
+    Rows in it have ``lower <= cutoff < upper``.
+    """
+
+    name: str
+    lower: typing.Union[datetime, _date, None]
+    upper: typing.Union[datetime, _date, None]
+
+    def older_than(self, upto: typing.Union[datetime, _date]) -> bool:
+        """Every row of the partition is under the cutoff ``upto``"""
+        return self.upper is not None and self.upper <= upto
@@ -0,0 +1,138 @@
+import itertools
+import json
+import struct
+import sys
+import typing
+import zlib
+from array import array
+from datetime import datetime, timedelta
+from migrator.domain import models as m
+from migrator.domain.columnar import EPOCH, SensorDataBatch, FLOAT_COLUMNS
+
+# Packed items: every reading of a sensor in one time bucket (a UTC day by
+# default) in a single DynamoDB item instead of one item per reading.
+#
+# ``data`` is zlib compressed: MAGIC, a JSON header length (uint32) and
+# header, then the columns. Ids and timestamps are delta encoded and every
+# 8 byte column is byte-shuffled (all first bytes, then all second bytes...)
+# so regular readings compress to a few bytes each.
+
+MAGIC = b"SDP1"
+# DynamoDB items are limited to 400KB, leave room for the other attributes
+MAX_DATA_BYTES = 350_000
+_INT_COLUMNS = ("id", "user_plant_id", "timestamp")
+_DELTA_COLUMNS = ("id", "timestamp")
+
+
+def bucket_start(epoch_us: int, bucket: timedelta) -> datetime:
+    size = bucket // timedelta(microseconds=1)
+    return EPOCH + timedelta(microseconds=epoch_us - epoch_us % size)
+
+
+def _little_endian(column: array) -> array:
+    if sys.byteorder == "big":
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column
+
+
+def _shuffle(raw: bytes, width: int) -> bytes:
+    return b"".join(raw[i::width] for i in range(width))
+
+
+def _unshuffle(raw: bytes, width: int) -> bytes:
+    out = bytearray(len(raw))
+    size = len(raw) // width
+    for i in range(width):
+        out[i::width] = raw[i * size : (i + 1) * size]
+    return bytes(out)
+
+
+def encode(batch: SensorDataBatch) -> bytes:
+    header = json.dumps(
+        {
+            "rows": len(batch),
+            "sensor": batch.sensor,
+            "sensor_id": batch.sensor_id,
+            "locations": batch.locations,
+        }
+    ).encode()
+    parts = [MAGIC, struct.pack("<I", len(header)), header]
+    for name in (*_INT_COLUMNS, *FLOAT_COLUMNS):
+        column = getattr(batch, name)
+        if name in _DELTA_COLUMNS:
+            column = array("q", [column[0], *map(int.__sub__, column[1:], column)])
+        parts.append(_shuffle(_little_endian(column).tobytes(), 8))
+    parts.append(_little_endian(batch.location).tobytes())
+    return zlib.compress(b"".join(parts))
+
+
+def decode(data: bytes) -> SensorDataBatch:
+    raw = zlib.decompress(data)
+    if raw[:4] != MAGIC:
+        raise ValueError(f"Not a packed sensor data item: {raw[:4]!r}")
+    (length,) = struct.unpack_from("<I", raw, 4)
+    header = json.loads(raw[8 : 8 + length])
+    batch = SensorDataBatch(header["sensor"], header["sensor_id"])
+    rows, offset = header["rows"], 8 + length
+    for name in (*_INT_COLUMNS, *FLOAT_COLUMNS, "location"):
+        column = array(getattr(batch, name).typecode)
+        size = rows * column.itemsize
+        chunk = raw[offset : offset + size]
+        column.frombytes(_unshuffle(chunk, 8) if column.itemsize == 8 else chunk)
+        offset += size
+        column = _little_endian(column)
+        if name in _DELTA_COLUMNS:
+            column = array("q", itertools.accumulate(column))
+        setattr(batch, name, column)
+    batch.locations = header["locations"]
+    return batch
+
+
+def _segments(batch: SensorDataBatch) -> typing.Iterator[typing.Tuple[int, bytes]]:
+    """(rows, data) of the batch, split in halves until every part fits"""
+    data = encode(batch)
+    if len(data) <= MAX_DATA_BYTES or len(batch) == 1:
+        yield len(batch), data
+        return
+    half = len(batch) // 2
+    yield from _segments(batch.select(range(half)))
+    yield from _segments(batch.select(range(half, len(batch))))
+
+
+def pack(
+    batch: SensorDataBatch, bucket: timedelta = timedelta(days=1)
+) -> typing.Iterator[typing.Dict[str, typing.Any]]:
+    """Packed items of a chunk, keyed by ``sensor_id`` and ``bucket``.
+
+    The sort key is ``<bucket start>#<first id>``: rows of one bucket spread
+    over several chunks or runs land in separate items rather than
+    overwriting each other, and writing the same chunk again is idempotent.
+    """
+    buckets: typing.Dict[datetime, typing.List[int]] = {}
+    for index, epoch_us in enumerate(batch.timestamp):
+        buckets.setdefault(bucket_start(epoch_us, bucket), []).append(index)
+    for start, indices in sorted(buckets.items()):
+        part = batch.select(indices)
+        offset = 0
+        for rows, data in _segments(part):
+            yield {
+                "sensor_id": batch.sensor_id,
+                "bucket": f"{start.isoformat()}#{part.id[offset]}",
+                "rows": rows,
+                "data": data,
+            }
+            offset += rows
+
+
+def unpack(
+    items: typing.Iterable[typing.Dict[str, typing.Any]]
+) -> typing.List[m.SensorData]:
+    """Readings of packed items ordered by timestamp and id, each row once
+    even if a chunk was archived twice"""
+    rows: typing.Dict[int, m.SensorData] = {}
+    for item in items:
+        data = item["data"]
+        for row in decode(getattr(data, "value", data)):
+            rows[row.id] = row
+    return sorted(rows.values(), key=lambda row: (row.timestamp, row.id))
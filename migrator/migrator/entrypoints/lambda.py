@@ -1,14 +1,93 @@
+import typing
+from dataclasses import asdict
 from datetime import datetime, timedelta
-from migrator.services import archive_data
+from core.settings import (
+    ARCHIVE_REINVOKE,
+    ARCHIVE_SAFETY_MARGIN_MS,
+    ARCHIVE_SHARD_BACKEND,
+    ARCHIVE_SHARDS,
+)
+from core.utils.deadline import Deadline
+from migrator.services import ArchiveOptions, archive_data, replay_spool
+from migrator.services.continuation import continuation_event, get_reinvoker
+from migrator.services.sharding import fan_out, get_backend
 
 
-def lambda_handler(event, context):
-    timestamp_upto = datetime.utcnow() - timedelta(days=60)
+def _timestamp_upto(event) -> datetime:
     ts = event.get("timestamp_upto")
     if ts:
-        timestamp_upto = datetime.fromisoformat(ts)
-    archive_data(
+        return datetime.fromisoformat(ts)
+    return datetime.utcnow() - timedelta(days=60)
+
+
+def _selected(event, key: str):
+    """Ids selected by ``event``, None for all of them. An empty list selects
+    all too unless the event is a continuation or shard of a run"""
+    ids = event.get(key)
+    if not ids and not event.get("exact_selection"):
+        return None
+    return ids
+
+
+def _deadline(event, context) -> typing.Optional[Deadline]:
+    if not hasattr(context, "get_remaining_time_in_millis"):
+        return None
+    return Deadline(
+        context.get_remaining_time_in_millis,
+        event.get("safety_margin_ms", ARCHIVE_SAFETY_MARGIN_MS),
+    )
+
+
+def lambda_handler(event, context, reinvoke=None):
+    timestamp_upto = _timestamp_upto(event)
+    deadline = _deadline(event, context)
+    summary = archive_data(
         timestamp_upto=timestamp_upto,
         selected_sensors=event.get("selected_sensors"),
         selected_user_plants=event.get("selected_user_plants"),
+        options=ArchiveOptions.from_event(event),
+        deadline=deadline,
+        watermarks=event.get("watermarks"),
+        exact_selection=event.get("exact_selection", False),
+    )
+    response = asdict(summary)
+    if summary.complete:
+        return response
+    # Out of time: hand what is left to the next invocation
+    response["continuation"] = continuation_event(event, timestamp_upto, summary)
+    if reinvoke is None:
+        reinvoke = get_reinvoker(
+            event.get("reinvoke", ARCHIVE_REINVOKE), lambda_handler
+        )
+    if reinvoke is not None:
+        response["continued"] = reinvoke(response["continuation"], context)
+    return response
+
+
+def coordinator_handler(event, context, backend=None):
+    """Splits a run into shards balanced by row count and runs each shard
+    through ``lambda_handler`` on a worker, see ``fan_out``. Shards still
+    running when the coordinator is about to time out are reported pending"""
+    # Options in the event other than the selection are passed on to workers
+    base_event = {
+        key: value
+        for key, value in event.items()
+        if key not in ("shards", "backend", "selected_sensors", "selected_user_plants")
+    }
+    summary = fan_out(
+        timestamp_upto=_timestamp_upto(event),
+        shards=event.get("shards", ARCHIVE_SHARDS),
+        backend=backend or get_backend(event.get("backend", ARCHIVE_SHARD_BACKEND)),
+        base_event=base_event,
+        selected_sensors=_selected(event, "selected_sensors"),
+        selected_user_plants=_selected(event, "selected_user_plants"),
+        run_id=event.get("run_id"),
+        deadline=_deadline(event, context),
     )
+    return summary.report()
+
+
+def replay_handler(event, context):
+    """Drains spool segments a crashed run left behind, for a scheduled run
+    or the first one after a deploy; archive runs replay them too"""
+    return replay_spool(ArchiveOptions.from_event(event))
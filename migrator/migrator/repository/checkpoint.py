@@ -0,0 +1,135 @@
+import logging
+import sqlite3
+import threading
+import typing
+from mypy_boto3_dynamodb.service_resource import DynamoDBServiceResource
+from core import exceptions as exc
+from core.settings import DYNAMODB_CHECKPOINT_TABLE
+from migrator.domain import models as m
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class CheckpointRepo(typing.Protocol):
+    def get(self, table: str, owner_id: int) -> typing.Optional[m.Checkpoint]:
+        ...
+
+    def save(self, checkpoint: m.Checkpoint) -> None:
+        ...
+
+
+class SqliteCheckpointRepo:
+    """Checkpoints in a local SQLite file, for local runs and tests"""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS archive_checkpoint ("
+                " table_name TEXT NOT NULL,"
+                " owner_id INTEGER NOT NULL,"
+                " run_id TEXT NOT NULL,"
+                " cutoff TEXT,"
+                " row_id INTEGER,"
+                " done INTEGER NOT NULL DEFAULT 0,"
+                " PRIMARY KEY (table_name, owner_id))"
+            )
+
+    def get(self, table: str, owner_id: int) -> typing.Optional[m.Checkpoint]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT run_id, cutoff, row_id, done FROM archive_checkpoint"
+                " WHERE table_name = ? AND owner_id = ?",
+                (table, owner_id),
+            ).fetchone()
+        if row is None:
+            return None
+        return m.Checkpoint(
+            table=table,
+            owner_id=owner_id,
+            run_id=row[0],
+            cutoff=row[1],
+            id=row[2],
+            done=bool(row[3]),
+        )
+
+    def save(self, checkpoint: m.Checkpoint) -> None:
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO archive_checkpoint"
+                " (table_name, owner_id, run_id, cutoff, row_id, done)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    checkpoint.table,
+                    checkpoint.owner_id,
+                    checkpoint.run_id,
+                    checkpoint.cutoff,
+                    checkpoint.id,
+                    int(checkpoint.done),
+                ),
+            )
+
+
+class DynamoCheckpointRepo:
+    """Checkpoints in a DynamoDB table keyed by ``key`` (string hash key)"""
+
+    def __init__(
+        self,
+        dynamo_resource: DynamoDBServiceResource,
+        table_name: str = DYNAMODB_CHECKPOINT_TABLE,
+    ):
+        # The resource's client serializes python types and, unlike the
+        # resource itself, can be shared between archive workers
+        self.client = dynamo_resource.meta.client
+        self.table_name = table_name
+
+    @staticmethod
+    def _key(table: str, owner_id: int) -> str:
+        return f"{table}#{owner_id}"
+
+    def get(self, table: str, owner_id: int) -> typing.Optional[m.Checkpoint]:
+        resp = self.client.get_item(
+            TableName=self.table_name,
+            Key={"key": self._key(table, owner_id)},
+            ConsistentRead=True,
+        )
+        item = resp.get("Item")
+        if item is None:
+            return None
+        return m.Checkpoint(
+            table=table,
+            owner_id=owner_id,
+            run_id=item["run_id"],
+            cutoff=item.get("cutoff"),
+            id=int(item["row_id"]) if item.get("row_id") is not None else None,
+            done=bool(item.get("done", False)),
+        )
+
+    def save(self, checkpoint: m.Checkpoint) -> None:
+        self.client.put_item(
+            TableName=self.table_name,
+            Item={
+                "key": self._key(checkpoint.table, checkpoint.owner_id),
+                "run_id": checkpoint.run_id,
+                "cutoff": checkpoint.cutoff,
+                "row_id": checkpoint.id,
+                "done": checkpoint.done,
+            },
+        )
+
+
+def get_checkpoint_repo(
+    url: str, dynamo_resource: DynamoDBServiceResource
+) -> typing.Optional[CheckpointRepo]:
+    """Checkpoint store for ``url``, see ARCHIVE_CHECKPOINT in core.settings"""
+    if not url:
+        return None
+    if url.startswith("sqlite:///"):
+        return SqliteCheckpointRepo(url[len("sqlite:///") :])
+    if url == "dynamodb":
+        return DynamoCheckpointRepo(dynamo_resource)
+    if url.startswith("dynamodb:"):
+        return DynamoCheckpointRepo(dynamo_resource, url[len("dynamodb:") :])
+    raise exc.WillowException(f"Invalid checkpoint store: {url}")
@@ -1,25 +1,60 @@
+import threading
 import traceback
 import typing
 import logging
+from boto3.dynamodb.conditions import Key
+from datetime import timedelta
 from core import exceptions as exc
+from core.dynamo import (
+    BatchWriter,
+    PreparedChunk,
+    RateLimiter,
+    WritePool,
+    WriteResult,
+)
+from core.metrics import get_metrics
+from core.utils.budget import dict_nbytes, estimate_nbytes
 from mypy_boto3_dynamodb.service_resource import Table, DynamoDBServiceResource
 from core.settings import (
+    ARCHIVE_PACKED_BUCKET_SECONDS,
+    ARCHIVE_PACKED_TABLES,
     DYNAMODB_SENSOR_DATA_TABLE,
+    DYNAMODB_SENSOR_DATA_PACKED_TABLE,
     DYNAMODB_DAILY_SENSOR_DATA_TABLE,
     DYNAMODB_PLANT_SCORE_TABLE,
     DYNAMODB_PLANT_TEMPERATURE_SCORE_TABLE,
     DYNAMODB_PLANT_HUMIDITY_SCORE_TABLE,
     DYNAMODB_PLANT_LIGHT_SCORE_TABLE,
     DYNAMODB_PLANT_MOISTURE_SCORE_TABLE,
+    DYNAMODB_BATCH_SIZE,
+    DYNAMODB_MAX_RETRIES,
+    DYNAMODB_ON_DEMAND_WCU,
+    DYNAMODB_RATE_LIMIT,
+    DYNAMODB_RETRY_BASE_DELAY,
+    DYNAMODB_RETRY_MAX_DELAY,
+    DYNAMODB_WRITE_CONCURRENCY,
+    DYNAMODB_WRITE_QUEUE_DEPTH,
+    get_dynamodb_resource,
 )
+from migrator.adapters import orm as o
 from migrator.domain import models as m
+from migrator.domain.columnar import Chunk, SensorDataBatch, to_dicts
+from migrator.domain.packed import pack, unpack
 
 
 LOGGER = logging.getLogger(__name__)
 
 
 class DynamoRepo:
-    def __init__(self, dynamo_resource: DynamoDBServiceResource) -> None:
+    def __init__(
+        self,
+        dynamo_resource: DynamoDBServiceResource,
+        concurrency: typing.Optional[int] = None,
+        queue_depth: typing.Optional[int] = None,
+        packed: typing.Optional[typing.Iterable[str]] = None,
+        bucket: timedelta = timedelta(seconds=ARCHIVE_PACKED_BUCKET_SECONDS),
+        rate_limit: bool = DYNAMODB_RATE_LIMIT,
+    ) -> None:
         self.sensor_data_table: Table = dynamo_resource.Table(
             DYNAMODB_SENSOR_DATA_TABLE
         )
@@ -39,67 +74,203 @@ class DynamoRepo:
         self.moisture_score_table: Table = dynamo_resource.Table(
             DYNAMODB_PLANT_MOISTURE_SCORE_TABLE
         )
+        self.tables: typing.Dict[str, Table] = {
+            o.sensor_data_source.name: self.sensor_data_table,
+            o.daily_data_summary_source.name: self.daily_sensor_data_table,
+            o.user_plant_score_source.name: self.score_table,
+            o.user_plant_temperature_score_source.name: self.temperature_score_table,
+            o.user_plant_humidity_score_source.name: self.humidity_score_table,
+            o.user_plant_light_score_source.name: self.light_score_table,
+            o.user_plant_moisture_score_source.name: self.moisture_score_table,
+        }
+        self.packed_tables: typing.Dict[str, Table] = {
+            o.sensor_data_source.name: dynamo_resource.Table(
+                DYNAMODB_SENSOR_DATA_PACKED_TABLE
+            ),
+        }
+        # Metrics are by Postgres table whichever layout a table is written in
+        self.labels: typing.Dict[str, str] = {
+            table.name: name
+            for tables in (self.tables, self.packed_tables)
+            for name, table in tables.items()
+        }
+        self.packed = set(ARCHIVE_PACKED_TABLES if packed is None else packed)
+        if self.packed - set(self.packed_tables):
+            raise exc.WillowException(
+                f"No packed layout for {sorted(self.packed - set(self.packed_tables))}"
+            )
+        self.bucket = bucket
+        self.writers: typing.Dict[str, BatchWriter] = {}
+        # One limiter per table, shared by every thread writing to it
+        self.rate_limit = rate_limit
+        self.limiters: typing.Dict[str, RateLimiter] = {}
+        self._lock = threading.Lock()
+        self.pool: typing.Optional[WritePool] = None
+        concurrency = concurrency or DYNAMODB_WRITE_CONCURRENCY
+        if concurrency > 1:
+            self.pool = WritePool(
+                get_dynamodb_resource,
+                concurrency=concurrency,
+                queue_depth=queue_depth or DYNAMODB_WRITE_QUEUE_DEPTH,
+                **self._writer_options(),
+            )
 
-    def save_sensor_data(self, data: typing.List[m.SensorData]):
-        try:
-            for item in data:
-                self.sensor_data_table.put_item(
-                    Item=item.to_dict(),
+    @staticmethod
+    def _writer_options() -> typing.Dict[str, typing.Any]:
+        return dict(
+            batch_size=DYNAMODB_BATCH_SIZE,
+            max_retries=DYNAMODB_MAX_RETRIES,
+            base_delay=DYNAMODB_RETRY_BASE_DELAY,
+            max_delay=DYNAMODB_RETRY_MAX_DELAY,
+        )
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+
+    def _writer(self, table: Table) -> BatchWriter:
+        with self._lock:
+            if table.name not in self.writers:
+                limiter = None
+                if self.rate_limit:
+                    limiter = self.limiters[table.name] = RateLimiter.for_table(
+                        table, DYNAMODB_ON_DEMAND_WCU
+                    )
+                self.writers[table.name] = BatchWriter(
+                    table,
+                    limiter=limiter,
+                    label=self.labels.get(table.name),
+                    **self._writer_options(),
                 )
-        except Exception as e:
-            traceback.print_exc()
-            raise exc.DbException(str(e)) from e
+            return self.writers[table.name]
 
-    def save_daily_sensor_data(self, data: typing.List[m.DailyDataSummary]):
-        try:
-            for item in data:
-                self.daily_sensor_data_table.put_item(Item=item.to_dict())
-        except Exception as e:
-            traceback.print_exc()
-            raise exc.DbException(str(e)) from e
+    def _save(self, table: Table, data: Chunk) -> WriteResult:
+        return self._write(table, to_dicts(data))
+
+    def _pack(
+        self, table: Table, data: Chunk
+    ) -> typing.List[typing.Dict[str, typing.Any]]:
+        if not isinstance(data, SensorDataBatch):
+            data = SensorDataBatch.from_models(data)
+        if not len(data):
+            return []
+        label = self.labels[table.name]
+        with get_metrics().time("serialize", label):
+            items = list(pack(data, self.bucket))
+        get_metrics().count("bytes", label, sum(len(item["data"]) for item in items))
+        return items
 
-    def save_user_plant_score(self, data: typing.List[m.UserPlantScore]):
+    def _save_packed(self, table: Table, data: Chunk) -> WriteResult:
+        items = self._pack(table, data)
+        if not items:
+            return WriteResult()
+        result = self._write(table, items)
+        # Callers count archived rows, each item carries many
+        result.written = sum(item["rows"] for item in items)
+        return result
+
+    def _write(
+        self, table: Table, items: typing.Iterable[typing.Dict[str, typing.Any]]
+    ) -> WriteResult:
+        writer = self._writer(table)
+        metrics = get_metrics()
+        # Items are serialized lazily as batches are filled
+        items = metrics.timed(items, "serialize", writer.label, per_item=False)
         try:
-            for item in data:
-                self.score_table.put_item(Item=item.to_dict())
+            if self.pool is not None:
+                result = self.pool.write(writer, items)
+            else:
+                result = writer.write(items)
         except Exception as e:
             traceback.print_exc()
             raise exc.DbException(str(e)) from e
+        metrics.count("items_written", writer.label, result.written)
+        metrics.count("items_retried", writer.label, result.retried)
+        metrics.count("requests", writer.label, result.requests)
+        metrics.count("requests_throttled", writer.label, result.throttled)
+        metrics.count("wcu", writer.label, result.consumed)
+        LOGGER.info(
+            f"Wrote {result.written} items to {table.name} "
+            f"({result.retried} retried, {result.duplicates} duplicates, "
+            f"{result.throttled} throttled, {result.consumed:.0f} WCU)"
+        )
+        return result
+
+    def save(self, source: o.ArchiveSource, data: Chunk) -> WriteResult:
+        """Archive a chunk, ``written`` counts rows also for packed tables"""
+        if source.name in self.packed:
+            return self._save_packed(self.packed_tables[source.name], data)
+        return self._save(self.tables[source.name], data)
+
+    def prepare(self, source: o.ArchiveSource, data: Chunk) -> PreparedChunk:
+        """Serialize a chunk into the items ``write`` sends, so serializing and
+        writing can run in different threads"""
+        if source.name in self.packed:
+            items = self._pack(self.packed_tables[source.name], data)
+            rows = sum(item["rows"] for item in items)
+        else:
+            with get_metrics().time("serialize", source.name):
+                items = list(to_dicts(data))
+            rows = len(items)
+        return PreparedChunk(
+            source.name, rows, items, nbytes=estimate_nbytes(items, dict_nbytes)
+        )
+
+    def write(self, prepared: PreparedChunk) -> WriteResult:
+        if prepared.table in self.packed:
+            result = self._write(self.packed_tables[prepared.table], prepared.items)
+            result.written = prepared.rows
+            return result
+        return self._write(self.tables[prepared.table], prepared.items)
+
+    def read_packed_sensor_data(
+        self, sensor_id: int, prefix: str
+    ) -> typing.List[m.SensorData]:
+        """Readings of a sensor in the packed buckets starting with ``prefix``,
+        e.g. "2024-01-01" for that UTC day"""
+        table = self.packed_tables[o.sensor_data_source.name]
+        query = dict(
+            KeyConditionExpression=Key("sensor_id").eq(sensor_id)
+            & Key("bucket").begins_with(prefix)
+        )
+        items = []
+        while True:
+            resp = table.query(**query)
+            items.extend(resp["Items"])
+            if "LastEvaluatedKey" not in resp:
+                break
+            query["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+        return unpack(items)
+
+    def save_sensor_data(self, data: typing.Iterable[m.SensorData]) -> WriteResult:
+        return self._save(self.sensor_data_table, data)
+
+    def save_daily_sensor_data(
+        self, data: typing.Iterable[m.DailyDataSummary]
+    ) -> WriteResult:
+        return self._save(self.daily_sensor_data_table, data)
+
+    def save_user_plant_score(
+        self, data: typing.Iterable[m.UserPlantScore]
+    ) -> WriteResult:
+        return self._save(self.score_table, data)
 
     def save_temperature_user_plant_score(
-        self, data: typing.List[m.UserPlantTemperatureScore]
-    ):
-        try:
-            for item in data:
-                self.temperature_score_table.put_item(Item=item.to_dict())
-        except Exception as e:
-            traceback.print_exc()
-            raise exc.DbException(str(e)) from e
+        self, data: typing.Iterable[m.UserPlantTemperatureScore]
+    ) -> WriteResult:
+        return self._save(self.temperature_score_table, data)
 
     def save_moisture_user_plant_score(
-        self, data: typing.List[m.UserPlantMoistureScore]
-    ):
-        try:
-            for item in data:
-                self.moisture_score_table.put_item(Item=item.to_dict())
-        except Exception as e:
-            traceback.print_exc()
-            raise exc.DbException(str(e)) from e
+        self, data: typing.Iterable[m.UserPlantMoistureScore]
+    ) -> WriteResult:
+        return self._save(self.moisture_score_table, data)
 
-    def save_light_user_plant_score(self, data: typing.List[m.UserPlantLightScore]):
-        try:
-            for item in data:
-                self.light_score_table.put_item(Item=item.to_dict())
-        except Exception as e:
-            traceback.print_exc()
-            raise exc.DbException(str(e)) from e
+    def save_light_user_plant_score(
+        self, data: typing.Iterable[m.UserPlantLightScore]
+    ) -> WriteResult:
+        return self._save(self.light_score_table, data)
 
     def save_humidity_user_plant_score(
-        self, data: typing.List[m.UserPlantHumidityScore]
-    ):
-        try:
-            for item in data:
-                self.humidity_score_table.put_item(Item=item.to_dict())
-        except Exception as e:
-            traceback.print_exc()
-            raise exc.DbException(str(e)) from e
+        self, data: typing.Iterable[m.UserPlantHumidityScore]
+    ) -> WriteResult:
+        return self._save(self.humidity_score_table, data)
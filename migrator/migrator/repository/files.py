@@ -0,0 +1,156 @@
+import gzip
+import io
+import json
+import logging
+import os
+import typing
+from datetime import date, datetime
+from core import exceptions as exc
+from core.dynamo import PreparedChunk, WriteResult
+from core.metrics import get_metrics
+from core.utils.durable import fsync_directory
+from migrator.adapters import orm as o
+from migrator.domain import models as m
+from migrator.domain.columnar import Chunk, SensorDataBatch
+
+
+LOGGER = logging.getLogger(__name__)
+
+FORMATS = ("ndjson", "parquet")
+
+
+def _json_default(value: typing.Any):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+Columns = typing.Dict[str, typing.List[typing.Any]]
+
+
+def _columns(source: o.ArchiveSource, data: Chunk) -> Columns:
+    """Values of every field of the chunk, straight from a batch's columns"""
+    fields = list(source.model.__dataclass_fields__)
+    if isinstance(data, SensorDataBatch):
+        return {name: data.column(name) for name in fields}
+    rows: typing.List[m.Base] = list(data)
+    return {name: [getattr(row, name) for row in rows] for name in fields}
+
+
+def _ndjson(columns: Columns) -> bytes:
+    names = list(columns)
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode="wb", mtime=0) as out:
+        for values in zip(*columns.values()):
+            record = dict(zip(names, values))
+            out.write(json.dumps(record, default=_json_default).encode())
+            out.write(b"\n")
+    return buffer.getvalue()
+
+
+def _parquet(columns: Columns) -> bytes:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise exc.WillowException("The parquet format needs pyarrow installed") from e
+    table = pa.table(columns)
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression="zstd")
+    return buffer.getvalue()
+
+
+class FileSink:
+    """Archives chunks as compressed files instead of DynamoDB items.
+
+    Files are partitioned as ``<table>/<owner field>=<id>/date=<day>/`` under
+    ``root``, a local directory or ``s3://bucket/prefix``, and named after
+    the first and last row id so archiving a chunk again replaces its file.
+    Every file is complete once ``save`` or ``write`` returns, so rows can be deleted.
+    """
+
+    def __init__(self, root: str, format: str = "ndjson", s3_client=None):
+        if format not in FORMATS:
+            raise exc.WillowException(f"Invalid file format: {format}")
+        self.root = root.rstrip("/")
+        self.format = format
+        self.extension = "ndjson.gz" if format == "ndjson" else "parquet"
+        self.s3_client = s3_client
+
+    def _put(self, path: str, body: bytes):
+        if self.root.startswith("s3://"):
+            bucket, _, prefix = self.root[len("s3://") :].partition("/")
+            key = f"{prefix}/{path}" if prefix else path
+            self.s3_client.put_object(Bucket=bucket, Key=key, Body=body)
+            return
+        full_path = os.path.abspath(os.path.join(self.root, path))
+        directory = os.path.dirname(full_path)
+        created = not os.path.isdir(directory)
+        os.makedirs(directory, exist_ok=True)
+        # Readers never see half written files
+        with open(f"{full_path}.tmp", "wb") as out:
+            out.write(body)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(f"{full_path}.tmp", full_path)
+        # The rows are deleted next, so the file has to survive a crash under
+        # its name, and so do the directories it was the first file of
+        fsync_directory(directory)
+        if created:
+            top = os.path.dirname(os.path.abspath(self.root))
+            while directory not in (top, os.path.dirname(directory)):
+                directory = os.path.dirname(directory)
+                fsync_directory(directory)
+
+    def prepare(self, source: o.ArchiveSource, data: Chunk) -> PreparedChunk:
+        """Encode a chunk into (path, body, rows) files, one per owner and day"""
+        prepared = PreparedChunk(source.name, len(data))
+        columns = _columns(source, data)
+        owner_field = source.owner.name
+        encode = _ndjson if self.format == "ndjson" else _parquet
+        partitions: typing.Dict[typing.Tuple[int, str], typing.List[int]] = {}
+        for index, (owner_id, cutoff) in enumerate(
+            zip(columns[owner_field], columns[source.cutoff.name])
+        ):
+            day = cutoff.date() if isinstance(cutoff, datetime) else cutoff
+            partitions.setdefault((owner_id, day.isoformat()), []).append(index)
+        metrics = get_metrics()
+        for (owner_id, day), indices in partitions.items():
+            part = {
+                name: [values[index] for index in indices]
+                for name, values in columns.items()
+            }
+            path = (
+                f"{source.name}/{owner_field}={owner_id}/date={day}/"
+                f"part-{min(part['id'])}-{max(part['id'])}.{self.extension}"
+            )
+            with metrics.time("serialize", source.name):
+                body = encode(part)
+            metrics.count("bytes", source.name, len(body))
+            prepared.items.append((path, body, len(indices)))
+            prepared.nbytes += len(body)
+        return prepared
+
+    def write(self, prepared: PreparedChunk) -> WriteResult:
+        result = WriteResult()
+        if not prepared.items:
+            return result
+        metrics = get_metrics()
+        for path, body, rows in prepared.items:
+            with metrics.time("write", prepared.table):
+                self._put(path, body)
+            result.requests += 1
+            result.written += rows
+        metrics.count("items_written", prepared.table, result.written)
+        metrics.count("requests", prepared.table, result.requests)
+        LOGGER.info(
+            f"Wrote {result.written} {prepared.table} rows to {result.requests} "
+            f"files under {self.root}"
+        )
+        return result
+
+    def save(self, source: o.ArchiveSource, data: Chunk) -> WriteResult:
+        return self.write(self.prepare(source, data))
+
+    def close(self):
+        pass
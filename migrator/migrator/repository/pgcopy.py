@@ -0,0 +1,178 @@
+import queue
+import re
+import threading
+import typing
+import sqlalchemy as sa
+from datetime import date, datetime
+from decimal import Decimal
+from core.protocols import DbConnection
+from core.settings import ARCHIVE_COPY_BUFFER_BYTES
+
+# The text format of COPY: one line per row, values separated by tabs, \N
+# for NULL and backslash escapes in text values. Parsed for COPY ... TO
+# STDOUT, formatted for bulk loads with COPY ... FROM STDIN.
+
+NULL = "\\N"
+_ESCAPE = re.compile(r"\\(?:([0-7]{1,3})|x([0-9A-Fa-f]{1,2})|(.))")
+_ESCAPES = {"b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t", "v": "\v"}
+_SPECIAL = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+# COPY output is handed from the copying thread to the parser in blocks of
+# whole rows of about this size
+BLOCK_BYTES = 64 << 10
+# Tells the parser the copy is over
+_END = object()
+
+
+def _unescape_match(match: "re.Match[str]") -> str:
+    octal, hexa, char = match.groups()
+    if octal:
+        return chr(int(octal, 8))
+    if hexa:
+        return chr(int(hexa, 16))
+    return _ESCAPES.get(char, char)
+
+
+def text(value: str) -> str:
+    if "\\" not in value:
+        return value
+    return _ESCAPE.sub(_unescape_match, value)
+
+
+def timestamp(value: str) -> datetime:
+    # Postgres trims trailing zeros of the fraction, older fromisoformat
+    # versions only take 3 or 6 digits
+    head, dot, fraction = value.partition(".")
+    if dot and len(fraction) != 6:
+        value = f"{head}.{fraction.ljust(6, '0')}"
+    return datetime.fromisoformat(value)
+
+
+def boolean(value: str) -> bool:
+    return value == "t"
+
+
+def converter(type_: sa.types.TypeEngine) -> typing.Callable[[str], typing.Any]:
+    """Parses a COPY text value of a column type"""
+    if isinstance(type_, sa.Boolean):
+        return boolean
+    if isinstance(type_, sa.Integer):
+        return int
+    if isinstance(type_, sa.Float):
+        return float
+    if isinstance(type_, sa.Numeric):
+        return Decimal
+    if isinstance(type_, sa.DateTime):
+        return timestamp
+    if isinstance(type_, sa.Date):
+        return date.fromisoformat
+    return text
+
+
+def parse(
+    lines: typing.Iterable[str],
+    names: typing.Sequence[str],
+    converters: typing.Sequence[typing.Callable[[str], typing.Any]],
+    chunk_size: int,
+) -> typing.Iterator[typing.List[typing.Dict[str, typing.Any]]]:
+    columns = list(zip(names, converters))
+    chunk = []
+    for line in lines:
+        values = line.rstrip("\n").split("\t")
+        chunk.append(
+            {
+                name: None if value == NULL else convert(value)
+                for (name, convert), value in zip(columns, values)
+            }
+        )
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def format_value(value: typing.Any) -> str:
+    if value is None:
+        return NULL
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, datetime):
+        return value.isoformat(" ")
+    if isinstance(value, str):
+        return value.translate(_SPECIAL)
+    # Numbers and dates print the way COPY reads them
+    return str(value)
+
+
+def format_row(values: typing.Iterable[typing.Any]) -> str:
+    return "\t".join(map(format_value, values)) + "\n"
+
+
+class _Blocks:
+    """File COPY writes its rows to, one row per call, queued in blocks"""
+
+    def __init__(self, blocks: queue.Queue):
+        self.blocks = blocks
+        self.buffer = bytearray()
+
+    def write(self, data: bytes) -> int:
+        self.buffer += data
+        if len(self.buffer) >= BLOCK_BYTES:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            self.blocks.put(bytes(self.buffer))
+            self.buffer.clear()
+
+
+def copy_partitions(
+    conn: DbConnection,
+    query: sa.sql.Select,
+    chunk_size: int,
+    buffer_bytes: int = ARCHIVE_COPY_BUFFER_BYTES,
+) -> typing.Iterator[typing.List[typing.Dict[str, typing.Any]]]:
+    """Rows of ``query`` as dicts in chunks of ``chunk_size``, read with COPY.
+
+    COPY runs on a thread of its own and rows are parsed as they arrive,
+    at most ``buffer_bytes`` of them waiting in between, so reading
+    overlaps with whatever the chunks are used for. Stopping before the end
+    cancels the COPY, which rolls back the connection's transaction.
+    """
+    selected = list(query.selected_columns)
+    names = [column.key for column in selected]
+    converters = [converter(column.type) for column in selected]
+    blocks: queue.Queue = queue.Queue(maxsize=max(1, buffer_bytes // BLOCK_BYTES))
+    failure: typing.List[BaseException] = []
+
+    def copy():
+        out = _Blocks(blocks)
+        try:
+            conn.copy_expert(query, out)
+            out.flush()
+        except BaseException as e:
+            failure.append(e)
+        finally:
+            blocks.put(_END)
+
+    def lines() -> typing.Iterator[str]:
+        nonlocal ended
+        for block in iter(blocks.get, _END):
+            # Values escape their newlines, every block ends with one
+            yield from block.decode("utf-8").split("\n")[:-1]
+        ended = True
+
+    ended = False
+    thread = threading.Thread(target=copy, name="copy-out", daemon=True)
+    thread.start()
+    try:
+        yield from parse(lines(), names, converters, chunk_size)
+    finally:
+        if not ended:
+            conn.cancel()
+            while blocks.get() is not _END:
+                pass
+        thread.join()
+    if failure:
+        raise failure[0]
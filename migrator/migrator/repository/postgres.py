@@ -1,19 +1,126 @@
+import contextlib
+import itertools
 import logging
+import re
+import sys
 import typing
 import sqlalchemy as sa
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
+from sqlalchemy.dialects import postgresql
 from migrator.adapters import orm as o
 from migrator.domain import models as m
+from migrator.domain.columnar import Chunk, SensorDataBatch
+from migrator.repository import pgcopy
+from migrator.repository.pgcopy import copy_partitions
 
+from core import exceptions as exc
+from core.metrics import get_metrics
 from core.protocols import DbConnection
+from core.utils.budget import MemoryBudget, estimate_nbytes
+from core.settings import (
+    ARCHIVE_CHUNK_SIZE,
+    ARCHIVE_COLUMNAR,
+    ARCHIVE_COPY_BUFFER_BYTES,
+    ARCHIVE_COPY_TABLES,
+    ARCHIVE_DELETE_BATCH_SIZE,
+)
 
 
 LOGGER = logging.getLogger(__name__)
 
+Owner = typing.Union[m.Sensor, m.UserPlant]
+# Position of a row in (cutoff, id) order, used to page without OFFSET
+Keyset = typing.Tuple[typing.Any, int]
+
+
+# FOR VALUES FROM ('2024-01-01 00:00:00') TO ('2024-02-01 00:00:00')
+_RANGE_BOUND = re.compile(r"^FOR VALUES FROM \((.+)\) TO \((.+)\)$")
+# UTC offset of a timestamptz bound such as '2024-01-01 00:00:00+05:30'
+_UTC_OFFSET = re.compile(r"([+-])(\d{2})(?::?(\d{2}))?(?::?(\d{2}))?$")
+
+
+def quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def parse_bound_value(
+    source: o.ArchiveSource, value: str
+) -> typing.Union[datetime, date]:
+    """A partition bound as the cutoff compares to it, timestamptz bounds
+    as naive UTC timestamps"""
+    if isinstance(source.cutoff.type, sa.Date):
+        return date.fromisoformat(value)
+    day, _, clock = value.partition(" ")
+    offset = _UTC_OFFSET.search(clock)
+    if offset is None:
+        return pgcopy.timestamp(value)
+    sign, hours, minutes, seconds = offset.groups()
+    delta = timedelta(
+        hours=int(hours), minutes=int(minutes or 0), seconds=int(seconds or 0)
+    )
+    local = pgcopy.timestamp(f"{day} {clock[: offset.start()]}")
+    return local - delta if sign == "+" else local + delta
+
+
+def parse_range_bound(
+    source: o.ArchiveSource, bound: str
+) -> typing.Optional[typing.Tuple[typing.Any, typing.Any]]:
+    """(lower, upper) of a single column range partition bound, None for
+    DEFAULT and anything else"""
+    match = _RANGE_BOUND.match(bound)
+    if match is None:
+        return None
+    values = []
+    for value in match.groups():
+        if value in ("MINVALUE", "MAXVALUE"):
+            values.append(None)
+        elif value.startswith("'") and value.endswith("'"):
+            try:
+                values.append(parse_bound_value(source, value[1:-1]))
+            except ValueError:
+                LOGGER.warning(f"Skipping partition with unreadable bound {bound}")
+                return None
+        else:
+            return None
+    return values[0], values[1]
+
+
+def owner_fields(owner: Owner) -> typing.Dict[str, typing.Any]:
+    """Model fields that come from the sensor/user plant rather than the row"""
+    if isinstance(owner, m.Sensor):
+        return {"sensor": owner.sensor, "sensor_id": owner.id}
+    return {"user_plant": owner.personal_name, "user_plant_id": owner.id}
+
+
+def _row_nbytes(row: m.Base) -> int:
+    return sys.getsizeof(row) + sum(
+        sys.getsizeof(getattr(row, name)) for name in row.__dataclass_fields__
+    )
+
+
+def chunk_nbytes(chunk: Chunk) -> int:
+    """Approximate bytes a loaded chunk holds"""
+    if isinstance(chunk, SensorDataBatch):
+        return chunk.nbytes
+    return estimate_nbytes(chunk, _row_nbytes)
+
 
 class SqlRepo:
-    def __init__(self, conn: DbConnection):
+    def __init__(
+        self,
+        conn: DbConnection,
+        columnar: bool = ARCHIVE_COLUMNAR,
+        copy_tables: typing.Optional[typing.Iterable[str]] = None,
+        budget: typing.Optional[MemoryBudget] = None,
+    ):
         self.conn = conn
+        self.columnar = columnar
+        self.copy_tables = set(
+            ARCHIVE_COPY_TABLES if copy_tables is None else copy_tables
+        )
+        # Learns row widths from loaded chunks and sizes streamed chunks to
+        # fit it, callers hold the chunks against it
+        self.budget = budget
 
     def get_sensors(self) -> typing.List[m.Sensor]:
         query = sa.select(
@@ -49,337 +156,557 @@ class SqlRepo:
             for item in resp
         ]
 
-    def get_sensor_data(
-        self, sensor: m.Sensor, timestamp_upto: datetime
-    ) -> typing.List[m.SensorData]:
-        query = sa.select(
-            [
-                o.sensor_readings_table.c.id,
-                o.sensor_readings_table.c.sensor_id,
-                o.sensor_readings_table.c.user_plant_id,
-                o.sensor_readings_table.c.timestamp,
-                o.sensor_readings_table.c.temperature,
-                o.sensor_readings_table.c.humidity,
-                o.sensor_readings_table.c.moisture,
-                o.sensor_readings_table.c.light,
-                o.sensor_readings_table.c.moisture_voltage,
-                o.sensor_readings_table.c.location,
-            ]
-        ).where(
+    def _select(self, source: o.ArchiveSource, owner: Owner, upto: typing.Any):
+        return sa.select(source.columns).where(
             sa.and_(
-                o.sensor_readings_table.c.sensor_id == sensor.id,
-                o.sensor_readings_table.c.timestamp <= timestamp_upto,
+                source.owner == owner.id,
+                source.cutoff <= upto,
             )
         )
+
+    def _load(
+        self,
+        source: o.ArchiveSource,
+        owner: Owner,
+        rows: typing.Sequence[typing.Any],
+    ) -> Chunk:
+        """Rows as a columnar batch where the table has one, models otherwise"""
+        extra = owner_fields(owner)
+        metrics = get_metrics()
+        metrics.count("rows_read", source.name, len(rows))
+        with metrics.time("load", source.name):
+            if self.columnar and source.batch is not None:
+                chunk = source.batch.from_rows(rows, **extra)
+            else:
+                chunk = [
+                    source.model(**getattr(item, "_mapping", item), **extra)
+                    for item in rows
+                ]
+        if self.budget is not None:
+            self.budget.observe(source.name, len(chunk), chunk_nbytes(chunk))
+        return chunk
+
+    def chunk_rows(self, source: o.ArchiveSource, chunk_size: int) -> int:
+        """``chunk_size`` cut down to what fits the memory budget"""
+        if self.budget is None:
+            return chunk_size
+        return self.budget.chunk_rows(source.name, chunk_size)
+
+    def _partitions(
+        self, source: o.ArchiveSource, query: sa.sql.Select, chunk_size: int
+    ) -> typing.Iterator[typing.Sequence[typing.Any]]:
+        """Result rows in chunks, through COPY for tables in ``copy_tables``"""
+        metrics = get_metrics()
+        if source.name not in self.copy_tables:
+            with metrics.time("select", source.name):
+                result = self.conn.execute(
+                    query.execution_options(
+                        stream_results=True,
+                        max_row_buffer=self.chunk_rows(source, chunk_size),
+                    )
+                )
+            if self.budget is None or not self.budget.limit:
+                partitions = result.partitions(chunk_size)
+            else:
+                # Every fetch is sized by the row width seen so far
+                partitions = iter(
+                    lambda: result.fetchmany(self.chunk_rows(source, chunk_size)), []
+                )
+            return metrics.timed(partitions, "select", source.name)
+        if self.conn.url.get_backend_name() != "postgresql":
+            raise exc.DbException("COPY extraction needs PostgreSQL")
+        buffer_bytes = ARCHIVE_COPY_BUFFER_BYTES
+        if self.budget is not None and self.budget.limit:
+            buffer_bytes = min(buffer_bytes, self.budget.chunk_bytes)
+        return metrics.timed(
+            copy_partitions(
+                self.conn, query, self.chunk_rows(source, chunk_size), buffer_bytes
+            ),
+            "select",
+            source.name,
+        )
+
+    def _fetchall(
+        self, source: o.ArchiveSource, query: sa.sql.Select
+    ) -> typing.Sequence[typing.Any]:
+        if source.name not in self.copy_tables:
+            with get_metrics().time("select", source.name):
+                return self.conn.execute(query).fetchall()
+        return list(
+            itertools.chain.from_iterable(
+                self._partitions(source, query, ARCHIVE_CHUNK_SIZE)
+            )
+        )
+
+    def fetch(self, source: o.ArchiveSource, owner: Owner, upto: typing.Any) -> Chunk:
+        resp = self._fetchall(source, self._select(source, owner, upto))
+        LOGGER.info(f"Collected {len(resp)} {source.name} rows.")
+        return self._load(source, owner, resp)
+
+    def stream(
+        self,
+        source: o.ArchiveSource,
+        owner: Owner,
+        upto: typing.Any,
+        chunk_size: int = ARCHIVE_CHUNK_SIZE,
+    ) -> typing.Iterator[Chunk]:
+        """Yield rows in chunks of ``chunk_size`` from a server side cursor, or
+        from COPY for tables in ``copy_tables``"""
+        query = self._select(source, owner, upto)
+        total = 0
+        for rows in self._partitions(source, query, chunk_size):
+            total += len(rows)
+            yield self._load(source, owner, rows)
+        LOGGER.info(f"Streamed {total} {source.name} rows.")
+
+    def plan(
+        self,
+        source: o.ArchiveSource,
+        upto: typing.Any,
+        owner_ids: typing.Optional[typing.Sequence[int]] = None,
+    ) -> typing.List[typing.Tuple[Owner, m.PendingRows]]:
+        """Owners with rows under the cutoff, with row count and cutoff range"""
+        query = (
+            sa.select(
+                [
+                    source.owner.label("owner_id"),
+                    source.owner_name.label("owner_name"),
+                    sa.func.count().label("rows"),
+                    sa.func.min(source.cutoff).label("first"),
+                    sa.func.max(source.cutoff).label("last"),
+                ]
+            )
+            .select_from(
+                source.table.join(
+                    source.owner_name.table,
+                    source.owner_name.table.c.id == source.owner,
+                )
+            )
+            .where(source.cutoff <= upto)
+            .group_by(source.owner, source.owner_name)
+        )
+        if owner_ids:
+            query = query.where(source.owner.in_(owner_ids))
         resp = self.conn.execute(query).fetchall()
-        LOGGER.info(f"Collected {len(resp)} sensor data")
+        LOGGER.info(f"{len(resp)} owners have {source.name} rows to archive")
         return [
-            m.SensorData(
-                id=item["id"],
-                sensor=sensor.sensor,
-                sensor_id=sensor.id,
-                user_plant_id=item["user_plant_id"],
-                timestamp=item["timestamp"],
-                temperature=item["temperature"],
-                humidity=item["humidity"],
-                moisture=item["moisture"],
-                light=item["light"],
-                moisture_voltage=item["moisture_voltage"],
-                location=item["location"],
+            (
+                source.make_owner(item["owner_id"], item["owner_name"]),
+                m.PendingRows(
+                    rows=item["rows"], first=item["first"], last=item["last"]
+                ),
             )
             for item in resp
         ]
 
-    def delete_sensor_data(self, sensor: m.Sensor, timestamp_upto: datetime):
-        query = sa.delete(o.sensor_readings_table).where(
-            sa.and_(
-                o.sensor_readings_table.c.sensor_id == sensor.id,
-                o.sensor_readings_table.c.timestamp <= timestamp_upto,
+    def stream_owners(
+        self,
+        source: o.ArchiveSource,
+        upto: typing.Any,
+        owner_ids: typing.Optional[typing.Sequence[int]] = None,
+        chunk_size: int = ARCHIVE_CHUNK_SIZE,
+        partition: typing.Optional[m.Partition] = None,
+    ) -> typing.Iterator[typing.Tuple[Owner, Chunk]]:
+        """Stream rows of every sensor/user plant with one query.
+
+        Rows come ordered by owner and are yielded as ``(owner, chunk)``
+        pairs, a chunk never mixing owners, so the number of queries depends
+        on the amount of data rather than on the number of owners. With a
+        ``partition`` the query is limited to its bounds, so only that
+        partition is scanned.
+        """
+        query = (
+            sa.select(
+                [
+                    *source.columns,
+                    source.owner.label("owner_id"),
+                    source.owner_name.label("owner_name"),
+                ]
+            )
+            .select_from(
+                source.table.join(
+                    source.owner_name.table,
+                    source.owner_name.table.c.id == source.owner,
+                )
             )
+            .where(source.cutoff <= upto)
+            .order_by(source.owner, source.cutoff, source.table.c.id)
         )
-        res = self.conn.execute(query)
-        LOGGER.info(
-            f"Deleted {getattr(res, 'rowcount')} sensor data rows for sensor: {sensor}. Upto {timestamp_upto}"
+        if owner_ids:
+            query = query.where(source.owner.in_(owner_ids))
+        if partition is not None:
+            query = query.where(*self._partition_clauses(source, partition))
+        owner, chunk, total = None, [], 0
+        for rows in self._partitions(source, query, chunk_size):
+            total += len(rows)
+            for item in rows:
+                values = dict(getattr(item, "_mapping", item))
+                owner_id = values.pop("owner_id")
+                owner_name = values.pop("owner_name")
+                if owner is None or owner.id != owner_id:
+                    if chunk:
+                        yield owner, self._load(source, owner, chunk)
+                        chunk = []
+                    owner = source.make_owner(owner_id, owner_name)
+                chunk.append(values)
+                if len(chunk) >= self.chunk_rows(source, chunk_size):
+                    yield owner, self._load(source, owner, chunk)
+                    chunk = []
+        if chunk:
+            yield owner, self._load(source, owner, chunk)
+        LOGGER.info(f"Streamed {total} {source.name} rows.")
+
+    def page(
+        self,
+        source: o.ArchiveSource,
+        owner: Owner,
+        upto: typing.Any,
+        after: typing.Optional[Keyset] = None,
+        limit: int = ARCHIVE_CHUNK_SIZE,
+    ) -> Chunk:
+        """Next ``limit`` rows ordered by (cutoff, id), starting after ``after``"""
+        query = self._select(source, owner, upto)
+        if after is not None:
+            query = query.where(sa.tuple_(source.cutoff, source.table.c.id) > after)
+        query = query.order_by(source.cutoff, source.table.c.id).limit(limit)
+        resp = self._fetchall(source, query)
+        return self._load(source, owner, resp)
+
+    @staticmethod
+    def keyset(source: o.ArchiveSource, item: m.Base) -> Keyset:
+        return getattr(item, source.cutoff.name), item.id
+
+    @contextlib.contextmanager
+    def move(
+        self,
+        source: o.ArchiveSource,
+        owner: Owner,
+        upto: typing.Any,
+        limit: int = ARCHIVE_CHUNK_SIZE,
+    ) -> typing.Iterator[Chunk]:
+        """Delete the next ``limit`` rows with RETURNING and yield them.
+
+        The delete is only committed when the ``with`` block exits cleanly, so
+        callers upload the yielded rows inside the block; any error rolls the
+        rows back into the table.
+        """
+        if self.conn.url.get_backend_name() != "postgresql":
+            raise exc.DbException("Move mode needs DELETE ... RETURNING (PostgreSQL)")
+        chunk = (
+            sa.select(source.table.c.id)
+            .where(
+                sa.and_(
+                    source.owner == owner.id,
+                    source.cutoff <= upto,
+                )
+            )
+            .order_by(source.cutoff, source.table.c.id)
+            .limit(limit)
+            .scalar_subquery()
+        )
+        query = (
+            sa.delete(source.table)
+            .where(source.table.c.id.in_(chunk))
+            .returning(*source.columns)
         )
+        with self.conn.begin():
+            with get_metrics().time("select", source.name):
+                resp = self.conn.execute(query).fetchall()
+            yield self._load(source, owner, resp)
 
-    def get_daily_data_summary(
-        self, sensor: m.Sensor, date_upto: date
-    ) -> typing.List[m.DailyDataSummary]:
-        query = sa.select(
-            [
-                o.daily_data_summary_table.c.id,
-                o.daily_data_summary_table.c.sensor_id,
-                o.daily_data_summary_table.c.user_plant_id,
-                o.daily_data_summary_table.c.date,
-                o.daily_data_summary_table.c.temperature,
-                o.daily_data_summary_table.c.humidity,
-                o.daily_data_summary_table.c.moisture,
-                o.daily_data_summary_table.c.light,
-                o.daily_data_summary_table.c.moisture_voltage,
-                o.daily_data_summary_table.c.location,
-            ]
-        ).where(
-            sa.and_(
-                o.daily_data_summary_table.c.sensor_id == sensor.id,
-                o.daily_data_summary_table.c.date <= date_upto,
+    def _ids_clause(self, source: o.ArchiveSource):
+        """``id = ANY(:ids)`` on Postgres so a batch is a single array parameter"""
+        if self.conn.url.get_backend_name() == "postgresql":
+            return source.table.c.id == sa.any_(
+                sa.bindparam("ids", type_=postgresql.ARRAY(sa.BigInteger()))
             )
+        return source.table.c.id.in_(sa.bindparam("ids", expanding=True))
+
+    def delete_ids(
+        self,
+        source: o.ArchiveSource,
+        ids: typing.Sequence[int],
+        batch_size: int = ARCHIVE_DELETE_BATCH_SIZE,
+    ) -> int:
+        """Delete exactly the given rows, one short transaction per batch"""
+        query = sa.delete(source.table).where(self._ids_clause(source))
+        deleted = 0
+        metrics = get_metrics()
+        for start in range(0, len(ids), batch_size):
+            with metrics.time("delete", source.name), self.conn.begin():
+                res = self.conn.execute(
+                    query, {"ids": list(ids[start : start + batch_size])}
+                )
+            deleted += getattr(res, "rowcount")
+        metrics.count("rows_deleted", source.name, deleted)
+        LOGGER.info(f"Deleted {deleted} of {len(ids)} {source.name} rows by id")
+        return deleted
+
+    @staticmethod
+    def _partition_clauses(
+        source: o.ArchiveSource, partition: m.Partition
+    ) -> typing.List[typing.Any]:
+        """Limit a query to the bounds of ``partition``, so only it is scanned"""
+        clauses = []
+        if partition.lower is not None:
+            clauses.append(source.cutoff >= partition.lower)
+        if partition.upper is not None:
+            clauses.append(source.cutoff < partition.upper)
+        return clauses
+
+    def delete_partition_rows(
+        self,
+        source: o.ArchiveSource,
+        partition: m.Partition,
+        upto: typing.Any,
+        last_ids: typing.Mapping[int, int],
+    ) -> int:
+        """Delete the rows of ``partition`` that were archived, those of each
+        owner in ``last_ids`` up to the cutoff and its last archived id, one
+        short transaction per owner"""
+        query = sa.delete(source.table).where(
+            source.owner == sa.bindparam("owner_id"),
+            source.cutoff <= upto,
+            source.table.c.id <= sa.bindparam("last_id"),
+            *self._partition_clauses(source, partition),
         )
-        resp = self.conn.execute(query).fetchall()
-        LOGGER.info(f"Collected {len(resp)} daily sensor data")
-        return [
-            m.DailyDataSummary(
-                id=item["id"],
-                sensor=sensor.sensor,
-                sensor_id=sensor.id,
-                user_plant_id=item["user_plant_id"],
-                date=item["date"],
-                temperature=item["temperature"],
-                humidity=item["humidity"],
-                moisture=item["moisture"],
-                light=item["light"],
-                location=item["location"],
+        deleted = 0
+        metrics = get_metrics()
+        for owner_id, last_id in last_ids.items():
+            with metrics.time("delete", source.name), self.conn.begin():
+                res = self.conn.execute(
+                    query, {"owner_id": owner_id, "last_id": last_id}
+                )
+            deleted += getattr(res, "rowcount")
+        metrics.count("rows_deleted", source.name, deleted)
+        LOGGER.info(
+            f"Deleted {deleted} {source.name} rows of {len(last_ids)} owners from "
+            f"{partition.name}"
+        )
+        return deleted
+
+    def partitions(self, source: o.ArchiveSource) -> typing.List[m.Partition]:
+        """Range partitions of the table when it is partitioned by its cutoff
+        column, empty otherwise"""
+        if self.conn.url.get_backend_name() != "postgresql":
+            return []
+        parent = f"{quote(source.table.schema or 'public')}.{quote(source.table.name)}"
+        key = self.conn.execute(
+            sa.text(
+                "SELECT pg_get_partkeydef(c.oid) FROM pg_class c"
+                " JOIN pg_partitioned_table p ON p.partrelid = c.oid"
+                " WHERE c.oid = CAST(:parent AS regclass)"
+            ),
+            {"parent": parent},
+        ).scalar()
+        if key is None or key.replace('"', "") != f"RANGE ({source.cutoff.name})":
+            return []
+        resp = self.conn.execute(
+            sa.text(
+                "SELECT n.nspname, c.relname, pg_get_expr(c.relpartbound, c.oid)"
+                " FROM pg_inherits i"
+                " JOIN pg_class c ON c.oid = i.inhrelid"
+                " JOIN pg_namespace n ON n.oid = c.relnamespace"
+                " WHERE i.inhparent = CAST(:parent AS regclass)"
+            ),
+            {"parent": parent},
+        ).fetchall()
+        partitions = []
+        for schema, name, bound in resp:
+            bounds = parse_range_bound(source, bound)
+            if bounds is not None:
+                partitions.append(
+                    m.Partition(f"{quote(schema)}.{quote(name)}", *bounds)
+                )
+        return sorted(
+            partitions, key=lambda partition: (partition.upper is None, partition.upper)
+        )
+
+    def drop_partition(
+        self, source: o.ArchiveSource, partition: m.Partition, rows: int
+    ) -> bool:
+        """Detach and drop ``partition`` if it still holds exactly the ``rows``
+        rows that were archived, under a lock so none can arrive meanwhile"""
+        parent = f"{quote(source.table.schema or 'public')}.{quote(source.table.name)}"
+        with self.conn.begin():
+            self.conn.execute(
+                sa.text(f"LOCK TABLE {partition.name} IN ACCESS EXCLUSIVE MODE")
             )
-            for item in resp
-        ]
+            count = self.conn.execute(
+                sa.text(f"SELECT count(*) FROM {partition.name}")
+            ).scalar()
+            if count != rows:
+                LOGGER.warning(
+                    f"{partition.name} holds {count} rows but {rows} were archived,"
+                    " deleting the archived rows instead"
+                )
+                return False
+            self.conn.execute(
+                sa.text(f"ALTER TABLE {parent} DETACH PARTITION {partition.name}")
+            )
+            self.conn.execute(sa.text(f"DROP TABLE {partition.name}"))
+        LOGGER.info(f"Dropped partition {partition.name} of {source.name}")
+        return True
 
-    def delete_daily_data_summary(self, sensor: m.Sensor, date_upto: date):
-        query = sa.delete(o.daily_data_summary_table).where(
+    def delete(self, source: o.ArchiveSource, owner: Owner, upto: typing.Any):
+        query = sa.delete(source.table).where(
             sa.and_(
-                o.daily_data_summary_table.c.sensor_id == sensor.id,
-                o.daily_data_summary_table.c.timestamp <= date_upto,
+                source.owner == owner.id,
+                source.cutoff <= upto,
             )
         )
-        res = self.conn.execute(query)
+        metrics = get_metrics()
+        with metrics.time("delete", source.name):
+            res = self.conn.execute(query)
+        metrics.count("rows_deleted", source.name, getattr(res, "rowcount"))
         LOGGER.info(
-            f"Deleted {getattr(res, 'rowcount')} daily data summary rows for sensor: {sensor}. Upto: {date_upto}"
+            f"Deleted {getattr(res, 'rowcount')} {source.name} rows for {owner}. Upto {upto}"
         )
+        return getattr(res, "rowcount")
+
+    def get_sensor_data(
+        self, sensor: m.Sensor, timestamp_upto: datetime
+    ) -> typing.List[m.SensorData]:
+        return self.fetch(o.sensor_data_source, sensor, timestamp_upto)
+
+    def stream_sensor_data(
+        self,
+        sensor: m.Sensor,
+        timestamp_upto: datetime,
+        chunk_size: int = ARCHIVE_CHUNK_SIZE,
+    ) -> typing.Iterator[typing.List[m.SensorData]]:
+        return self.stream(o.sensor_data_source, sensor, timestamp_upto, chunk_size)
+
+    def delete_sensor_data(self, sensor: m.Sensor, timestamp_upto: datetime):
+        return self.delete(o.sensor_data_source, sensor, timestamp_upto)
+
+    def get_daily_data_summary(
+        self, sensor: m.Sensor, date_upto: date
+    ) -> typing.List[m.DailyDataSummary]:
+        return self.fetch(o.daily_data_summary_source, sensor, date_upto)
+
+    def stream_daily_data_summary(
+        self,
+        sensor: m.Sensor,
+        date_upto: date,
+        chunk_size: int = ARCHIVE_CHUNK_SIZE,
+    ) -> typing.Iterator[typing.List[m.DailyDataSummary]]:
+        return self.stream(o.daily_data_summary_source, sensor, date_upto, chunk_size)
+
+    def delete_daily_data_summary(self, sensor: m.Sensor, date_upto: date):
+        return self.delete(o.daily_data_summary_source, sensor, date_upto)
 
     def get_user_plant_temperature_score(
         self, user_plant: m.UserPlant, timestamp_upto: datetime
     ) -> typing.List[m.UserPlantTemperatureScore]:
-        query = sa.select(
-            [
-                o.user_plant_temperature_score_table.c.id,
-                o.user_plant_temperature_score_table.c.timestamp,
-                o.user_plant_temperature_score_table.c.temperature_score,
-                o.user_plant_temperature_score_table.c.temperature_rolled_score,
-                o.user_plant_temperature_score_table.c.temperature_score_usable,
-            ]
-        ).where(
-            sa.and_(
-                o.user_plant_temperature_score_table.c.user_plant_id == user_plant.id,
-                o.user_plant_temperature_score_table.c.timestamp <= timestamp_upto,
-            )
+        return self.fetch(
+            o.user_plant_temperature_score_source, user_plant, timestamp_upto
+        )
+
+    def stream_user_plant_temperature_score(
+        self,
+        user_plant: m.UserPlant,
+        timestamp_upto: datetime,
+        chunk_size: int = ARCHIVE_CHUNK_SIZE,
+    ) -> typing.Iterator[typing.List[m.UserPlantTemperatureScore]]:
+        return self.stream(
+            o.user_plant_temperature_score_source,
+            user_plant,
+            timestamp_upto,
+            chunk_size,
         )
-        resp = self.conn.execute(query).fetchall()
-        LOGGER.info(f"Collected {len(resp)} temperature score.")
-        return [
-            m.UserPlantTemperatureScore(
-                id=item["id"],
-                user_plant=user_plant.personal_name,
-                user_plant_id=user_plant.id,
-                timestamp=item["timestamp"],
-                temperature_score=item["temperature_score"],
-                temperature_rolled_score=item["temperature_rolled_score"],
-                temperature_score_usable=item["temperature_rolled_usable"],
-            )
-            for item in resp
-        ]
 
     def delete_user_plant_temperature_score(
         self, user_plant: m.UserPlant, timestamp_upto: datetime
     ):
-        query = sa.delete(o.user_plant_temperature_score_table).where(
-            sa.and_(
-                o.user_plant_temperature_score_table.c.user_plant_id == user_plant.id,
-                o.user_plant_temperature_score_table.c.timestamp <= timestamp_upto,
-            )
-        )
-        res = self.conn.execute(query)
-        LOGGER.info(
-            f"Deleted {getattr(res, 'rowcount')} temperature score rows for user plant: {user_plant}. Upto {timestamp_upto}"
+        return self.delete(
+            o.user_plant_temperature_score_source, user_plant, timestamp_upto
         )
 
     def get_user_plant_humidity_score(
         self, user_plant: m.UserPlant, timestamp_upto: datetime
     ) -> typing.List[m.UserPlantHumidityScore]:
-        query = sa.select(
-            [
-                o.user_plant_humidity_score_table.c.id,
-                o.user_plant_humidity_score_table.c.timestamp,
-                o.user_plant_humidity_score_table.c.humidity_score,
-                o.user_plant_humidity_score_table.c.humidity_rolled_score,
-                o.user_plant_humidity_score_table.c.humidity_score_usable,
-            ]
-        ).where(
-            sa.and_(
-                o.user_plant_humidity_score_table.c.user_plant_id == user_plant.id,
-                o.user_plant_humidity_score_table.c.timestamp <= timestamp_upto,
-            )
+        return self.fetch(
+            o.user_plant_humidity_score_source, user_plant, timestamp_upto
+        )
+
+    def stream_user_plant_humidity_score(
+        self,
+        user_plant: m.UserPlant,
+        timestamp_upto: datetime,
+        chunk_size: int = ARCHIVE_CHUNK_SIZE,
+    ) -> typing.Iterator[typing.List[m.UserPlantHumidityScore]]:
+        return self.stream(
+            o.user_plant_humidity_score_source, user_plant, timestamp_upto, chunk_size
         )
-        resp = self.conn.execute(query).fetchall()
-        LOGGER.info(f"Collected {len(resp)} humidity score.")
-        return [
-            m.UserPlantHumidityScore(
-                id=item["id"],
-                user_plant=user_plant.personal_name,
-                user_plant_id=user_plant.id,
-                timestamp=item["timestamp"],
-                humidity_score=item["humidity_score"],
-                humidity_rolled_score=item["humidity_rolled_score"],
-                humidity_score_usable=item["humidity_rolled_usable"],
-            )
-            for item in resp
-        ]
 
     def delete_user_plant_humidity_score(
         self, user_plant: m.UserPlant, timestamp_upto: datetime
     ):
-        query = sa.delete(o.user_plant_humidity_score_table).where(
-            sa.and_(
-                o.user_plant_humidity_score_table.c.user_plant_id == user_plant.id,
-                o.user_plant_humidity_score_table.c.timestamp <= timestamp_upto,
-            )
-        )
-        res = self.conn.execute(query)
-        LOGGER.info(
-            f"Deleted {getattr(res, 'rowcount')} humidity score rows for user plant: {user_plant}. Upto {timestamp_upto}"
+        return self.delete(
+            o.user_plant_humidity_score_source, user_plant, timestamp_upto
         )
 
     def get_user_plant_light_score(
         self, user_plant: m.UserPlant, timestamp_upto: datetime
     ) -> typing.List[m.UserPlantLightScore]:
-        query = sa.select(
-            [
-                o.user_plant_light_score_table.c.id,
-                o.user_plant_light_score_table.c.timestamp,
-                o.user_plant_light_score_table.c.light_score,
-                o.user_plant_light_score_table.c.light_rolled_score,
-                o.user_plant_light_score_table.c.light_score_usable,
-            ]
-        ).where(
-            sa.and_(
-                o.user_plant_light_score_table.c.user_plant_id == user_plant.id,
-                o.user_plant_light_score_table.c.timestamp <= timestamp_upto,
-            )
+        return self.fetch(o.user_plant_light_score_source, user_plant, timestamp_upto)
+
+    def stream_user_plant_light_score(
+        self,
+        user_plant: m.UserPlant,
+        timestamp_upto: datetime,
+        chunk_size: int = ARCHIVE_CHUNK_SIZE,
+    ) -> typing.Iterator[typing.List[m.UserPlantLightScore]]:
+        return self.stream(
+            o.user_plant_light_score_source, user_plant, timestamp_upto, chunk_size
         )
-        resp = self.conn.execute(query).fetchall()
-        LOGGER.info(f"Collected {len(resp)} light score.")
-        return [
-            m.UserPlantLightScore(
-                id=item["id"],
-                user_plant=user_plant.personal_name,
-                user_plant_id=user_plant.id,
-                timestamp=item["timestamp"],
-                light_score=item["light_score"],
-                light_rolled_score=item["light_rolled_score"],
-                light_score_usable=item["light_rolled_usable"],
-            )
-            for item in resp
-        ]
 
     def delete_user_plant_light_score(
         self, user_plant: m.UserPlant, timestamp_upto: datetime
     ):
-        query = sa.delete(o.user_plant_light_score_table).where(
-            sa.and_(
-                o.user_plant_light_score_table.c.user_plant_id == user_plant.id,
-                o.user_plant_light_score_table.c.timestamp <= timestamp_upto,
-            )
-        )
-        res = self.conn.execute(query)
-        LOGGER.info(
-            f"Deleted {getattr(res, 'rowcount')} light score rows for user plant: {user_plant}. Upto {timestamp_upto}"
-        )
+        return self.delete(o.user_plant_light_score_source, user_plant, timestamp_upto)
 
     def get_user_plant_moisture_score(
         self, user_plant: m.UserPlant, timestamp_upto: datetime
     ) -> typing.List[m.UserPlantMoistureScore]:
-        query = sa.select(
-            [
-                o.user_plant_moisture_score_table.c.id,
-                o.user_plant_moisture_score_table.c.timestamp,
-                o.user_plant_moisture_score_table.c.moisture_score,
-                o.user_plant_moisture_score_table.c.moisture_rolled_score,
-                o.user_plant_moisture_score_table.c.moisture_score_usable,
-            ]
-        ).where(
-            sa.and_(
-                o.user_plant_moisture_score_table.c.user_plant_id == user_plant.id,
-                o.user_plant_moisture_score_table.c.timestamp <= timestamp_upto,
-            )
+        return self.fetch(
+            o.user_plant_moisture_score_source, user_plant, timestamp_upto
+        )
+
+    def stream_user_plant_moisture_score(
+        self,
+        user_plant: m.UserPlant,
+        timestamp_upto: datetime,
+        chunk_size: int = ARCHIVE_CHUNK_SIZE,
+    ) -> typing.Iterator[typing.List[m.UserPlantMoistureScore]]:
+        return self.stream(
+            o.user_plant_moisture_score_source, user_plant, timestamp_upto, chunk_size
         )
-        resp = self.conn.execute(query).fetchall()
-        LOGGER.info(f"Collected {len(resp)} moisture score.")
-        return [
-            m.UserPlantMoistureScore(
-                id=item["id"],
-                user_plant=user_plant.personal_name,
-                user_plant_id=user_plant.id,
-                timestamp=item["timestamp"],
-                moisture_score=item["moisture_score"],
-                moisture_rolled_score=item["moisture_rolled_score"],
-                moisture_score_usable=item["moisture_rolled_usable"],
-            )
-            for item in resp
-        ]
 
     def delete_user_plant_moisture_score(
         self, user_plant: m.UserPlant, timestamp_upto: datetime
     ):
-        query = sa.delete(o.user_plant_moisture_score_table).where(
-            sa.and_(
-                o.user_plant_moisture_score_table.c.user_plant_id == user_plant.id,
-                o.user_plant_moisture_score_table.c.timestamp <= timestamp_upto,
-            )
-        )
-        res = self.conn.execute(query)
-        LOGGER.info(
-            f"Deleted {getattr(res, 'rowcount')} moisture score rows for user plant: {user_plant}. Upto {timestamp_upto}"
+        return self.delete(
+            o.user_plant_moisture_score_source, user_plant, timestamp_upto
         )
 
     def get_user_plant_score(
         self, user_plant: m.UserPlant, timestamp_upto: datetime
     ) -> typing.List[m.UserPlantScore]:
-        query = sa.select(
-            [
-                o.user_plant_score_table.c.id,
-                o.user_plant_score_table.c.timestamp,
-                o.user_plant_score_table.c.score,
-                o.user_plant_score_table.c.rolled_score,
-                o.user_plant_score_table.c.score_usable,
-            ]
-        ).where(
-            sa.and_(
-                o.user_plant_score_table.c.user_plant_id == user_plant.id,
-                o.user_plant_score_table.c.timestamp <= timestamp_upto,
-            )
+        return self.fetch(o.user_plant_score_source, user_plant, timestamp_upto)
+
+    def stream_user_plant_score(
+        self,
+        user_plant: m.UserPlant,
+        timestamp_upto: datetime,
+        chunk_size: int = ARCHIVE_CHUNK_SIZE,
+    ) -> typing.Iterator[typing.List[m.UserPlantScore]]:
+        return self.stream(
+            o.user_plant_score_source, user_plant, timestamp_upto, chunk_size
         )
-        resp = self.conn.execute(query).fetchall()
-        LOGGER.info(f"Collected {len(resp)} score.")
-        return [
-            m.UserPlantScore(
-                id=item["id"],
-                user_plant=user_plant.personal_name,
-                user_plant_id=user_plant.id,
-                timestamp=item["timestamp"],
-                score=item["score"],
-                rolled_score=item["rolled_score"],
-                score_usable=item["rolled_usable"],
-            )
-            for item in resp
-        ]
 
     def delete_user_plant_score(
         self, user_plant: m.UserPlant, timestamp_upto: datetime
     ):
-        query = sa.delete(o.user_plant_score_table).where(
-            sa.and_(
-                o.user_plant_score_table.c.user_plant_id == user_plant.id,
-                o.user_plant_score_table.c.timestamp <= timestamp_upto,
-            )
-        )
-        res = self.conn.execute(query)
-        LOGGER.info(
-            f"Deleted {getattr(res, 'rowcount')} plant score rows for user plant: {user_plant}. Upto {timestamp_upto}"
-        )
+        return self.delete(o.user_plant_score_source, user_plant, timestamp_upto)
@@ -0,0 +1,49 @@
+import typing
+from mypy_boto3_dynamodb.service_resource import DynamoDBServiceResource
+from core import exceptions as exc
+from core.dynamo import PreparedChunk, WriteResult
+from core.settings import get_s3_client
+from migrator.adapters import orm as o
+from migrator.domain.columnar import Chunk
+from migrator.repository.dynamodb import DynamoRepo
+from migrator.repository.files import FileSink
+from migrator.repository.spool import SpoolSink
+
+
+class ArchiveSink(typing.Protocol):
+    """Where archived rows go; rows are deleted once ``save`` returns"""
+
+    def save(self, source: o.ArchiveSource, data: Chunk) -> WriteResult:
+        ...
+
+    def prepare(self, source: o.ArchiveSource, data: Chunk) -> PreparedChunk:
+        """Serialize a chunk without writing it, ``write`` then does what
+        ``save`` would have"""
+        ...
+
+    def write(self, prepared: PreparedChunk) -> WriteResult:
+        ...
+
+    def close(self) -> None:
+        ...
+
+
+def get_archive_sink(
+    url: str,
+    dynamo_resource: DynamoDBServiceResource,
+    file_format: str = "ndjson",
+    spool: str = "",
+    **dynamo_options,
+) -> ArchiveSink:
+    """Sink for ``url``, see ARCHIVE_SINK in core.settings, spooled to the
+    ``spool`` directory first when there is one"""
+    sink: ArchiveSink
+    if url == "dynamodb":
+        sink = DynamoRepo(dynamo_resource, **dynamo_options)
+    elif url.startswith("file://"):
+        sink = FileSink(url[len("file://") :], file_format)
+    elif url.startswith("s3://"):
+        sink = FileSink(url, file_format, s3_client=get_s3_client())
+    else:
+        raise exc.WillowException(f"Invalid archive sink: {url}")
+    return SpoolSink(sink, spool) if spool else sink
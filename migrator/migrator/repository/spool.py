@@ -0,0 +1,404 @@
+import fcntl
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import typing
+import zlib
+from collections import deque
+from datetime import date, datetime
+from decimal import Decimal
+from core import exceptions as exc
+from core.dynamo import PreparedChunk, WriteResult
+from core.metrics import get_metrics
+from core.settings import ARCHIVE_SPOOL_MAX_BYTES, ARCHIVE_SPOOL_SEGMENT_BYTES
+from core.utils.durable import fsync_directory
+from migrator.adapters import orm as o
+from migrator.domain import packed
+from migrator.domain.columnar import Chunk, SensorDataBatch
+
+
+LOGGER = logging.getLogger(__name__)
+
+# A segment is this marker, which versions the format, followed by records
+# of <payload length><crc32 of the payload><payload>, little endian.
+#
+# A payload is a JSON header (length as uint32) naming the table, the
+# format of the rows and their fields, then the rows: sensor_data batches
+# as packed.encode stores them, other chunks zlib compressed row by row,
+# every value a type tag and its value. Rows are rebuilt from the field
+# names, so a model that changed since they were spooled fails loudly
+# instead of loading values into the wrong fields.
+MAGIC = b"WILLOWSPOOL2\n"
+_HEADER = struct.Struct("<II")
+_LENGTH = struct.Struct("<I")
+_INT = struct.Struct("<q")
+_FLOAT = struct.Struct("<d")
+SUFFIX = ".spool"
+_SOURCES = {source.name: source for source in o.sensor_sources + o.user_plant_sources}
+# Value tags
+_NONE, _FALSE, _TRUE, _INTEGER, _REAL, _TEXT, _DATETIME, _DATE, _DECIMAL = range(9)
+_TEXT_TAGS = {
+    _TEXT: str,
+    _DATETIME: datetime.fromisoformat,
+    _DATE: date.fromisoformat,
+    _DECIMAL: Decimal,
+}
+
+
+def _encode_value(value: typing.Any, out: bytearray):
+    if value is None:
+        out.append(_NONE)
+    elif value is True or value is False:
+        out.append(_TRUE if value else _FALSE)
+    elif isinstance(value, int):
+        out.append(_INTEGER)
+        out += _INT.pack(value)
+    elif isinstance(value, float):
+        out.append(_REAL)
+        out += _FLOAT.pack(value)
+    else:
+        if isinstance(value, str):
+            tag, text = _TEXT, value
+        elif isinstance(value, datetime):
+            tag, text = _DATETIME, value.isoformat()
+        elif isinstance(value, date):
+            tag, text = _DATE, value.isoformat()
+        elif isinstance(value, Decimal):
+            tag, text = _DECIMAL, str(value)
+        else:
+            raise exc.WillowException(
+                f"Can't spool values of type {type(value).__name__}"
+            )
+        raw = text.encode()
+        out.append(tag)
+        out += _LENGTH.pack(len(raw))
+        out += raw
+
+
+def _decode_values(raw: bytes, count: int) -> typing.Iterator[typing.Any]:
+    offset = 0
+    for _ in range(count):
+        tag = raw[offset]
+        offset += 1
+        if tag == _NONE:
+            yield None
+        elif tag in (_FALSE, _TRUE):
+            yield tag == _TRUE
+        elif tag == _INTEGER:
+            yield _INT.unpack_from(raw, offset)[0]
+            offset += _INT.size
+        elif tag == _REAL:
+            yield _FLOAT.unpack_from(raw, offset)[0]
+            offset += _FLOAT.size
+        elif tag in _TEXT_TAGS:
+            (length,) = _LENGTH.unpack_from(raw, offset)
+            offset += _LENGTH.size
+            yield _TEXT_TAGS[tag](raw[offset : offset + length].decode())
+            offset += length
+        else:
+            raise exc.WillowException(f"Unknown spooled value tag {tag}")
+
+
+def encode(source: o.ArchiveSource, data: Chunk) -> bytes:
+    if isinstance(data, SensorDataBatch):
+        header = {"table": source.name, "format": "packed", "rows": len(data)}
+        body = packed.encode(data)
+    else:
+        names = list(source.model.__dataclass_fields__)
+        header = {
+            "table": source.name,
+            "format": "rows",
+            "rows": len(data),
+            "fields": names,
+        }
+        out = bytearray()
+        for row in data:
+            for name in names:
+                _encode_value(getattr(row, name), out)
+        body = zlib.compress(out, 1)
+    raw = json.dumps(header).encode()
+    return _LENGTH.pack(len(raw)) + raw + body
+
+
+def decode(payload: bytes) -> typing.Tuple[o.ArchiveSource, Chunk]:
+    (length,) = _LENGTH.unpack_from(payload)
+    header = json.loads(payload[_LENGTH.size : _LENGTH.size + length])
+    body = payload[_LENGTH.size + length :]
+    source = _SOURCES.get(header["table"])
+    if source is None:
+        raise exc.WillowException(f"Spooled rows of unknown table {header['table']}")
+    if header["format"] == "packed":
+        return source, packed.decode(body)
+    if header["format"] != "rows":
+        raise exc.WillowException(f"Unknown spooled row format {header['format']}")
+    names = header["fields"]
+    if set(names) != set(source.model.__dataclass_fields__):
+        raise exc.WillowException(
+            f"Spooled {source.name} rows have fields {names}, "
+            f"{source.model.__name__} has {list(source.model.__dataclass_fields__)}"
+        )
+    values = _decode_values(zlib.decompress(body), header["rows"] * len(names))
+    return source, [
+        source.model(**dict(zip(names, row))) for row in zip(*[values] * len(names))
+    ]
+
+
+def read_records(buffer: typing.Union[bytes, mmap.mmap]) -> typing.Iterator[bytes]:
+    """Payloads of a segment up to its end.
+
+    A crash while appending leaves a torn last record behind, which was
+    never acknowledged and is skipped. A bad record anywhere else is
+    corruption of acknowledged chunks, whose rows are already deleted, so it
+    raises and the segment stays on disk.
+    """
+    if buffer[: len(MAGIC)] != MAGIC:
+        raise exc.WillowException("Not a spool segment")
+    offset = len(MAGIC)
+    while offset + _HEADER.size <= len(buffer):
+        length, checksum = _HEADER.unpack_from(buffer, offset)
+        start = offset + _HEADER.size
+        payload = buffer[start : start + length]
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            if start + length >= len(buffer):
+                LOGGER.warning(f"Ignoring torn spool record at offset {offset}")
+                return
+            raise exc.WillowException(
+                f"Corrupt spool record at offset {offset} of {len(buffer)} bytes"
+            )
+        yield payload
+        offset = start + length
+
+
+class Segment:
+    """A spool file and the descriptor holding an exclusive lock on it until
+    it is uploaded and removed, so no other process replays it meanwhile"""
+
+    __slots__ = ("path", "fd", "size")
+
+    def __init__(self, path: str, fd: int, size: int):
+        self.path = path
+        self.fd = fd
+        self.size = size
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes of the records in the segment"""
+        return max(0, self.size - len(MAGIC))
+
+    @classmethod
+    def create(cls, directory: str, sequence: int) -> "Segment":
+        name = f"{time.time_ns():020d}-{os.getpid()}-{sequence:06d}"
+        # Locked under a name replays skip, then moved in place
+        temporary = os.path.join(directory, f".{name}")
+        fd = os.open(temporary, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        os.write(fd, MAGIC)
+        path = os.path.join(directory, name + SUFFIX)
+        os.rename(temporary, path)
+        # Chunks are acknowledged once their record is fsynced, by then the
+        # segment has to be found under its final name after a crash
+        fsync_directory(directory)
+        return cls(path, fd, len(MAGIC))
+
+    def records(self) -> typing.Iterator[bytes]:
+        with open(self.path, "rb") as segment:
+            if os.fstat(segment.fileno()).st_size < len(MAGIC):
+                return
+            with mmap.mmap(segment.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                yield from read_records(buffer)
+
+    def remove(self):
+        os.unlink(self.path)
+        os.close(self.fd)
+
+    def release(self):
+        """Leave the segment for another process or a later run"""
+        os.close(self.fd)
+
+
+def claim_segments(directory: str) -> typing.List[Segment]:
+    """Segments in ``directory`` that no running process holds, oldest first,
+    locked for the caller"""
+    segments = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(SUFFIX):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            continue
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            continue
+        stat = os.fstat(fd)
+        # Uploaded and removed by its owner since it was listed
+        if not stat.st_nlink:
+            os.close(fd)
+            continue
+        segments.append(Segment(path, fd, stat.st_size))
+    return segments
+
+
+class SpoolSink:
+    """Acknowledges chunks once they are appended to a local spool and
+    uploads them to ``sink`` from there on a thread of its own.
+
+    ``save`` returns as soon as the chunk is fsynced to the current segment,
+    so rows are deleted from Postgres without waiting for DynamoDB. The
+    uploader takes segments oldest first, sealing the current one whenever
+    it runs out of work, reads them through mmap and removes each once all
+    its chunks are written; at most ``max_bytes`` wait on disk, beyond that
+    ``save`` blocks. Segments left behind by a crash are claimed and
+    uploaded first, chunks being written at least once. Should an upload
+    fail, the uploader stops, ``save`` raises so no more rows are deleted,
+    and the spooled chunks stay on disk for the next run or a replay.
+    """
+
+    def __init__(
+        self,
+        sink,
+        directory: str,
+        segment_bytes: int = ARCHIVE_SPOOL_SEGMENT_BYTES,
+        max_bytes: int = ARCHIVE_SPOOL_MAX_BYTES,
+    ):
+        os.makedirs(directory, exist_ok=True)
+        fsync_directory(os.path.dirname(os.path.abspath(directory)))
+        self.sink = sink
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.error: typing.Optional[Exception] = None
+        self.stats = {"spooled": 0, "spooled_bytes": 0, "replayed": 0, "uploaded": 0}
+        self._cond = threading.Condition()
+        self._segment: typing.Optional[Segment] = None
+        self._sealed: typing.Deque[Segment] = deque(claim_segments(directory))
+        self._sequence = 0
+        self._closed = False
+        # Bytes spooled and not yet uploaded
+        self._pending = sum(segment.nbytes for segment in self._sealed)
+        self.stats["replayed"] = len(self._sealed)
+        if self._sealed:
+            LOGGER.info(
+                f"Replaying {len(self._sealed)} spool segments ({self._pending} "
+                f"bytes) left in {directory}"
+            )
+        self._uploader = threading.Thread(
+            target=self._upload, name="spool-uploader", daemon=True
+        )
+        self._uploader.start()
+
+    def _seal(self):
+        if self._segment is not None and self._segment.nbytes:
+            self._sealed.append(self._segment)
+            self._segment = None
+
+    def _append(self, table: str, payload: bytes):
+        record = _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self.error is not None
+                or not self._pending
+                or self._pending + len(record) <= self.max_bytes
+            )
+            if self.error is not None:
+                raise exc.DbException(f"Spool upload failed: {self.error}")
+            if self._segment is None:
+                self._segment = Segment.create(self.directory, self._sequence)
+                self._sequence += 1
+            os.write(self._segment.fd, record)
+            os.fsync(self._segment.fd)
+            self._segment.size += len(record)
+            self._pending += len(record)
+            self.stats["spooled"] += 1
+            self.stats["spooled_bytes"] += len(record)
+            if self._segment.size >= self.segment_bytes:
+                self._seal()
+            self._cond.notify_all()
+        get_metrics().count("spool_bytes", table, len(record))
+
+    def _upload(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._sealed or self._segment is not None or self._closed
+                )
+                if not self._sealed:
+                    # Idle, so whatever is spooled so far goes next
+                    self._seal()
+                if not self._sealed:
+                    return
+                segment = self._sealed.popleft()
+            try:
+                for payload in segment.records():
+                    source, data = decode(payload)
+                    written = self.sink.save(source, data).written
+                    with self._cond:
+                        self.stats["uploaded"] += written
+            except Exception as e:
+                LOGGER.error(
+                    f"Uploading spool segment {segment.path} failed, it stays for "
+                    f"a replay: {str(e)}"
+                )
+                with self._cond:
+                    self.error = e
+                    self._sealed.appendleft(segment)
+                    self._cond.notify_all()
+                return
+            segment.remove()
+            with self._cond:
+                self._pending -= segment.nbytes
+                self._cond.notify_all()
+
+    def prepare(self, source: o.ArchiveSource, data: Chunk) -> PreparedChunk:
+        with get_metrics().time("spool", source.name):
+            payload = encode(source, data)
+        return PreparedChunk(source.name, len(data), [payload], nbytes=len(payload))
+
+    def write(self, prepared: PreparedChunk) -> WriteResult:
+        with get_metrics().time("spool", prepared.table):
+            for payload in prepared.items:
+                self._append(prepared.table, payload)
+        return WriteResult(written=prepared.rows, requests=len(prepared.items))
+
+    def save(self, source: o.ArchiveSource, data: Chunk) -> WriteResult:
+        """Spool a chunk, ``written`` counting rows that are safe to delete"""
+        if not len(data):
+            return WriteResult()
+        return self.write(self.prepare(source, data))
+
+    def close(self):
+        """Upload everything spooled, then close the sink"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._uploader.join()
+        self.sink.close()
+        if self.error is None:
+            return
+        LOGGER.error(
+            f"{self._pending} spooled bytes are left in {self.directory} for a "
+            f"replay"
+        )
+        self._seal()
+        while self._sealed:
+            self._sealed.popleft().release()
+        if self._segment is not None:
+            # Never written to, so nothing to replay
+            self._segment.remove()
+            self._segment = None
+
+    def report(self) -> typing.Dict[str, typing.Any]:
+        with self._cond:
+            return {
+                "directory": self.directory,
+                **self.stats,
+                "pending_bytes": self._pending,
+                "error": None if self.error is None else str(self.error),
+            }
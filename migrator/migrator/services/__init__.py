@@ -1,86 +1,871 @@
 import logging
+import time
 import typing
+import uuid
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, fields
 from datetime import datetime
-from core.settings import PostgresDatabase, dynamodb_resource
-from migrator.repository.postgres import SqlRepo
-from migrator.repository.dynamodb import DynamoRepo
+from core import exceptions as exc
+from core.settings import (
+    ARCHIVE_CHECKPOINT,
+    ARCHIVE_CHUNK_SIZE,
+    ARCHIVE_DELETE_BATCH_SIZE,
+    ARCHIVE_DROP_PARTITIONS,
+    ARCHIVE_FILE_FORMAT,
+    ARCHIVE_MEMORY_BUDGET_BYTES,
+    ARCHIVE_METRICS,
+    ARCHIVE_METRICS_NAMESPACE,
+    ARCHIVE_MODE,
+    ARCHIVE_PIPELINE_QUEUE_DEPTH,
+    ARCHIVE_PIPELINE_WRITERS,
+    ARCHIVE_SINK,
+    ARCHIVE_SPOOL_DIR,
+    ARCHIVE_WORKERS,
+    DATABASE_POOL_SIZE,
+    PostgresDatabase,
+    dynamodb_resource,
+)
+from core.dynamo import WriteResult
+from core.metrics import get_exporters, get_metrics, recording
+from core.utils.budget import MemoryBudget
+from core.utils.deadline import Deadline
+from migrator.adapters import orm as o
+from migrator.domain import models as m
+from migrator.domain.columnar import Chunk, row_ids
+from migrator.repository.checkpoint import CheckpointRepo, get_checkpoint_repo
+from migrator.repository.postgres import Keyset, Owner, SqlRepo
+from migrator.repository.sink import ArchiveSink, get_archive_sink
+from migrator.repository.spool import SpoolSink
+from migrator.services.pipeline import ArchivePipeline, PipelineConfig, PipelineTask
+from migrator.services.planning import ArchivePlan, build_plan
 
 
 LOGGER = logging.getLogger(__name__)
 
 
+ARCHIVE_MODES = ("stream", "chunked", "move", "bulk", "pipeline")
+
+
+@dataclass(slots=True)
+class ArchiveOptions:
+    mode: str = ARCHIVE_MODE
+    chunk_size: int = ARCHIVE_CHUNK_SIZE
+    workers: int = ARCHIVE_WORKERS
+    write_concurrency: typing.Optional[int] = None
+    write_queue_depth: typing.Optional[int] = None
+    checkpoint: str = ARCHIVE_CHECKPOINT
+    sink: str = ARCHIVE_SINK
+    file_format: str = ARCHIVE_FILE_FORMAT
+    # Directory chunks are spooled to before rows are deleted, "" for none
+    spool: str = ARCHIVE_SPOOL_DIR
+    # Tables written as packed items, ARCHIVE_PACKED_TABLES when not given
+    packed_tables: typing.Optional[typing.List[str]] = None
+    # Tables read with COPY, ARCHIVE_COPY_TABLES when not given
+    copy_tables: typing.Optional[typing.List[str]] = None
+    drop_partitions: bool = ARCHIVE_DROP_PARTITIONS
+    # Pipeline mode writer threads and queue depth, ``workers`` threads read
+    pipeline_writers: int = ARCHIVE_PIPELINE_WRITERS
+    pipeline_queue_depth: int = ARCHIVE_PIPELINE_QUEUE_DEPTH
+    metrics: str = ARCHIVE_METRICS
+    # Bytes of rows held in memory at once, 0 to only measure them
+    memory_budget: int = ARCHIVE_MEMORY_BUDGET_BYTES
+    # Passing the run id of an interrupted run resumes it
+    run_id: typing.Optional[str] = None
+
+    def __post_init__(self):
+        if self.mode not in ARCHIVE_MODES:
+            raise exc.WillowException(f"Invalid archive mode: {self.mode}")
+        if self.workers > DATABASE_POOL_SIZE:
+            LOGGER.warning(
+                f"Limiting {self.workers} archive workers to database pool size "
+                f"{DATABASE_POOL_SIZE}"
+            )
+            self.workers = DATABASE_POOL_SIZE
+
+    @classmethod
+    def from_event(cls, event: typing.Dict[str, typing.Any]) -> "ArchiveOptions":
+        """Options overridden by the keys of a Lambda event"""
+        return cls(
+            **{
+                option.name: event[option.name]
+                for option in fields(cls)
+                if event.get(option.name) is not None
+            }
+        )
+
+
+@dataclass(slots=True)
+class ArchiveContext:
+    """What every sensor/user plant of a run shares"""
+
+    timestamp_upto: datetime
+    options: ArchiveOptions
+    sink: ArchiveSink
+    run_id: str
+    checkpoints: typing.Optional[CheckpointRepo] = None
+    deadline: typing.Optional[Deadline] = None
+    # Chunked mode keysets by "table#owner_id" of tables stopped halfway, as
+    # handed in by the previous invocation and updated as chunks are moved
+    watermarks: typing.Dict[str, typing.List[typing.Any]] = field(default_factory=dict)
+    # Chunks read and not yet written are held against it
+    budget: MemoryBudget = field(default_factory=MemoryBudget)
+
+    @property
+    def expired(self) -> bool:
+        return self.deadline is not None and self.deadline.expired
+
+
+@dataclass(slots=True)
+class ArchiveSummary:
+    """Rows moved per table, keyed by sensor / user plant id"""
+
+    run_id: typing.Optional[str] = None
+    sensors: typing.Dict[int, typing.Dict[str, int]] = field(default_factory=dict)
+    user_plants: typing.Dict[int, typing.Dict[str, int]] = field(default_factory=dict)
+    failed_sensors: typing.List[int] = field(default_factory=list)
+    failed_user_plants: typing.List[int] = field(default_factory=list)
+    # Rows the plan expected per entity, empty in bulk mode
+    planned: typing.Dict[str, typing.Dict[int, int]] = field(default_factory=dict)
+    # Set when the run stopped at its deadline, the remaining lists and
+    # watermarks are what a continuation has to pick up (None meaning all)
+    complete: bool = True
+    remaining_sensors: typing.Optional[typing.List[int]] = field(default_factory=list)
+    remaining_user_plants: typing.Optional[typing.List[int]] = field(
+        default_factory=list
+    )
+    watermarks: typing.Dict[str, typing.List[typing.Any]] = field(default_factory=dict)
+    # Partitions dropped per table after being archived whole
+    partitions: typing.Dict[str, typing.List[str]] = field(default_factory=dict)
+    # Pipeline mode: the stage configuration and where each stage spent its
+    # time, see migrator.services.pipeline.StageStats
+    pipeline: typing.Dict[str, typing.Any] = field(default_factory=dict)
+    # Peak bytes of rows in memory and waits for the budget, see MemoryBudget
+    memory: typing.Dict[str, typing.Any] = field(default_factory=dict)
+    # Chunks spooled, replayed and uploaded, see SpoolSink
+    spool: typing.Dict[str, typing.Any] = field(default_factory=dict)
+
+    @property
+    def rows(self) -> int:
+        return sum(
+            sum(moved.values())
+            for moved in [*self.sensors.values(), *self.user_plants.values()]
+        )
+
+
 def archive_data(
     timestamp_upto: datetime,
     selected_sensors: typing.Optional[typing.List[int]] = None,
     selected_user_plants: typing.Optional[typing.List[int]] = None,
-):
-    LOGGER.info("Starting migrating data")
-    date_upto = timestamp_upto.date()
-    dynamo_repo = DynamoRepo(dynamodb_resource)
-    with PostgresDatabase() as conn:
-        postgres_repo = SqlRepo(conn)
-        sensors = postgres_repo.get_sensors()
-    for sensor in sensors:
-        if selected_sensors and sensor.id not in selected_sensors:
-            LOGGER.info(f"Skipping sensor: {sensor}")
-            continue
+    options: typing.Optional[ArchiveOptions] = None,
+    deadline: typing.Optional[Deadline] = None,
+    watermarks: typing.Optional[typing.Dict[str, typing.List[typing.Any]]] = None,
+    exact_selection: bool = False,
+) -> ArchiveSummary:
+    """Archive the selected sensors/user plants, ``None`` or an empty list
+    selecting all of them. With ``exact_selection`` an empty list selects
+    none, which continuations and shards of a run need.
+
+    Once ``deadline`` expires the run stops at the next chunk boundary and
+    the summary lists what is left, see ``ArchiveSummary.complete``. Stage
+    timings and counters of the run go to the ``options.metrics`` exporters.
+    """
+    options = options or ArchiveOptions()
+    if not exact_selection:
+        selected_sensors = selected_sensors or None
+        selected_user_plants = selected_user_plants or None
+    exporters = get_exporters(options.metrics, ARCHIVE_METRICS_NAMESPACE)
+    sink = get_archive_sink(
+        options.sink,
+        dynamodb_resource,
+        file_format=options.file_format,
+        spool=options.spool,
+        concurrency=options.write_concurrency,
+        queue_depth=options.write_queue_depth,
+        packed=options.packed_tables,
+    )
+    context = ArchiveContext(
+        timestamp_upto=timestamp_upto,
+        options=options,
+        sink=sink,
+        run_id=options.run_id or uuid.uuid4().hex,
+        checkpoints=get_checkpoint_repo(options.checkpoint, dynamodb_resource),
+        deadline=deadline,
+        watermarks=dict(watermarks or {}),
+        budget=MemoryBudget(
+            options.memory_budget, items_held=options.mode == "pipeline"
+        ),
+    )
+    with recording() as metrics:
         try:
-            with PostgresDatabase() as conn:
-                postgres_repo = SqlRepo(conn)
-                LOGGER.info(f"Working on {sensor.sensor} for sensor data")
-                data = postgres_repo.get_sensor_data(sensor, timestamp_upto)
-                dynamo_repo.save_sensor_data(data)
-                postgres_repo.delete_sensor_data(sensor, timestamp_upto)
-                LOGGER.info(f"Working on {sensor.sensor} for daily sensor data")
-                daily_data = postgres_repo.get_daily_data_summary(sensor, date_upto)
-                dynamo_repo.save_daily_sensor_data(daily_data)
-                postgres_repo.delete_daily_data_summary(sensor, date_upto)
-        except Exception as e:
-            LOGGER.error(f"Error Archiving sensor: {sensor}: {str(e)}")
-    with PostgresDatabase() as conn:
-        postgres_repo = SqlRepo(conn)
-        user_plants = postgres_repo.get_user_plants()
-    for user_plant in user_plants:
-        if selected_user_plants and user_plant.id not in selected_user_plants:
-            continue
+            summary = _archive_data(context, selected_sensors, selected_user_plants)
+        finally:
+            sink.close()
+    if isinstance(sink, SpoolSink):
+        summary.spool = sink.report()
+    summary.memory = context.budget.report()
+    LOGGER.info(
+        f"Held at most {summary.memory['peak']} bytes of rows in memory "
+        f"(budget {options.memory_budget or 'none'}, "
+        f"{summary.memory['waits']} waits)"
+    )
+    if exporters:
+        report = metrics.report(
+            run_id=context.run_id,
+            mode=options.mode,
+            sink=options.sink,
+            rows=summary.rows,
+            complete=summary.complete,
+            memory=summary.memory,
+            **({"pipeline": summary.pipeline} if summary.pipeline else {}),
+            **({"spool": summary.spool} if summary.spool else {}),
+        )
+        for exporter in exporters:
+            exporter.export(report)
+    return summary
+
+
+def replay_spool(
+    options: typing.Optional[ArchiveOptions] = None,
+) -> typing.Dict[str, typing.Any]:
+    """Upload the chunks a crashed run left in the ``options.spool`` directory
+    to the sink of ``options``, without archiving anything new"""
+    options = options or ArchiveOptions()
+    directory = options.spool
+    if not directory:
+        raise exc.WillowException("No spool directory to replay")
+    sink = get_archive_sink(
+        options.sink,
+        dynamodb_resource,
+        file_format=options.file_format,
+        spool=directory,
+        concurrency=options.write_concurrency,
+        queue_depth=options.write_queue_depth,
+        packed=options.packed_tables,
+    )
+    sink.close()
+    report = sink.report()
+    LOGGER.info(
+        f"Replayed {report['replayed']} spool segments from {directory}, "
+        f"{report['uploaded']} rows uploaded"
+    )
+    return report
+
+
+class _Progress:
+    """Checkpoint bookkeeping for one table of a sensor/user plant"""
+
+    def __init__(
+        self, context: ArchiveContext, source: o.ArchiveSource, owner: Owner
+    ) -> None:
+        self.context = context
+        self.source = source
+        self.owner = owner
+        self.key = f"{source.name}#{owner.id}"
+        self.previous = None
+        if context.checkpoints is not None:
+            self.previous = context.checkpoints.get(source.name, owner.id)
+
+    @property
+    def done(self) -> bool:
+        """Already finished by this run before it was interrupted"""
+        return (
+            self.previous is not None
+            and self.previous.done
+            and self.previous.run_id == self.context.run_id
+        )
+
+    @property
+    def after(self) -> typing.Optional[Keyset]:
+        """Watermark left by an interrupted run, everything up to it is gone"""
+        if self.previous is None or self.previous.done or self.previous.id is None:
+            watermark = self.context.watermarks.get(self.key)
+            if watermark is None:
+                return None
+            return self.source.parse_cutoff(watermark[0]), watermark[1]
+        return self.source.parse_cutoff(self.previous.cutoff), self.previous.id
+
+    def save(self, item: typing.Optional[m.Base] = None, done: bool = False):
+        cutoff, id_ = None, None
+        if item is not None:
+            cutoff, id_ = SqlRepo.keyset(self.source, item)
+            cutoff = cutoff.isoformat()
+        if done:
+            self.context.watermarks.pop(self.key, None)
+        elif item is not None:
+            self.context.watermarks[self.key] = [cutoff, id_]
+        if self.context.checkpoints is None:
+            return
+        self.context.checkpoints.save(
+            m.Checkpoint(
+                table=self.source.name,
+                owner_id=self.owner.id,
+                run_id=self.context.run_id,
+                cutoff=cutoff,
+                id=id_,
+                done=done,
+            )
+        )
+
+
+def _save(context: ArchiveContext, source: o.ArchiveSource, data: Chunk) -> WriteResult:
+    """Hand a chunk to the sink once the memory budget has room for it"""
+    with context.budget.held(context.budget.estimate(source.name, len(data))):
+        return context.sink.save(source, data)
+
+
+def _archive_stream(
+    postgres_repo: SqlRepo,
+    context: ArchiveContext,
+    source: o.ArchiveSource,
+    owner: Owner,
+    upto: typing.Any,
+    chunk_size: int,
+    progress: _Progress,
+) -> int:
+    """Stream rows from one query, deleting uploaded rows by id every
+    ARCHIVE_DELETE_BATCH_SIZE rows on a second connection, committing on
+    the streaming one would close its cursor"""
+    moved = 0
+    written = array("q")
+    expired = False
+    with PostgresDatabase() as delete_conn:
+        deleter = SqlRepo(delete_conn)
         try:
-            with PostgresDatabase() as conn:
-                postgres_repo = SqlRepo(conn)
-                LOGGER.info(f"Working on {user_plant.personal_name} for score")
-                score = postgres_repo.get_user_plant_score(user_plant, timestamp_upto)
-                dynamo_repo.save_user_plant_score(score)
-                postgres_repo.delete_user_plant_score(user_plant, timestamp_upto)
-                LOGGER.info(
-                    f"Working on {user_plant.personal_name} for temperature score"
-                )
-                temperature_score = postgres_repo.get_user_plant_temperature_score(
-                    user_plant, timestamp_upto
-                )
-                dynamo_repo.save_temperature_user_plant_score(temperature_score)
-                postgres_repo.delete_user_plant_temperature_score(
-                    user_plant, timestamp_upto
-                )
-                LOGGER.info(f"Working on {user_plant.personal_name} for humidity score")
-                humidity_score = postgres_repo.get_user_plant_humidity_score(
-                    user_plant, timestamp_upto
-                )
-                dynamo_repo.save_humidity_user_plant_score(humidity_score)
-                postgres_repo.delete_user_plant_humidity_score(
-                    user_plant, timestamp_upto
-                )
-                LOGGER.info(f"Working on {user_plant.personal_name} for light score")
-                light_score = postgres_repo.get_user_plant_light_score(
-                    user_plant, timestamp_upto
-                )
-                dynamo_repo.save_light_user_plant_score(light_score)
-                postgres_repo.delete_user_plant_light_score(user_plant, timestamp_upto)
-                LOGGER.info(f"Working on {user_plant.personal_name} for moisture score")
-                moisture_score = postgres_repo.get_user_plant_moisture_score(
-                    user_plant, timestamp_upto
-                )
-                dynamo_repo.save_moisture_user_plant_score(moisture_score)
-                postgres_repo.delete_user_plant_moisture_score(
-                    user_plant, timestamp_upto
+            for data in postgres_repo.stream(source, owner, upto, chunk_size):
+                moved += _save(context, source, data).written
+                written.extend(row_ids(data))
+                if len(written) >= ARCHIVE_DELETE_BATCH_SIZE:
+                    deleter.delete_ids(source, written)
+                    written = array("q")
+                if context.expired:
+                    expired = True
+                    break
+        finally:
+            # Only rows that were read and uploaded are deleted, rows arriving
+            # under the cutoff while streaming stay for the next run
+            deleter.delete_ids(source, written)
+    if expired:
+        raise exc.TimeBudgetExceeded(moved)
+    return moved
+
+
+def _archive_chunked(
+    postgres_repo: SqlRepo,
+    context: ArchiveContext,
+    source: o.ArchiveSource,
+    owner: Owner,
+    upto: typing.Any,
+    chunk_size: int,
+    progress: _Progress,
+) -> int:
+    """Page by (cutoff, id), deleting every chunk once it is uploaded"""
+    moved = 0
+    after = progress.after
+    while True:
+        if context.expired:
+            raise exc.TimeBudgetExceeded(moved)
+        limit = postgres_repo.chunk_rows(source, chunk_size)
+        data = postgres_repo.page(source, owner, upto, after, limit)
+        if not data:
+            break
+        moved += _save(context, source, data).written
+        postgres_repo.delete_ids(source, array("q", row_ids(data)))
+        progress.save(data[-1])
+        after = postgres_repo.keyset(source, data[-1])
+        if len(data) < limit:
+            break
+    LOGGER.info(f"Moved {moved} {source.name} rows for {owner} in chunks")
+    return moved
+
+
+def _archive_move(
+    postgres_repo: SqlRepo,
+    context: ArchiveContext,
+    source: o.ArchiveSource,
+    owner: Owner,
+    upto: typing.Any,
+    chunk_size: int,
+    progress: _Progress,
+) -> int:
+    """Delete and return a chunk at a time, committing after the upload"""
+    moved = 0
+    while True:
+        if context.expired:
+            raise exc.TimeBudgetExceeded(moved)
+        limit = postgres_repo.chunk_rows(source, chunk_size)
+        with postgres_repo.move(source, owner, upto, limit) as data:
+            if data:
+                moved += _save(context, source, data).written
+        if data:
+            progress.save(data[-1])
+        if len(data) < limit:
+            break
+    LOGGER.info(f"Moved {moved} {source.name} rows for {owner}")
+    return moved
+
+
+def _chunk_size(chunk_size: int, pending: typing.Optional[m.PendingRows]) -> int:
+    """No need for chunk buffers larger than what the plan says is waiting"""
+    return min(chunk_size, max(pending.rows, 1)) if pending else chunk_size
+
+
+def archive_table(
+    postgres_repo: SqlRepo,
+    context: ArchiveContext,
+    source: o.ArchiveSource,
+    owner: Owner,
+    pending: typing.Optional[m.PendingRows] = None,
+) -> int:
+    """Move rows of one table for a sensor/user plant, returns rows written.
+
+    With a checkpoint store, chunked and move mode record a watermark after
+    every chunk and resume from it; stream mode only records finished
+    tables, a run after it reading just the rows it had not deleted yet. Raises TimeBudgetExceeded once the
+    context's deadline expires, after the current chunk is fully moved.
+    """
+    options = context.options
+    progress = _Progress(context, source, owner)
+    if progress.done:
+        LOGGER.info(f"Skipping {source.name} for {owner}, done in {context.run_id}")
+        return 0
+    upto = source.upto(context.timestamp_upto)
+    chunk_size = _chunk_size(options.chunk_size, pending)
+    if options.mode == "chunked":
+        archive = _archive_chunked
+    elif options.mode == "move":
+        archive = _archive_move
+    else:
+        archive = _archive_stream
+    start = time.perf_counter()
+    try:
+        moved = archive(
+            postgres_repo, context, source, owner, upto, chunk_size, progress
+        )
+    except exc.TimeBudgetExceeded as e:
+        get_metrics().entity(
+            source.name, owner.id, e.args[0], time.perf_counter() - start
+        )
+        raise
+    get_metrics().entity(source.name, owner.id, moved, time.perf_counter() - start)
+    progress.save(done=True)
+    return moved
+
+
+def archive_entity(
+    context: ArchiveContext,
+    owner: Owner,
+    sources: typing.List[o.ArchiveSource],
+    tables: typing.Optional[typing.Dict[str, m.PendingRows]] = None,
+) -> typing.Dict[str, int]:
+    """Archive the tables of a sensor/user plant, only planned ones if given.
+
+    On TimeBudgetExceeded, re-raises it with the rows moved per table.
+    """
+    moved = {}
+    with PostgresDatabase() as conn:
+        postgres_repo = SqlRepo(
+            conn, copy_tables=context.options.copy_tables, budget=context.budget
+        )
+        for source in sources:
+            if tables is not None and source.name not in tables:
+                continue
+            LOGGER.info(f"Working on {owner} for {source.name}")
+            try:
+                moved[source.name] = archive_table(
+                    postgres_repo,
+                    context,
+                    source,
+                    owner,
+                    tables.get(source.name) if tables is not None else None,
                 )
+            except exc.TimeBudgetExceeded as e:
+                moved[source.name] = e.args[0]
+                raise exc.TimeBudgetExceeded(moved) from e
+    return moved
+
+
+def archive_sensor(
+    context: ArchiveContext,
+    sensor: m.Sensor,
+    tables: typing.Optional[typing.Dict[str, m.PendingRows]] = None,
+) -> typing.Dict[str, int]:
+    return archive_entity(context, sensor, o.sensor_sources, tables)
+
+
+def archive_user_plant(
+    context: ArchiveContext,
+    user_plant: m.UserPlant,
+    tables: typing.Optional[typing.Dict[str, m.PendingRows]] = None,
+) -> typing.Dict[str, int]:
+    return archive_entity(context, user_plant, o.user_plant_sources, tables)
+
+
+def _archive_each(
+    kind: str,
+    entities: typing.Sequence[Owner],
+    archive: typing.Callable[[Owner], typing.Dict[str, int]],
+    moved: typing.Dict[int, typing.Dict[str, int]],
+    failed: typing.List[int],
+    workers: int,
+    context: ArchiveContext,
+    remaining: typing.List[int],
+):
+    """Archive entities serially or on a thread pool, isolating failures.
+
+    Entities not started or cut short by the deadline go to ``remaining``.
+    """
+
+    def run(entity: Owner):
+        if context.expired:
+            remaining.append(entity.id)
+            return
+        try:
+            moved[entity.id] = archive(entity)
+        except exc.TimeBudgetExceeded as e:
+            LOGGER.info(f"Out of time while archiving {kind}: {entity}")
+            moved[entity.id] = e.args[0]
+            remaining.append(entity.id)
         except Exception as e:
-            LOGGER.error(f"Error Archiving user plant: {user_plant}: {str(e)}")
+            LOGGER.error(f"Error Archiving {kind}: {entity}: {str(e)}")
+            failed.append(entity.id)
+
+    if workers <= 1:
+        for entity in entities:
+            run(entity)
+        return
+    with ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix=f"archive-{kind}"
+    ) as executor:
+        list(executor.map(run, entities))
+
+
+def archive_bulk(
+    context: ArchiveContext,
+    source: o.ArchiveSource,
+    owner_ids: typing.Optional[typing.Sequence[int]],
+    moved: typing.Dict[int, typing.Dict[str, int]],
+    failed: typing.List[int],
+) -> bool:
+    """Move one table for all sensors/user plants through a single query.
+
+    Rows are deleted on a second connection whenever the stream moves on to
+    the next owner, so the read cursor stays open while progress is
+    committed. An owner whose upload fails is skipped for the rest of the
+    stream and keeps its rows. Returns False when the deadline cut the
+    stream short.
+    """
+    if owner_ids is not None and not owner_ids:
+        return True
+    upto = source.upto(context.timestamp_upto)
+    LOGGER.info(f"Working on {source.name} for all owners")
+    with PostgresDatabase() as read_conn, PostgresDatabase() as write_conn:
+        reader = SqlRepo(
+            read_conn, copy_tables=context.options.copy_tables, budget=context.budget
+        )
+        writer = SqlRepo(write_conn)
+        current, written = None, array("q")
+        finished = True
+        for owner, data in reader.stream_owners(
+            source, upto, owner_ids, context.options.chunk_size
+        ):
+            if context.expired:
+                finished = False
+                break
+            if owner.id in failed:
+                continue
+            if current is not None and owner.id != current.id and written:
+                writer.delete_ids(source, written)
+                written = array("q")
+            current = owner
+            start = time.perf_counter()
+            try:
+                count = _save(context, source, data).written
+            except Exception as e:
+                LOGGER.error(f"Error Archiving {source.name} for {owner}: {str(e)}")
+                failed.append(owner.id)
+                written = array("q")
+                continue
+            get_metrics().entity(
+                source.name, owner.id, count, time.perf_counter() - start
+            )
+            table_moved = moved.setdefault(owner.id, {})
+            table_moved[source.name] = table_moved.get(source.name, 0) + count
+            written.extend(row_ids(data))
+        if written:
+            writer.delete_ids(source, written)
+    return finished
+
+
+def archive_partitions(
+    context: ArchiveContext,
+    source: o.ArchiveSource,
+    moved: typing.Dict[int, typing.Dict[str, int]],
+    failed: typing.List[int],
+    dropped: typing.Dict[str, typing.List[str]],
+) -> bool:
+    """Archive the partitions of a table that are entirely under the cutoff
+    and drop them instead of deleting their rows.
+
+    A partition is dropped only when every owner in it was written and it
+    still holds just the archived rows, otherwise the rows of the owners
+    that were written are deleted, up to the last id archived for each so
+    rows that arrived since stay. Returns False when the deadline cut the
+    run short.
+    """
+    upto = source.upto(context.timestamp_upto)
+    with PostgresDatabase() as read_conn, PostgresDatabase() as write_conn:
+        reader = SqlRepo(
+            read_conn, copy_tables=context.options.copy_tables, budget=context.budget
+        )
+        writer = SqlRepo(write_conn)
+        with read_conn.begin():
+            partitions = reader.partitions(source)
+        for partition in partitions:
+            if not partition.older_than(upto):
+                continue
+            if context.expired:
+                return False
+            LOGGER.info(f"Working on partition {partition.name} of {source.name}")
+            # A count and the highest id written per owner rather than every
+            # id, a partition can hold tens of millions of rows
+            written, last_ids, partition_failed = 0, {}, []
+            # Reads end with their transaction, its locks on the partition
+            # would otherwise block drop_partition on the other connection
+            with read_conn.begin():
+                for owner, data in reader.stream_owners(
+                    source,
+                    upto,
+                    chunk_size=context.options.chunk_size,
+                    partition=partition,
+                ):
+                    if owner.id in partition_failed:
+                        continue
+                    start = time.perf_counter()
+                    try:
+                        count = _save(context, source, data).written
+                    except Exception as e:
+                        LOGGER.error(
+                            f"Error Archiving {source.name} for {owner}: {str(e)}"
+                        )
+                        partition_failed.append(owner.id)
+                        continue
+                    get_metrics().entity(
+                        source.name, owner.id, count, time.perf_counter() - start
+                    )
+                    table_moved = moved.setdefault(owner.id, {})
+                    table_moved[source.name] = table_moved.get(source.name, 0) + count
+                    written += len(data)
+                    last_ids[owner.id] = max(
+                        last_ids.get(owner.id, 0), max(row_ids(data), default=0)
+                    )
+            failed.extend(id_ for id_ in partition_failed if id_ not in failed)
+            # An owner that failed part way keeps its rows for the next run
+            for owner_id in partition_failed:
+                last_ids.pop(owner_id, None)
+            if not partition_failed and writer.drop_partition(
+                source, partition, written
+            ):
+                dropped.setdefault(source.name, []).append(partition.name)
+            elif last_ids:
+                writer.delete_partition_rows(source, partition, upto, last_ids)
+    return True
+
+
+def archive_pipeline(
+    context: ArchiveContext, plan: ArchivePlan, summary: ArchiveSummary
+) -> None:
+    """Archive the planned sensors/user plants through an ArchivePipeline,
+    recording rows moved, failures and what the deadline left in ``summary``.
+
+    Nothing is checkpointed: only written rows are deleted, so a rerun or
+    continuation simply reads what is left.
+    """
+    options = context.options
+    config = PipelineConfig(
+        extractors=options.workers,
+        writers=options.pipeline_writers,
+        queue_depth=options.pipeline_queue_depth,
+    )
+    summary.pipeline["config"] = config.describe(options.chunk_size)
+    LOGGER.info(f"Archiving through a pipeline of {summary.pipeline['config']}")
+    kinds = (
+        (
+            plan.sensors,
+            o.sensor_sources,
+            summary.sensors,
+            summary.failed_sensors,
+            summary.remaining_sensors,
+        ),
+        (
+            plan.user_plants,
+            o.user_plant_sources,
+            summary.user_plants,
+            summary.failed_user_plants,
+            summary.remaining_user_plants,
+        ),
+    )
+    tasks = [
+        [
+            PipelineTask(
+                entity.owner,
+                [
+                    (
+                        source,
+                        _chunk_size(options.chunk_size, entity.tables[source.name]),
+                    )
+                    for source in sources
+                    if source.name in entity.tables
+                ],
+            )
+            for entity in entities.values()
+        ]
+        for entities, sources, *_ in kinds
+    ]
+    pipeline = ArchivePipeline(
+        config,
+        context.sink,
+        context.timestamp_upto,
+        copy_tables=options.copy_tables,
+        budget=context.budget,
+        expired=lambda: context.expired,
+    )
+    pipeline.run([task for kind_tasks in tasks for task in kind_tasks])
+    summary.pipeline["stages"] = pipeline.report()
+    for kind_tasks, (_, _, moved, failed, remaining) in zip(tasks, kinds):
+        for task in kind_tasks:
+            # Rows of failed entities that were written are gone from Postgres
+            if task.moved or not (task.failed or task.remaining):
+                moved[task.owner.id] = task.moved
+            if task.failed:
+                failed.append(task.owner.id)
+            elif task.remaining:
+                remaining.append(task.owner.id)
+
+
+def _archive_data(
+    context: ArchiveContext,
+    selected_sensors: typing.Optional[typing.List[int]] = None,
+    selected_user_plants: typing.Optional[typing.List[int]] = None,
+    plan: typing.Optional[ArchivePlan] = None,
+) -> ArchiveSummary:
+    """Archive everything under the cutoff.
+
+    Bulk mode streams each table across all owners; the other modes first
+    build an ArchivePlan and only visit sensors/user plants that have rows,
+    pipeline mode all of them at once through overlapping stages.
+    """
+    options = context.options
+    LOGGER.info(f"Starting migrating data for run {context.run_id} with {options}")
+    summary = ArchiveSummary(run_id=context.run_id)
+    if (
+        options.drop_partitions
+        and selected_sensors is None
+        and selected_user_plants is None
+    ):
+        # Whatever was not dropped is left to the regular run below or, past
+        # the deadline, to a continuation
+        finished = all(
+            archive_partitions(context, source, moved, failed, summary.partitions)
+            for sources, moved, failed in (
+                (o.sensor_sources, summary.sensors, summary.failed_sensors),
+                (
+                    o.user_plant_sources,
+                    summary.user_plants,
+                    summary.failed_user_plants,
+                ),
+            )
+            for source in sources
+        )
+        if not finished:
+            summary.complete = False
+            summary.remaining_sensors = None
+            summary.remaining_user_plants = None
+            _log_summary(summary)
+            return summary
+    if options.mode == "bulk":
+        # Moved rows are gone, so whatever is cut short is simply queried again
+        finished = all(
+            archive_bulk(
+                context,
+                source,
+                selected_sensors,
+                summary.sensors,
+                summary.failed_sensors,
+            )
+            for source in o.sensor_sources
+        )
+        if not finished:
+            summary.complete = False
+            summary.remaining_sensors = selected_sensors
+            summary.remaining_user_plants = selected_user_plants
+            _log_summary(summary)
+            return summary
+        summary.complete = all(
+            archive_bulk(
+                context,
+                source,
+                selected_user_plants,
+                summary.user_plants,
+                summary.failed_user_plants,
+            )
+            for source in o.user_plant_sources
+        )
+        if not summary.complete:
+            summary.remaining_user_plants = selected_user_plants
+        _log_summary(summary)
+        return summary
+    if plan is None:
+        with PostgresDatabase() as conn:
+            plan = build_plan(
+                SqlRepo(conn),
+                context.timestamp_upto,
+                selected_sensors,
+                selected_user_plants,
+            )
+    summary.planned = plan.rows_per_entity()
+    if options.mode == "pipeline":
+        archive_pipeline(context, plan, summary)
+    else:
+        _archive_each(
+            "sensor",
+            [entity.owner for entity in plan.sensors.values()],
+            lambda sensor: archive_sensor(
+                context, sensor, plan.sensors[sensor.id].tables
+            ),
+            summary.sensors,
+            summary.failed_sensors,
+            options.workers,
+            context,
+            summary.remaining_sensors,
+        )
+        _archive_each(
+            "user plant",
+            [entity.owner for entity in plan.user_plants.values()],
+            lambda user_plant: archive_user_plant(
+                context, user_plant, plan.user_plants[user_plant.id].tables
+            ),
+            summary.user_plants,
+            summary.failed_user_plants,
+            options.workers,
+            context,
+            summary.remaining_user_plants,
+        )
+    summary.complete = not (summary.remaining_sensors or summary.remaining_user_plants)
+    summary.watermarks = dict(context.watermarks)
+    _log_summary(summary)
+    return summary
+
+
+def _log_summary(summary: ArchiveSummary):
+    LOGGER.info(
+        f"Archived {summary.rows} rows from {len(summary.sensors)} sensors and "
+        f"{len(summary.user_plants)} user plants. Failed sensors: "
+        f"{summary.failed_sensors}, failed user plants: {summary.failed_user_plants}"
+    )
+    if not summary.complete:
+        LOGGER.info(
+            f"Run {summary.run_id} stopped at its deadline, remaining sensors: "
+            f"{summary.remaining_sensors}, remaining user plants: "
+            f"{summary.remaining_user_plants}"
+        )
@@ -0,0 +1,96 @@
+import json
+import logging
+import typing
+from datetime import datetime
+from core import exceptions as exc
+from core.settings import get_lambda_client
+from core.utils.deadline import Deadline
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+Event = typing.Dict[str, typing.Any]
+Handler = typing.Callable[[Event, typing.Any], typing.Any]
+Reinvoker = typing.Callable[[Event, typing.Any], typing.Any]
+
+
+def continuation_event(event: Event, timestamp_upto: datetime, summary) -> Event:
+    """Event continuing an incomplete run where ``summary`` left off.
+
+    The cutoff and run id are pinned so every invocation of the run archives
+    the same rows and shares its checkpoints.
+    """
+    return {
+        **event,
+        "timestamp_upto": timestamp_upto.isoformat(),
+        "run_id": summary.run_id,
+        "selected_sensors": summary.remaining_sensors,
+        "selected_user_plants": summary.remaining_user_plants,
+        # Nothing left of a kind is an empty list, not all of them
+        "exact_selection": True,
+        "watermarks": summary.watermarks,
+    }
+
+
+class LocalContext:
+    """Stand-in for the Lambda context object with a fixed time budget"""
+
+    function_name = "local"
+    invoked_function_arn = "local"
+
+    def __init__(self, budget_ms: int):
+        self.deadline = Deadline.in_ms(budget_ms)
+
+    def get_remaining_time_in_millis(self) -> int:
+        return self.deadline.remaining_ms()
+
+
+class LambdaReinvoker:
+    """Continues the run in a new asynchronous invocation of this function"""
+
+    def __init__(self, client=None):
+        self.client = client or get_lambda_client()
+
+    def __call__(self, event: Event, context: typing.Any):
+        LOGGER.info(f"Continuing run {event['run_id']} in a new invocation")
+        self.client.invoke(
+            FunctionName=context.invoked_function_arn,
+            InvocationType="Event",
+            Payload=json.dumps(event, default=str).encode(),
+        )
+
+
+class LocalReinvoker:
+    """Continues the run in process, for local runs and tests.
+
+    Each continuation gets a fresh ``budget_ms``; ``events`` records what
+    was handed over between invocations.
+    """
+
+    def __init__(
+        self, handler: Handler, budget_ms: int = 900_000, max_invocations: int = 100
+    ):
+        self.handler = handler
+        self.budget_ms = budget_ms
+        self.max_invocations = max_invocations
+        self.events: typing.List[Event] = []
+
+    def __call__(self, event: Event, context: typing.Any):
+        if len(self.events) >= self.max_invocations:
+            raise exc.WillowException(
+                f"Run {event['run_id']} not done after {len(self.events)} invocations"
+            )
+        self.events.append(event)
+        return self.handler(event, LocalContext(self.budget_ms), reinvoke=self)
+
+
+def get_reinvoker(name: str, handler: Handler) -> typing.Optional[Reinvoker]:
+    """Reinvoke hook for ``name``, see ARCHIVE_REINVOKE in core.settings"""
+    if not name:
+        return None
+    if name == "lambda":
+        return LambdaReinvoker()
+    if name == "local":
+        return LocalReinvoker(handler)
+    raise exc.WillowException(f"Invalid reinvoke hook: {name}")
@@ -0,0 +1,332 @@
+import contextlib
+import logging
+import queue
+import threading
+import time
+import typing
+from array import array
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from core import exceptions as exc
+from core.dynamo import PreparedChunk
+from core.metrics import get_metrics
+from core.settings import PostgresDatabase
+from core.utils.budget import MemoryBudget
+from migrator.adapters import orm as o
+from migrator.domain.columnar import Chunk, row_ids
+from migrator.repository.postgres import Owner, SqlRepo
+from migrator.repository.sink import ArchiveSink
+
+
+LOGGER = logging.getLogger(__name__)
+
+STAGES = ("extract", "transform", "write", "delete")
+_WORKERS = {
+    "extract": "extractors",
+    "transform": "transformers",
+    "write": "writers",
+    "delete": "deleters",
+}
+# Tells a stage thread that everything before it is done
+_DONE = object()
+
+
+@dataclass(slots=True)
+class PipelineConfig:
+    """Threads per stage and the chunks each queue between two stages holds"""
+
+    extractors: int = 1
+    # Serializing is CPU bound, more threads mostly contend for the GIL
+    transformers: int = 1
+    writers: int = 2
+    deleters: int = 1
+    queue_depth: int = 2
+
+    def __post_init__(self):
+        for name in _WORKERS.values():
+            if getattr(self, name) < 1:
+                raise exc.WillowException(f"Pipeline needs at least one of {name}")
+        if self.queue_depth < 1:
+            raise exc.WillowException("Pipeline queue depth must be at least 1")
+
+    def workers(self, stage: str) -> int:
+        return getattr(self, _WORKERS[stage])
+
+    @property
+    def max_chunks(self) -> int:
+        """Chunks held at once: one per extract/transform/write thread and
+        full queues in front of transform and write. Deletes only hold ids"""
+        return self.extractors + self.transformers + self.writers + 2 * self.queue_depth
+
+    def describe(self, chunk_size: int) -> typing.Dict[str, typing.Any]:
+        return {
+            **asdict(self),
+            "chunk_size": chunk_size,
+            "max_chunks": self.max_chunks,
+            "max_rows": self.max_chunks * chunk_size,
+        }
+
+
+@dataclass(slots=True)
+class PipelineTask:
+    """The tables of one sensor/user plant and the chunk size to read them in,
+    updated as its chunks move through the pipeline"""
+
+    owner: Owner
+    sources: typing.List[typing.Tuple[o.ArchiveSource, int]]
+    moved: typing.Dict[str, int] = field(default_factory=dict)
+    failed: bool = False
+    # Cut short or never started because of the deadline
+    remaining: bool = False
+
+
+@dataclass(slots=True)
+class _Work:
+    task: PipelineTask
+    source: o.ArchiveSource
+    ids: array
+    data: typing.Optional[Chunk] = None
+    prepared: typing.Optional[PreparedChunk] = None
+    # Held against the memory budget until the chunk is written or dropped
+    nbytes: int = 0
+
+
+@dataclass(slots=True)
+class StageStats:
+    """Where the threads of a stage spent their time, in seconds.
+
+    A stage that is hardly ever ``starved`` is the bottleneck; the stages
+    before it end up ``blocked`` on their full queues, the ones after it
+    starved.
+    """
+
+    workers: int
+    items: int = 0
+    busy: float = 0.0
+    # Waiting for the stage before, and for room in the queue after
+    starved: float = 0.0
+    blocked: float = 0.0
+    # Most items seen waiting in front of the stage
+    queue_peak: int = 0
+
+
+def _task(item: typing.Union[PipelineTask, _Work]) -> PipelineTask:
+    return item if isinstance(item, PipelineTask) else item.task
+
+
+class ArchivePipeline:
+    """Archive sensors/user plants through four stages of threads:
+
+    extract    streams chunks of every task's tables (own connection each)
+    transform  serializes chunks with ``ArchiveSink.prepare``
+    write      sends them with ``ArchiveSink.write``
+    delete     deletes the written rows by id (own connection each)
+
+    Stages are joined by queues of ``queue_depth`` chunks, so while one
+    sensor is read the previous one is uploaded and the one before deleted,
+    and a slow stage holds back the ones before it instead of piling up
+    chunks. Chunks are also held against ``budget`` from extraction until
+    they are written, so readers pause once it is spent. Chunks of a task
+    may be written out of order; only written rows are deleted, so whatever
+    fails or is cut short stays for the next run.
+    """
+
+    def __init__(
+        self,
+        config: PipelineConfig,
+        sink: ArchiveSink,
+        timestamp_upto: datetime,
+        copy_tables: typing.Optional[typing.List[str]] = None,
+        budget: typing.Optional[MemoryBudget] = None,
+        expired: typing.Callable[[], bool] = lambda: False,
+        clock: typing.Callable[[], float] = time.perf_counter,
+    ):
+        self.config = config
+        self.sink = sink
+        self.timestamp_upto = timestamp_upto
+        self.copy_tables = copy_tables
+        self.budget = budget or MemoryBudget(items_held=True)
+        self.expired = expired
+        self.clock = clock
+        self.stats = {stage: StageStats(config.workers(stage)) for stage in STAGES}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def _connected(self, handle):
+        with PostgresDatabase() as conn:
+            repo = SqlRepo(conn, copy_tables=self.copy_tables, budget=self.budget)
+            yield lambda item: handle(repo, item)
+
+    def _extract(self, repo: SqlRepo, task: PipelineTask) -> typing.Iterator[_Work]:
+        if self.expired():
+            task.remaining = True
+            return
+        for source, chunk_size in task.sources:
+            upto = source.upto(self.timestamp_upto)
+            for data in repo.stream(source, task.owner, upto, chunk_size):
+                if task.failed:
+                    return
+                if len(data):
+                    nbytes = self.budget.estimate(source.name, len(data))
+                    self.budget.acquire(nbytes)
+                    ids = array("q", row_ids(data))
+                    yield _Work(task, source, ids, data=data, nbytes=nbytes)
+                if self.expired():
+                    task.remaining = True
+                    return
+
+    def _release(self, work: _Work):
+        self.budget.release(work.nbytes)
+        work.nbytes = 0
+        work.data = work.prepared = None
+
+    def _transform(self, work: _Work) -> typing.Iterator[_Work]:
+        if work.task.failed:
+            self._release(work)
+            return
+        work.prepared = self.sink.prepare(work.source, work.data)
+        work.data = None
+        # Serialized items mostly take more room than the rows. Later chunks
+        # are read for the larger size, this one never waits since only the
+        # writers free room
+        self.budget.observe_items(
+            work.source.name, work.prepared.rows, work.prepared.nbytes
+        )
+        self.budget.adjust(work.prepared.nbytes - work.nbytes)
+        work.nbytes = work.prepared.nbytes
+        yield work
+
+    def _write(self, work: _Work) -> typing.Iterator[_Work]:
+        if work.task.failed:
+            self._release(work)
+            return
+        start = self.clock()
+        try:
+            written = self.sink.write(work.prepared).written
+        finally:
+            self._release(work)
+        get_metrics().entity(
+            work.source.name, work.task.owner.id, written, self.clock() - start
+        )
+        with self._lock:
+            moved = work.task.moved
+            moved[work.source.name] = moved.get(work.source.name, 0) + written
+        yield work
+
+    def _delete(self, repo: SqlRepo, work: _Work) -> typing.Iterator[_Work]:
+        repo.delete_ids(work.source, work.ids)
+        return iter(())
+
+    def _fail(self, item: typing.Union[PipelineTask, _Work]):
+        _task(item).failed = True
+        if isinstance(item, _Work):
+            self._release(item)
+
+    def _worker(
+        self,
+        stage: str,
+        open_handler: typing.ContextManager[typing.Callable],
+        inbox: queue.Queue,
+        outbox: typing.Optional[queue.Queue],
+        running: typing.List[int],
+    ):
+        stats = self.stats[stage]
+        starved = blocked = busy = 0.0
+        items = peak = 0
+        try:
+            with open_handler as handle:
+                while True:
+                    start = self.clock()
+                    item = inbox.get()
+                    starved += self.clock() - start
+                    if item is _DONE:
+                        break
+                    items += 1
+                    peak = max(peak, inbox.qsize() + 1)
+                    start = self.clock()
+                    try:
+                        for out in handle(item):
+                            busy += self.clock() - start
+                            start = self.clock()
+                            if outbox is not None:
+                                outbox.put(out)
+                            blocked += self.clock() - start
+                            start = self.clock()
+                    except Exception as e:
+                        self._fail(item)
+                        LOGGER.error(
+                            f"Error Archiving {_task(item).owner} in {stage}: {e}"
+                        )
+                    busy += self.clock() - start
+        except Exception as e:
+            # Without a connection the thread can only fail what reaches it,
+            # it keeps taking items so the stages before it are not stuck
+            LOGGER.error(f"Archive {stage} thread failed: {e}")
+            while (item := inbox.get()) is not _DONE:
+                self._fail(item)
+        finally:
+            with self._lock:
+                stats.items += items
+                stats.busy += busy
+                stats.starved += starved
+                stats.blocked += blocked
+                stats.queue_peak = max(stats.queue_peak, peak)
+                running[0] -= 1
+                last = running[0] == 0
+            # The last thread out lets every thread of the next stage finish
+            if last and outbox is not None:
+                for _ in range(self.config.workers(STAGES[STAGES.index(stage) + 1])):
+                    outbox.put(_DONE)
+
+    def run(self, tasks: typing.Sequence[PipelineTask]) -> typing.Dict[str, StageStats]:
+        """Archive ``tasks``, recording the outcome on each of them"""
+        config = self.config
+        # Tasks are all known up front, only the queues after extract are bounded
+        inboxes: typing.Dict[str, queue.Queue] = {"extract": queue.Queue()}
+        for task in tasks:
+            inboxes["extract"].put(task)
+        for _ in range(config.extractors):
+            inboxes["extract"].put(_DONE)
+        for stage in STAGES[1:]:
+            inboxes[stage] = queue.Queue(maxsize=config.queue_depth)
+        handlers = {
+            "extract": lambda: self._connected(self._extract),
+            "transform": lambda: contextlib.nullcontext(self._transform),
+            "write": lambda: contextlib.nullcontext(self._write),
+            "delete": lambda: self._connected(self._delete),
+        }
+        threads = []
+        for index, stage in enumerate(STAGES):
+            workers = config.workers(stage)
+            outbox = inboxes[STAGES[index + 1]] if index + 1 < len(STAGES) else None
+            running = [workers]
+            for number in range(workers):
+                threads.append(
+                    threading.Thread(
+                        target=self._worker,
+                        args=(
+                            stage,
+                            handlers[stage](),
+                            inboxes[stage],
+                            outbox,
+                            running,
+                        ),
+                        name=f"archive-{stage}-{number}",
+                        daemon=True,
+                    )
+                )
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.stats
+
+    def report(self) -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+        """Stage statistics with times rounded for reports"""
+        return {
+            stage: {
+                name: round(value, 6) if isinstance(value, float) else value
+                for name, value in asdict(stats).items()
+            }
+            for stage, stats in self.stats.items()
+        }
@@ -0,0 +1,84 @@
+import logging
+import typing
+from dataclasses import dataclass, field
+from datetime import datetime
+from migrator.adapters import orm as o
+from migrator.domain import models as m
+from migrator.repository.postgres import Owner, SqlRepo
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class EntityPlan:
+    owner: Owner
+    tables: typing.Dict[str, m.PendingRows] = field(default_factory=dict)
+
+    @property
+    def rows(self) -> int:
+        return sum(pending.rows for pending in self.tables.values())
+
+
+@dataclass(slots=True)
+class ArchivePlan:
+    """Sensors and user plants that have rows under the cutoff"""
+
+    sensors: typing.Dict[int, EntityPlan] = field(default_factory=dict)
+    user_plants: typing.Dict[int, EntityPlan] = field(default_factory=dict)
+
+    @property
+    def rows(self) -> int:
+        return sum(
+            plan.rows for plan in [*self.sensors.values(), *self.user_plants.values()]
+        )
+
+    def rows_per_entity(self) -> typing.Dict[str, typing.Dict[int, int]]:
+        return {
+            "sensors": {id_: plan.rows for id_, plan in self.sensors.items()},
+            "user_plants": {id_: plan.rows for id_, plan in self.user_plants.items()},
+        }
+
+
+def _plan_sources(
+    postgres_repo: SqlRepo,
+    sources: typing.List[o.ArchiveSource],
+    timestamp_upto: datetime,
+    owner_ids: typing.Optional[typing.Sequence[int]],
+    plans: typing.Dict[int, EntityPlan],
+):
+    if owner_ids is not None and not owner_ids:
+        return
+    for source in sources:
+        for owner, pending in postgres_repo.plan(
+            source, source.upto(timestamp_upto), owner_ids
+        ):
+            plans.setdefault(owner.id, EntityPlan(owner)).tables[source.name] = pending
+
+
+def build_plan(
+    postgres_repo: SqlRepo,
+    timestamp_upto: datetime,
+    selected_sensors: typing.Optional[typing.Sequence[int]] = None,
+    selected_user_plants: typing.Optional[typing.Sequence[int]] = None,
+) -> ArchivePlan:
+    """One grouped scan per table instead of a select per sensor/user plant.
+
+    ``None`` selects every sensor/user plant, an empty list none of them.
+    """
+    plan = ArchivePlan()
+    _plan_sources(
+        postgres_repo, o.sensor_sources, timestamp_upto, selected_sensors, plan.sensors
+    )
+    _plan_sources(
+        postgres_repo,
+        o.user_plant_sources,
+        timestamp_upto,
+        selected_user_plants,
+        plan.user_plants,
+    )
+    LOGGER.info(
+        f"Planned {plan.rows} rows over {len(plan.sensors)} sensors and "
+        f"{len(plan.user_plants)} user plants"
+    )
+    return plan
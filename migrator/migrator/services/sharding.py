@@ -0,0 +1,306 @@
+import heapq
+import importlib
+import json
+import logging
+import time
+import typing
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from datetime import datetime
+from multiprocessing import get_context
+from botocore.config import Config
+from core import exceptions as exc
+from core.settings import (
+    ARCHIVE_WORKER_FUNCTION,
+    PostgresDatabase,
+    get_lambda_client,
+)
+from core.utils.deadline import Deadline
+from migrator.repository.postgres import SqlRepo
+from migrator.services.planning import ArchivePlan, build_plan
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+Event = typing.Dict[str, typing.Any]
+
+# A worker answers once its run is over, which takes up to the 15 minutes a
+# Lambda invocation may last; coordinators stop waiting at their deadline.
+# Retrying a read that timed out would start a second worker on the same
+# shard and run id
+WORKER_CLIENT_CONFIG = Config(
+    read_timeout=15 * 60 + 60,
+    tcp_keepalive=True,
+    retries={"max_attempts": 0},
+)
+
+
+@dataclass(slots=True)
+class Shard:
+    index: int
+    sensors: typing.List[int] = field(default_factory=list)
+    user_plants: typing.List[int] = field(default_factory=list)
+    rows: int = 0
+
+    def event(self, base: Event, timestamp_upto: datetime, run_id: str) -> Event:
+        """Worker event archiving only this shard's sensors/user plants"""
+        return {
+            **base,
+            "timestamp_upto": timestamp_upto.isoformat(),
+            "selected_sensors": self.sensors,
+            "selected_user_plants": self.user_plants,
+            # A shard without sensors or user plants archives none of them
+            "exact_selection": True,
+            "run_id": f"{run_id}-{self.index}",
+        }
+
+
+@dataclass(slots=True)
+class ShardResult:
+    shard: Shard
+    seconds: float = 0.0
+    summary: typing.Optional[typing.Dict[str, typing.Any]] = None
+    error: typing.Optional[str] = None
+    # Still running when the coordinator ran out of time
+    pending: bool = False
+
+    @property
+    def rows(self) -> int:
+        if self.summary is None:
+            return 0
+        return sum(
+            sum(moved.values())
+            for kind in ("sensors", "user_plants")
+            for moved in self.summary[kind].values()
+        )
+
+
+@dataclass(slots=True)
+class FanOutSummary:
+    run_id: str
+    results: typing.List[ShardResult] = field(default_factory=list)
+
+    @property
+    def rows(self) -> int:
+        return sum(result.rows for result in self.results)
+
+    @property
+    def failed_shards(self) -> typing.List[int]:
+        return [result.shard.index for result in self.results if result.error]
+
+    @property
+    def pending_shards(self) -> typing.List[int]:
+        """Shards still running when the coordinator had to return"""
+        return [result.shard.index for result in self.results if result.pending]
+
+    @property
+    def incomplete_shards(self) -> typing.List[int]:
+        """Shards that ran out of time and continue on their own"""
+        return [
+            result.shard.index
+            for result in self.results
+            if result.summary is not None and not result.summary["complete"]
+        ]
+
+    def report(self) -> typing.Dict[str, typing.Any]:
+        return {
+            "run_id": self.run_id,
+            "rows": self.rows,
+            "planned_skew": skew([result.shard.rows for result in self.results]),
+            "rows_skew": skew([result.rows for result in self.results]),
+            "seconds_skew": skew([result.seconds for result in self.results]),
+            "failed_shards": self.failed_shards,
+            "pending_shards": self.pending_shards,
+            "incomplete_shards": self.incomplete_shards,
+            "shards": [
+                {
+                    "index": result.shard.index,
+                    "sensors": len(result.shard.sensors),
+                    "user_plants": len(result.shard.user_plants),
+                    "planned_rows": result.shard.rows,
+                    "rows": result.rows,
+                    "seconds": round(result.seconds, 3),
+                    "error": result.error,
+                    "pending": result.pending,
+                    "summary": result.summary,
+                }
+                for result in self.results
+            ],
+        }
+
+
+def skew(values: typing.Sequence[float]) -> float:
+    """Largest value over the mean, 1.0 meaning perfectly balanced"""
+    if not values or not sum(values):
+        return 1.0
+    return round(max(values) / (sum(values) / len(values)), 3)
+
+
+def shard_plan(plan: ArchivePlan, shards: int) -> typing.List[Shard]:
+    """Bin-pack sensors/user plants into ``shards`` shards by planned rows.
+
+    Largest entities first, each onto the currently lightest shard, which
+    keeps the heaviest shard within 4/3 of the optimum.
+    """
+    if shards < 1:
+        raise exc.WillowException(f"Need at least one shard, got {shards}")
+    entities = [
+        (entity.rows, "sensors", id_) for id_, entity in plan.sensors.items()
+    ] + [(entity.rows, "user_plants", id_) for id_, entity in plan.user_plants.items()]
+    entities.sort(key=lambda entity: (-entity[0], entity[1], entity[2]))
+    result = [Shard(index) for index in range(shards)]
+    heap = [(0, index) for index in range(shards)]
+    for rows, kind, id_ in entities:
+        load, index = heapq.heappop(heap)
+        shard = result[index]
+        getattr(shard, kind).append(id_)
+        shard.rows += rows
+        heapq.heappush(heap, (load + rows, index))
+    return [shard for shard in result if shard.sensors or shard.user_plants]
+
+
+def _run_local(event: Event) -> typing.Dict[str, typing.Any]:
+    # entrypoints/lambda.py can't be imported with an import statement
+    handler = importlib.import_module("migrator.entrypoints.lambda").lambda_handler
+    return handler(event, None)
+
+
+class ProcessBackend:
+    """Runs shards through the Lambda handler in a local process pool"""
+
+    def __init__(self, workers: typing.Optional[int] = None):
+        self.workers = workers
+
+    def run(
+        self, events: typing.List[Event], deadline: typing.Optional[Deadline] = None
+    ) -> typing.Iterator[typing.Any]:
+        # Spawned, a forked process would share the pooled connections of
+        # the coordinator that planned the run
+        pool = ProcessPoolExecutor(
+            max_workers=self.workers or len(events), mp_context=get_context("spawn")
+        )
+        try:
+            yield from _timed(pool, _run_local, events, deadline)
+        finally:
+            pool.shutdown(wait=False)
+
+
+class LambdaBackend:
+    """Invokes the worker function once per shard and waits for the results,
+    until the coordinator's deadline at most"""
+
+    def __init__(self, function_name: str = ARCHIVE_WORKER_FUNCTION, client=None):
+        if not function_name:
+            raise exc.WillowException("No ARCHIVE_WORKER_FUNCTION configured")
+        self.function_name = function_name
+        self.client = client or get_lambda_client(WORKER_CLIENT_CONFIG)
+
+    def _invoke(self, event: Event) -> typing.Dict[str, typing.Any]:
+        resp = self.client.invoke(
+            FunctionName=self.function_name,
+            InvocationType="RequestResponse",
+            Payload=json.dumps(event).encode(),
+        )
+        payload = json.loads(resp["Payload"].read())
+        if resp.get("FunctionError"):
+            raise exc.WillowException(
+                f"{resp['FunctionError']}: {payload.get('errorMessage')}"
+            )
+        return payload
+
+    def run(
+        self, events: typing.List[Event], deadline: typing.Optional[Deadline] = None
+    ) -> typing.Iterator[typing.Any]:
+        pool = ThreadPoolExecutor(max_workers=len(events))
+        try:
+            yield from _timed(pool, self._invoke, events, deadline)
+        finally:
+            # Workers still running finish their shards on their own
+            pool.shutdown(wait=False)
+
+
+def _call(fn, event: Event) -> typing.Tuple[float, typing.Any]:
+    started = time.perf_counter()
+    result = fn(event)
+    return time.perf_counter() - started, result
+
+
+def _timed(
+    pool, fn, events: typing.List[Event], deadline: typing.Optional[Deadline] = None
+) -> typing.Iterator[typing.Any]:
+    """(index, seconds, summary, error, pending) per event, in submission
+    order, waiting until ``deadline`` expires at most"""
+    started = time.perf_counter()
+    futures = [pool.submit(_call, fn, event) for event in events]
+    timeout = None
+    if deadline is not None:
+        timeout = max(0, deadline.remaining_ms() - deadline.margin_ms) / 1000
+    wait(futures, timeout=timeout)
+    for index, future in enumerate(futures):
+        if not future.done():
+            yield index, time.perf_counter() - started, None, None, True
+            continue
+        try:
+            (seconds, summary), error = future.result(), None
+        except Exception as e:
+            seconds, summary, error = 0.0, None, f"{type(e).__name__}: {e}"
+        yield index, seconds, summary, error, False
+
+
+def get_backend(name: str):
+    """Shard backend for ``name``, see ARCHIVE_SHARD_BACKEND in core.settings"""
+    if name == "lambda":
+        return LambdaBackend()
+    if name == "process":
+        return ProcessBackend()
+    raise exc.WillowException(f"Invalid shard backend: {name}")
+
+
+def fan_out(
+    timestamp_upto: datetime,
+    shards: int,
+    backend,
+    base_event: typing.Optional[Event] = None,
+    selected_sensors: typing.Optional[typing.List[int]] = None,
+    selected_user_plants: typing.Optional[typing.List[int]] = None,
+    run_id: typing.Optional[str] = None,
+    deadline: typing.Optional[Deadline] = None,
+) -> FanOutSummary:
+    """Plan once, split the plan into balanced shards and archive them in
+    parallel, each shard as its own run ``<run_id>-<shard index>``.
+
+    Once ``deadline`` expires the summary is returned without the shards
+    still running, which finish on their own and are listed as pending.
+    """
+    run_id = run_id or uuid.uuid4().hex
+    with PostgresDatabase() as conn:
+        plan = build_plan(
+            SqlRepo(conn), timestamp_upto, selected_sensors, selected_user_plants
+        )
+    summary = FanOutSummary(run_id=run_id)
+    planned = shard_plan(plan, shards)
+    if not planned:
+        LOGGER.info(f"Nothing to archive for run {run_id}")
+        return summary
+    LOGGER.info(
+        f"Fanning out {plan.rows} rows over {len(planned)} shards, planned skew "
+        f"{skew([shard.rows for shard in planned])}"
+    )
+    events = [
+        shard.event(base_event or {}, timestamp_upto, run_id) for shard in planned
+    ]
+    for index, seconds, result, error, pending in backend.run(events, deadline):
+        if error:
+            LOGGER.error(f"Shard {index} of run {run_id} failed: {error}")
+        summary.results.append(
+            ShardResult(planned[index], seconds, result, error, pending)
+        )
+    report = summary.report()
+    LOGGER.info(
+        f"Run {run_id} archived {summary.rows} rows, rows skew "
+        f"{report['rows_skew']}, time skew {report['seconds_skew']}, failed "
+        f"shards: {summary.failed_shards}, pending shards: {summary.pending_shards}"
+    )
+    return summary
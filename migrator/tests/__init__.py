@@ -0,0 +1,11 @@
+"""Tests of the archive, run from the migrator directory with
+
+    python -m unittest discover -s tests -t .
+
+DynamoDB is moto's in-memory backend for every test, started here since
+core.settings creates its DynamoDB resource on import. See
+benchmarks.standins, which tests/database.py uses for PostgreSQL.
+"""
+from benchmarks import standins
+
+standins.start_dynamodb()
@@ -0,0 +1,125 @@
+"""Scratch SQLite database with sensors, user plants and rows to archive"""
+import tempfile
+import typing
+import unittest
+from datetime import date, timedelta
+import sqlalchemy as sa
+from benchmarks import standins
+from core import settings
+from migrator.adapters import orm as o
+from tests import rows
+
+DYNAMODB_TABLES = {
+    o.sensor_data_source.name: settings.DYNAMODB_SENSOR_DATA_TABLE,
+    o.daily_data_summary_source.name: settings.DYNAMODB_DAILY_SENSOR_DATA_TABLE,
+    o.user_plant_score_source.name: settings.DYNAMODB_PLANT_SCORE_TABLE,
+    o.user_plant_temperature_score_source.name: (
+        settings.DYNAMODB_PLANT_TEMPERATURE_SCORE_TABLE
+    ),
+    o.user_plant_humidity_score_source.name: settings.DYNAMODB_PLANT_HUMIDITY_SCORE_TABLE,
+    o.user_plant_light_score_source.name: settings.DYNAMODB_PLANT_LIGHT_SCORE_TABLE,
+    o.user_plant_moisture_score_source.name: settings.DYNAMODB_PLANT_MOISTURE_SCORE_TABLE,
+}
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """Every sensor has ``readings`` readings 15 minutes apart from
+    rows.START and a daily summary per day, every user plant ``scores``
+    hourly scores in each score table"""
+
+    sensors = 3
+    readings = 60
+    user_plants = 2
+    scores = 20
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.engine = standins.use_database(f"sqlite:{directory.name}")
+        self.addCleanup(self.engine.dispose)
+        standins.create_tables(self.engine)
+        standins.create_dynamodb_tables()
+        with self.engine.begin() as conn:
+            self._insert(conn)
+
+    def _insert(self, conn):
+        id_ = 1
+        for sensor_id in range(1, self.sensors + 1):
+            conn.execute(
+                o.sensor_table.insert(), {"id": sensor_id, "sensor_id": f"S{sensor_id}"}
+            )
+            readings = [
+                rows.reading(
+                    id_ + index,
+                    sensor_id,
+                    timestamp=rows.START + timedelta(minutes=15 * index),
+                )
+                for index in range(self.readings)
+            ]
+            conn.execute(o.sensor_readings_table.insert(), readings)
+            id_ += self.readings
+            days = (self.readings - 1) // 96 + 1
+            conn.execute(
+                o.daily_data_summary_table.insert(),
+                [
+                    {
+                        "id": sensor_id * 1000 + day,
+                        "sensor_id": sensor_id,
+                        "user_plant_id": 7,
+                        "date": date(2024, 1, 1) + timedelta(days=day),
+                        "temperature": 20.5,
+                        "humidity": None,
+                        "moisture": 3.0,
+                        "light": 100.0,
+                        "location": "indoor",
+                    }
+                    for day in range(days)
+                ],
+            )
+        id_ = 1
+        for user_plant_id in range(1, self.user_plants + 1):
+            conn.execute(
+                o.user_plants_table.insert(),
+                {"id": user_plant_id, "personal_name": f"P{user_plant_id}"},
+            )
+            for source in o.user_plant_sources:
+                scores = []
+                for index in range(self.scores):
+                    score = {
+                        "id": id_,
+                        "user_plant_id": user_plant_id,
+                        "timestamp": rows.START + timedelta(hours=index),
+                    }
+                    for column in source.table.c:
+                        if column.name.endswith("usable"):
+                            score[column.name] = index % 3 != 0
+                        elif column.name.endswith("score"):
+                            score[column.name] = (
+                                None
+                                if "rolled" in column.name and index % 2
+                                else index / 4
+                            )
+                    scores.append(score)
+                    id_ += 1
+                conn.execute(source.table.insert(), scores)
+
+    def left(self) -> typing.Dict[str, int]:
+        """Rows left in Postgres per table"""
+        with self.engine.connect() as conn:
+            return {
+                source.name: conn.execute(
+                    sa.select(sa.func.count()).select_from(source.table)
+                ).scalar()
+                for source in o.sensor_sources + o.user_plant_sources
+            }
+
+    def archived(self, table: str) -> typing.List[int]:
+        """Ids of the items archived for ``table``, in order"""
+        dynamo_table = settings.dynamodb_resource.Table(DYNAMODB_TABLES[table])
+        items, kwargs = [], {}
+        while True:
+            resp = dynamo_table.scan(ProjectionExpression="id", **kwargs)
+            items.extend(int(item["id"]) for item in resp["Items"])
+            if "LastEvaluatedKey" not in resp:
+                return sorted(items)
+            kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
@@ -0,0 +1,78 @@
+"""Rows of the archived tables for tests"""
+import math
+import typing
+from datetime import datetime, timedelta
+from migrator.domain import models as m
+from migrator.domain.columnar import SensorDataBatch
+
+START = datetime(2024, 1, 1)
+
+
+def reading(id_: int, sensor_id: int = 1, **values) -> typing.Dict[str, typing.Any]:
+    """A sensor_data row as the database gives it, one every 15 minutes"""
+    if "timestamp" not in values:
+        values["timestamp"] = START + timedelta(minutes=15 * id_)
+    row = {
+        "id": id_,
+        "sensor_id": sensor_id,
+        "user_plant_id": 7,
+        "temperature": 20.5,
+        "humidity": 0.5,
+        "moisture": 3.0,
+        "light": 100.0,
+        "moisture_voltage": 1.1,
+        "location": "indoor",
+    }
+    row.update(values)
+    return row
+
+
+def readings(
+    count: int, sensor_id: int = 1
+) -> typing.List[typing.Dict[str, typing.Any]]:
+    """Readings with some NULLs, a NaN, -0.0 and repeated values"""
+    rows = []
+    for id_ in range(1, count + 1):
+        rows.append(
+            reading(
+                id_,
+                sensor_id,
+                user_plant_id=None if id_ % 5 == 0 else 7,
+                temperature=None if id_ % 7 == 0 else 20 + (id_ % 4) / 4,
+                humidity=math.nan if id_ % 11 == 0 else 0.5,
+                moisture=-0.0 if id_ % 3 == 0 else 3.0 + id_ / 100,
+                light=float(id_ * 1000),
+                location=None if id_ % 13 == 0 else ("indoor", "outdoor")[id_ % 2],
+            )
+        )
+    return rows
+
+
+def batch(count: int, sensor_id: int = 1) -> SensorDataBatch:
+    return SensorDataBatch.from_rows(
+        readings(count, sensor_id), f"S{sensor_id}", sensor_id
+    )
+
+
+def plant_scores(count: int, user_plant_id: int = 1) -> typing.List[m.UserPlantScore]:
+    return [
+        m.UserPlantScore(
+            id=id_,
+            user_plant=f"P{user_plant_id}",
+            user_plant_id=user_plant_id,
+            timestamp=START + timedelta(hours=id_),
+            score=id_ / 3,
+            rolled_score=None if id_ % 2 else 0.25,
+            score_usable=bool(id_ % 3),
+        )
+        for id_ in range(1, count + 1)
+    ]
+
+
+def exact(items):
+    """Items with values that compare equal but print differently, such as
+    Decimal("0.0") and Decimal("-0.0"), told apart"""
+    return [
+        {name: (type(value), str(value)) for name, value in item.items()}
+        for item in items
+    ]
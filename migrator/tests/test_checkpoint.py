@@ -0,0 +1,141 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+from core import exceptions as exc
+from core import settings
+from migrator.domain import models as m
+from migrator.repository.checkpoint import (
+    DynamoCheckpointRepo,
+    SqliteCheckpointRepo,
+    get_checkpoint_repo,
+)
+from migrator.repository.dynamodb import DynamoRepo
+from migrator.repository.postgres import SqlRepo
+from migrator.services import ArchiveOptions, archive_data
+from tests.database import DatabaseTestCase
+
+CUTOFF = datetime(2024, 1, 2)
+
+
+class SqliteCheckpointRepoTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "checkpoints.db")
+
+    def test_save_and_get(self):
+        repo = SqliteCheckpointRepo(self.path)
+        self.assertIsNone(repo.get("sensor_data", 1))
+        checkpoint = m.Checkpoint("sensor_data", 1, "r1", "2024-01-01T07:15:00", 30)
+        repo.save(checkpoint)
+        self.assertEqual(repo.get("sensor_data", 1), checkpoint)
+        self.assertIsNone(repo.get("sensor_data", 2))
+        self.assertIsNone(repo.get("daily_data_summary", 1))
+
+    def test_later_save_replaces(self):
+        repo = SqliteCheckpointRepo(self.path)
+        repo.save(m.Checkpoint("sensor_data", 1, "r1", "2024-01-01T07:15:00", 30))
+        repo.save(m.Checkpoint("sensor_data", 1, "r1", done=True))
+        self.assertEqual(
+            repo.get("sensor_data", 1), m.Checkpoint("sensor_data", 1, "r1", done=True)
+        )
+
+    def test_survives_reopening(self):
+        checkpoint = m.Checkpoint("sensor_data", 1, "r1", "2024-01-01T07:15:00", 30)
+        SqliteCheckpointRepo(self.path).save(checkpoint)
+        self.assertEqual(
+            SqliteCheckpointRepo(self.path).get("sensor_data", 1), checkpoint
+        )
+
+    def test_get_checkpoint_repo(self):
+        resource = settings.dynamodb_resource
+        self.assertIsNone(get_checkpoint_repo("", resource))
+        self.assertIsInstance(
+            get_checkpoint_repo(f"sqlite:///{self.path}", resource),
+            SqliteCheckpointRepo,
+        )
+        repo = get_checkpoint_repo("dynamodb:Checkpoints", resource)
+        self.assertIsInstance(repo, DynamoCheckpointRepo)
+        self.assertEqual(repo.table_name, "Checkpoints")
+        with self.assertRaises(exc.WillowException):
+            get_checkpoint_repo("redis://localhost", resource)
+
+
+class ResumeTest(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "checkpoints.db")
+        self.options = ArchiveOptions(
+            mode="chunked",
+            chunk_size=10,
+            checkpoint=f"sqlite:///{self.path}",
+            run_id="r1",
+        )
+
+    def interrupted_run(self):
+        """A run whose fourth chunk, sensor 1's rows 31 to 40, fails"""
+        save, calls = DynamoRepo.save, []
+
+        def flaky(repo, source, data):
+            calls.append(source.name)
+            if len(calls) == 4:
+                raise RuntimeError("DynamoDB is down")
+            return save(repo, source, data)
+
+        with mock.patch.object(DynamoRepo, "save", flaky):
+            return archive_data(CUTOFF, options=self.options)
+
+    def test_interrupted_run_leaves_a_watermark(self):
+        summary = self.interrupted_run()
+        self.assertEqual(summary.failed_sensors, [1])
+        self.assertEqual(self.left()["sensor_data"], 30)
+        repo = SqliteCheckpointRepo(self.path)
+        self.assertEqual(
+            repo.get("sensor_data", 1),
+            m.Checkpoint("sensor_data", 1, "r1", "2024-01-01T07:15:00", 30),
+        )
+        self.assertTrue(repo.get("sensor_data", 2).done)
+        self.assertTrue(repo.get("user_plant_score", 1).done)
+
+    def run_recording_pages(self):
+        """Run again, returning the summary and (table, owner, after) of every
+        page read"""
+        page, pages = SqlRepo.page, []
+
+        def recording(repo, source, owner, upto, after=None, limit=10):
+            pages.append((source.name, owner.id, after))
+            return page(repo, source, owner, upto, after, limit)
+
+        with mock.patch.object(SqlRepo, "page", recording):
+            return archive_data(CUTOFF, options=self.options), pages
+
+    def test_resume_from_the_watermark(self):
+        self.interrupted_run()
+        second, pages = self.run_recording_pages()
+        # Only what the first run left, starting at its watermark
+        self.assertEqual(
+            pages[0], ("sensor_data", 1, (datetime(2024, 1, 1, 7, 15), 30))
+        )
+        self.assertEqual({owner for _, owner, _ in pages}, {1})
+        self.assertEqual(second.failed_sensors, [])
+        self.assertEqual(
+            second.sensors, {1: {"sensor_data": 30, "daily_data_summary": 1}}
+        )
+        self.assertEqual(set(self.left().values()), {0})
+        self.assertEqual(second.rows, 31)
+        self.assertEqual(self.archived("sensor_data"), list(range(1, 181)))
+
+    def test_new_run_resumes_from_the_watermark_too(self):
+        self.interrupted_run()
+        self.options.run_id = "r2"
+        summary, pages = self.run_recording_pages()
+        # Everything up to the watermark is gone whichever run left it
+        self.assertEqual(
+            pages[0], ("sensor_data", 1, (datetime(2024, 1, 1, 7, 15), 30))
+        )
+        self.assertEqual(summary.rows, 31)
+        self.assertEqual(set(self.left().values()), {0})
@@ -0,0 +1,65 @@
+import unittest
+from datetime import datetime
+from migrator.domain import models as m
+from migrator.domain.columnar import SensorDataBatch, row_ids, to_dicts
+from tests import rows
+
+
+class SensorDataBatchTest(unittest.TestCase):
+    def test_rows(self):
+        readings = rows.readings(40)
+        batch = SensorDataBatch.from_rows(readings, "S1", 1)
+        self.assertEqual(len(batch), 40)
+        self.assertEqual(list(batch.ids), [row["id"] for row in readings])
+        row = batch[4]
+        self.assertIsInstance(row, m.SensorData)
+        self.assertEqual((row.sensor, row.sensor_id), ("S1", 1))
+        self.assertIsNone(row.user_plant_id)
+        self.assertEqual(row.timestamp, readings[4]["timestamp"])
+        self.assertIsNone(batch[6].temperature)
+        self.assertIsNone(batch[10].humidity)
+        self.assertIsNone(batch[12].location)
+
+    def test_to_dicts_matches_to_dict(self):
+        batch = rows.batch(200)
+        self.assertEqual(
+            rows.exact(batch.to_dicts()), rows.exact(row.to_dict() for row in batch)
+        )
+
+    def test_signed_zeros(self):
+        readings = [
+            rows.reading(1, moisture=0.0, light=-0.0),
+            rows.reading(2, moisture=-0.0, light=0.0),
+        ]
+        batch = SensorDataBatch.from_rows(readings, "S1", 1)
+        self.assertEqual(
+            rows.exact(batch.to_dicts()), rows.exact(row.to_dict() for row in batch)
+        )
+
+    def test_early_timestamps(self):
+        batch = SensorDataBatch.from_rows(
+            [rows.reading(1, timestamp=datetime(999, 12, 31, 23, 59, 59))], "S1", 1
+        )
+        self.assertEqual(list(batch.to_dicts()), [row.to_dict() for row in batch])
+
+    def test_column(self):
+        batch = rows.batch(30)
+        for name in m.SensorData.__dataclass_fields__:
+            with self.subTest(name=name):
+                self.assertEqual(
+                    batch.column(name), [getattr(row, name) for row in batch]
+                )
+        with self.assertRaises(KeyError):
+            batch.column("score")
+
+    def test_select(self):
+        batch = rows.batch(30)
+        selected = batch.select([3, 7, 11])
+        self.assertEqual(list(selected), [batch[3], batch[7], batch[11]])
+
+    def test_chunk_helpers(self):
+        batch = rows.batch(5)
+        scores = rows.plant_scores(3)
+        self.assertEqual(list(row_ids(batch)), [1, 2, 3, 4, 5])
+        self.assertEqual(list(row_ids(scores)), [1, 2, 3])
+        self.assertEqual(list(to_dicts(scores)), [score.to_dict() for score in scores])
@@ -0,0 +1,92 @@
+import importlib
+import json
+import unittest
+from datetime import datetime
+from migrator.services import ArchiveSummary
+from migrator.services.continuation import LocalReinvoker, continuation_event
+from tests.database import DatabaseTestCase
+
+lambda_handler = importlib.import_module("migrator.entrypoints.lambda").lambda_handler
+CUTOFF = datetime(2024, 1, 2)
+
+
+class _Context:
+    """Lambda context with time for ``checks`` deadline checks"""
+
+    invoked_function_arn = "archive"
+
+    def __init__(self, checks: int):
+        self.checks = checks
+
+    def get_remaining_time_in_millis(self) -> int:
+        self.checks -= 1
+        return 900_000 if self.checks > 0 else 0
+
+
+class ContinuationEventTest(unittest.TestCase):
+    def test_pins_the_run(self):
+        summary = ArchiveSummary(
+            run_id="r1",
+            complete=False,
+            remaining_sensors=[3],
+            remaining_user_plants=[],
+            watermarks={"sensor_data#3": ["2024-01-01T07:15:00", 30]},
+        )
+        event = continuation_event(
+            {"mode": "chunked", "run_id": "old"}, CUTOFF, summary
+        )
+        self.assertEqual(
+            event,
+            {
+                "mode": "chunked",
+                "timestamp_upto": "2024-01-02T00:00:00",
+                "run_id": "r1",
+                "selected_sensors": [3],
+                "selected_user_plants": [],
+                "exact_selection": True,
+                "watermarks": {"sensor_data#3": ["2024-01-01T07:15:00", 30]},
+            },
+        )
+        # Sent to the next invocation as JSON
+        self.assertEqual(json.loads(json.dumps(event)), event)
+
+
+class ContinueTest(DatabaseTestCase):
+    event = {
+        "timestamp_upto": CUTOFF.isoformat(),
+        "mode": "chunked",
+        "chunk_size": 10,
+        "safety_margin_ms": 1000,
+    }
+
+    def test_run_continues_where_it_stopped(self):
+        reinvoke = LocalReinvoker(lambda_handler)
+        response = lambda_handler(self.event, _Context(4), reinvoke=reinvoke)
+        self.assertFalse(response["complete"])
+        continuation = response["continuation"]
+        self.assertEqual(reinvoke.events, [continuation])
+        self.assertEqual(continuation["run_id"], response["run_id"])
+        self.assertEqual(continuation["timestamp_upto"], "2024-01-02T00:00:00")
+        self.assertTrue(continuation["exact_selection"])
+        self.assertEqual(continuation["selected_sensors"], [1, 2, 3])
+        self.assertEqual(continuation["selected_user_plants"], [1, 2])
+        ((key, watermark),) = continuation["watermarks"].items()
+        self.assertEqual(key, "sensor_data#1")
+        continued = response["continued"]
+        self.assertTrue(continued["complete"])
+        self.assertEqual(continued["run_id"], response["run_id"])
+        # Every row archived once, the continuation starting at the watermark
+        self.assertEqual(set(self.left().values()), {0})
+        self.assertEqual(self.archived("sensor_data"), list(range(1, 181)))
+        # Sensor 1's rows up to id 60, its continuation read past the watermark
+        self.assertEqual(continued["sensors"][1]["sensor_data"], 60 - watermark[1])
+
+    def test_exact_selection_of_nothing(self):
+        event = {**self.event, "selected_sensors": [2], "selected_user_plants": []}
+        lambda_handler({**event, "exact_selection": True}, None)
+        left = self.left()
+        self.assertEqual(left["sensor_data"], 120)
+        self.assertEqual(left["user_plant_score"], 40)
+        # Without it an empty list is all of them
+        lambda_handler(event, None)
+        self.assertEqual(self.left()["user_plant_score"], 0)
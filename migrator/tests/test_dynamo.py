@@ -0,0 +1,186 @@
+import unittest
+from types import SimpleNamespace
+from botocore.exceptions import ClientError
+from core import exceptions as exc
+from core.dynamo import BatchWriter, RateLimiter
+
+
+def _items(*keys, **values):
+    return [{"id": key, **values} for key in keys]
+
+
+def _throttled():
+    return ClientError(
+        {"Error": {"Code": "ProvisionedThroughputExceededException"}},
+        "BatchWriteItem",
+    )
+
+
+class _Client:
+    """BatchWriteItem answering with ``responses`` in turn, recording the
+    items of every request; an exception in the list is raised instead"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def batch_write_item(self, RequestItems, ReturnConsumedCapacity):
+        ((table, requests),) = RequestItems.items()
+        self.requests.append([request["PutRequest"]["Item"] for request in requests])
+        response = self.responses.pop(0) if self.responses else {}
+        if isinstance(response, Exception):
+            raise response
+        if callable(response):
+            return response(table, requests)
+        return response
+
+
+def _unprocessed(count: int):
+    """Response leaving the last ``count`` items of the request unprocessed"""
+
+    def respond(table, requests):
+        return {
+            "UnprocessedItems": {table: requests[len(requests) - count :]},
+            "ConsumedCapacity": [{"CapacityUnits": float(len(requests) - count)}],
+        }
+
+    return respond
+
+
+def _writer(client, **options) -> BatchWriter:
+    table = SimpleNamespace(
+        name="Archive", meta=SimpleNamespace(client=client), key_schema=[]
+    )
+    options.setdefault("base_delay", 0)
+    return BatchWriter(table, key_names=["id"], **options)
+
+
+class BatchWriterTest(unittest.TestCase):
+    def test_unprocessed_items_are_sent_again(self):
+        client = _Client(_unprocessed(3))
+        result = _writer(client).write(_items(*range(10)))
+        self.assertEqual(result.written, 10)
+        self.assertEqual(result.retried, 3)
+        self.assertEqual(result.requests, 2)
+        self.assertEqual(result.throttled, 1)
+        self.assertEqual(result.consumed, 7.0)
+        self.assertEqual(client.requests[1], _items(7, 8, 9))
+
+    def test_throttled_requests_are_sent_again(self):
+        client = _Client(_throttled(), _throttled())
+        result = _writer(client).write(_items(1, 2))
+        self.assertEqual(result.written, 2)
+        self.assertEqual(result.throttled, 2)
+        self.assertEqual(len(client.requests), 3)
+        self.assertEqual(client.requests[0], client.requests[2])
+
+    def test_other_errors_raise(self):
+        error = ClientError(
+            {"Error": {"Code": "ValidationException"}}, "BatchWriteItem"
+        )
+        with self.assertRaises(ClientError):
+            _writer(_Client(error)).write(_items(1))
+
+    def test_max_retries(self):
+        client = _Client(*[_unprocessed(1)] * 4)
+        with self.assertRaises(exc.DbException):
+            _writer(client, max_retries=3).write(_items(1, 2))
+        # The first attempt and three retries
+        self.assertEqual(len(client.requests), 4)
+
+    def test_duplicate_keys_in_a_batch(self):
+        client = _Client()
+        items = _items(1, 2, value="old") + _items(2, 3, value="new")
+        result = _writer(client, batch_size=3).write(items)
+        self.assertEqual(result.duplicates, 1)
+        self.assertEqual(result.written, 3)
+        self.assertEqual(
+            client.requests,
+            [
+                [
+                    {"id": 1, "value": "old"},
+                    {"id": 2, "value": "new"},
+                    {"id": 3, "value": "new"},
+                ]
+            ],
+        )
+
+    def test_duplicates_in_separate_batches_are_both_sent(self):
+        client = _Client()
+        result = _writer(client, batch_size=2).write(_items(1, 2, 1))
+        self.assertEqual(result.duplicates, 0)
+        self.assertEqual(client.requests, [_items(1, 2), _items(1)])
+
+    def test_batch_size(self):
+        with self.assertRaises(exc.WillowException):
+            _writer(_Client(), batch_size=26)
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class RateLimiterTest(unittest.TestCase):
+    def limiter(self, **options) -> RateLimiter:
+        self.clock = _Clock()
+        options.setdefault("increase", 10)
+        return RateLimiter(100, clock=self.clock, sleep=self.clock.sleep, **options)
+
+    def test_paces_to_the_rate(self):
+        limiter = self.limiter()
+        # A full bucket goes through, then the debt is slept off
+        self.assertEqual(limiter.acquire(100), 100)
+        self.assertEqual(self.clock.slept, [])
+        limiter.acquire(50)
+        self.assertEqual(self.clock.slept, [0.5])
+        self.clock.now += 1
+        limiter.acquire(50)
+        self.assertEqual(self.clock.slept, [0.5])
+
+    def test_throttling_halves_the_rate_once_per_cooldown(self):
+        limiter = self.limiter(cooldown=2)
+        limiter.record(25, 0, 0, throttled=True)
+        self.assertEqual(limiter.rate, 50)
+        self.clock.now += 1
+        limiter.record(25, 0, 0, throttled=True)
+        self.assertEqual(limiter.rate, 50)
+        self.clock.now += 1
+        limiter.record(25, 0, 0, throttled=True)
+        self.assertEqual(limiter.rate, 25)
+
+    def test_rate_stays_above_the_minimum(self):
+        limiter = self.limiter(min_rate=30, cooldown=0)
+        for _ in range(5):
+            limiter.record(25, 0, 0, throttled=True)
+        self.assertEqual(limiter.rate, 30)
+
+    def test_rate_recovers_up_to_the_maximum(self):
+        limiter = self.limiter()
+        limiter.record(25, 0, 0, throttled=True)
+        for expected in (60, 70, 80, 90, 100, 100):
+            limiter.record(25, 25, 25.0, throttled=False)
+            self.assertEqual(limiter.rate, expected)
+
+    def test_throttling_drops_the_saved_up_tokens(self):
+        limiter = self.limiter()
+        limiter.record(25, 0, 0, throttled=True)
+        limiter.acquire(10)
+        self.assertEqual(self.clock.slept, [10 / 50])
+
+    def test_learns_the_units_per_item(self):
+        limiter = self.limiter()
+        for _ in range(50):
+            units = limiter.acquire(10)
+            limiter.record(units, 10, 20.0, throttled=False)
+            self.clock.now += 10
+        self.assertAlmostEqual(limiter.units_per_item, 2.0, places=3)
+        self.assertAlmostEqual(limiter.acquire(10), 20.0, places=2)
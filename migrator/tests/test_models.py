@@ -0,0 +1,72 @@
+import itertools
+import unittest
+from datetime import date, datetime, timezone
+from dataclasses import fields
+from migrator.domain import models as m
+from tests import rows
+
+MODELS = [
+    m.SensorData,
+    m.DailyDataSummary,
+    m.UserPlantTemperatureScore,
+    m.UserPlantHumidityScore,
+    m.UserPlantLightScore,
+    m.UserPlantMoistureScore,
+    m.UserPlantScore,
+]
+# Values of each field type, None for every one of them since a column's
+# type is not enforced; every row takes the next value of each list
+VALUES = {
+    int: [1, 0, None, 2**40],
+    str: ["S1", "", None],
+    float: [21.5, 0.0, -0.0, 1e-7, 0.1 + 0.2, 1e22, None],
+    datetime: [
+        datetime(2024, 1, 1, 7, 15, 30, 250),
+        datetime(999, 12, 31, 23, 59, 59),
+        datetime(2024, 1, 1, tzinfo=timezone.utc),
+        None,
+    ],
+    date: [date(2024, 2, 29), date(5, 1, 1), None],
+    bool: [True, False, None],
+}
+
+
+def _items(model, count=12):
+    values = {
+        field.name: itertools.cycle(VALUES[m._field_type(field.type)])
+        for field in fields(model)
+    }
+    return [
+        model(**{name: next(cycle) for name, cycle in values.items()})
+        for _ in range(count)
+    ]
+
+
+class SerializerTest(unittest.TestCase):
+    def test_matches_clean_for_dynamodb(self):
+        for model in MODELS:
+            with self.subTest(model=model.__name__):
+                items = _items(model)
+                expected = [
+                    {
+                        field.name: m.Base._clean_for_dynamodb(
+                            getattr(item, field.name)
+                        )
+                        for field in fields(model)
+                    }
+                    for item in items
+                ]
+                serializer = model.serializer()
+                self.assertEqual(
+                    rows.exact(map(serializer, items)), rows.exact(expected)
+                )
+                self.assertEqual(
+                    rows.exact(item.to_dict() for item in items), rows.exact(expected)
+                )
+
+    def test_compiled_once_per_class(self):
+        self.assertIs(m.SensorData.serializer(), m.SensorData.serializer())
+        self.assertIsNot(m.UserPlantScore.serializer(), m.SensorData.serializer())
+        # to_dict stays the method every model inherits
+        for model in MODELS:
+            self.assertIs(model.to_dict, m.Base.to_dict)
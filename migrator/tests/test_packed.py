@@ -0,0 +1,97 @@
+import random
+import unittest
+from datetime import timedelta
+from unittest import mock
+from migrator.domain import packed
+from migrator.domain.columnar import SensorDataBatch
+from tests import rows
+
+
+class EncodeTest(unittest.TestCase):
+    def test_round_trip(self):
+        batch = rows.batch(300)
+        decoded = packed.decode(packed.encode(batch))
+        self.assertEqual((decoded.sensor, decoded.sensor_id), ("S1", 1))
+        self.assertEqual(list(decoded), list(batch))
+
+    def test_missing_readings_and_user_plant(self):
+        readings = [
+            rows.reading(1, user_plant_id=None, temperature=None, location=None),
+            rows.reading(2, humidity=float("nan"), moisture=-0.0),
+        ]
+        decoded = list(
+            packed.decode(packed.encode(SensorDataBatch.from_rows(readings, "S1", 1)))
+        )
+        self.assertIsNone(decoded[0].user_plant_id)
+        self.assertIsNone(decoded[0].temperature)
+        self.assertIsNone(decoded[0].location)
+        # NaN stands for NULL in a batch
+        self.assertIsNone(decoded[1].humidity)
+        self.assertEqual(str(decoded[1].moisture), "-0.0")
+        self.assertEqual(decoded[1].user_plant_id, 7)
+
+    def test_irregular_ids_and_timestamps(self):
+        generator = random.Random(4)
+        readings, id_ = [], 10**12
+        timestamp = rows.START
+        for _ in range(200):
+            id_ += generator.randint(1, 10**6)
+            timestamp += timedelta(microseconds=generator.randint(1, 10**9))
+            readings.append(
+                rows.reading(id_, timestamp=timestamp, light=generator.random())
+            )
+        batch = SensorDataBatch.from_rows(readings, None, 3)
+        self.assertEqual(list(packed.decode(packed.encode(batch))), list(batch))
+
+    def test_not_packed(self):
+        with self.assertRaises(ValueError):
+            packed.decode(packed.zlib.compress(b"XXXX"))
+
+
+class PackTest(unittest.TestCase):
+    def test_one_item_per_bucket(self):
+        batch = rows.batch(300)
+        items = list(packed.pack(batch))
+        self.assertEqual(
+            [item["bucket"] for item in items],
+            [
+                "2024-01-01T00:00:00#1",
+                "2024-01-02T00:00:00#96",
+                "2024-01-03T00:00:00#192",
+                "2024-01-04T00:00:00#288",
+            ],
+        )
+        self.assertEqual([item["rows"] for item in items], [95, 96, 96, 13])
+        self.assertEqual({item["sensor_id"] for item in items}, {1})
+        self.assertEqual(packed.unpack(items), list(batch))
+
+    def test_large_bucket_is_split(self):
+        batch = rows.batch(90)
+        with mock.patch.object(packed, "MAX_DATA_BYTES", 400):
+            items = list(packed.pack(batch))
+        self.assertGreater(len(items), 1)
+        self.assertTrue(all(len(item["data"]) <= 400 for item in items))
+        self.assertEqual(sum(item["rows"] for item in items), 90)
+        first_ids = [int(item["bucket"].split("#")[1]) for item in items]
+        self.assertEqual(first_ids[0], 1)
+        self.assertEqual(len(set(first_ids)), len(items))
+        self.assertEqual(packed.unpack(items), list(batch))
+
+    def test_unpack_keeps_each_row_once(self):
+        batch = rows.batch(120)
+        first = list(packed.pack(batch.select(range(80))))
+        # Archived again with more rows, overlapping the first chunk
+        again = list(packed.pack(batch.select(range(40, 120))))
+        unpacked = packed.unpack(again + first + first)
+        self.assertEqual(unpacked, list(batch))
+
+    def test_unpack_reads_binary_attributes(self):
+        class Binary:
+            def __init__(self, value):
+                self.value = value
+
+        items = [
+            dict(item, data=Binary(item["data"]))
+            for item in packed.pack(rows.batch(10))
+        ]
+        self.assertEqual(packed.unpack(items), list(rows.batch(10)))
@@ -0,0 +1,62 @@
+import unittest
+from datetime import date, datetime
+from migrator.adapters import orm as o
+from migrator.domain import models as m
+from migrator.repository.postgres import parse_range_bound
+
+
+def _bound(lower: str, upper: str) -> str:
+    return f"FOR VALUES FROM ({lower}) TO ({upper})"
+
+
+class ParseRangeBoundTest(unittest.TestCase):
+    def test_timestamp(self):
+        self.assertEqual(
+            parse_range_bound(
+                o.sensor_data_source,
+                _bound("'2024-01-01 00:00:00'", "'2024-02-01 00:00:00.5'"),
+            ),
+            (datetime(2024, 1, 1), datetime(2024, 2, 1, 0, 0, 0, 500000)),
+        )
+
+    def test_timestamptz_is_naive_utc(self):
+        for bound, expected in (
+            ("'2024-01-01 00:00:00+00'", datetime(2024, 1, 1)),
+            ("'2024-01-01 05:30:00+05:30'", datetime(2024, 1, 1)),
+            ("'2023-12-31 21:00:00-03'", datetime(2024, 1, 1)),
+            ("'2024-01-01 00:00:00.25+01'", datetime(2023, 12, 31, 23, 0, 0, 250000)),
+        ):
+            with self.subTest(bound=bound):
+                lower, upper = parse_range_bound(
+                    o.sensor_data_source, _bound(bound, "MAXVALUE")
+                )
+                self.assertEqual(lower, expected)
+                self.assertIsNone(lower.tzinfo)
+                self.assertIsNone(upper)
+
+    def test_timestamptz_partition_compares_to_cutoff(self):
+        bounds = parse_range_bound(
+            o.sensor_data_source,
+            _bound("'2024-01-01 00:00:00+00'", "'2024-02-01 00:00:00+00'"),
+        )
+        partition = m.Partition("p", *bounds)
+        self.assertTrue(partition.older_than(datetime(2024, 2, 15)))
+        self.assertFalse(partition.older_than(datetime(2024, 1, 15)))
+
+    def test_date(self):
+        self.assertEqual(
+            parse_range_bound(
+                o.daily_data_summary_source, _bound("MINVALUE", "'2024-02-01'")
+            ),
+            (None, date(2024, 2, 1)),
+        )
+
+    def test_unreadable_bounds_are_skipped(self):
+        for bound in (
+            "DEFAULT",
+            "FOR VALUES IN (1, 2)",
+            _bound("'-infinity'", "'2024-01-01 00:00:00'"),
+            _bound("'2024-01-01 00:00:00 BC'", "'2024-01-01 00:00:00'"),
+        ):
+            with self.subTest(bound=bound):
+                self.assertIsNone(parse_range_bound(o.sensor_data_source, bound))
@@ -0,0 +1,106 @@
+import io
+import itertools
+import json
+import threading
+import unittest
+from datetime import datetime
+from core import exceptions as exc
+from core.utils.deadline import Deadline
+from migrator.domain import models as m
+from migrator.services.planning import ArchivePlan, EntityPlan
+from migrator.services.sharding import LambdaBackend, shard_plan, skew
+
+
+def _plan(sensors: dict, user_plants: dict = None) -> ArchivePlan:
+    def entities(rows_per_id, make_owner):
+        return {
+            id_: EntityPlan(
+                make_owner(id_),
+                {
+                    "table": m.PendingRows(
+                        rows, datetime(2024, 1, 1), datetime(2024, 2, 1)
+                    )
+                },
+            )
+            for id_, rows in rows_per_id.items()
+        }
+
+    return ArchivePlan(
+        sensors=entities(sensors, lambda id_: m.Sensor(id_, f"S{id_}")),
+        user_plants=entities(
+            user_plants or {}, lambda id_: m.UserPlant(id_, f"P{id_}")
+        ),
+    )
+
+
+class ShardPlanTest(unittest.TestCase):
+    def test_every_entity_once(self):
+        plan = _plan({1: 10, 2: 20, 3: 30}, {4: 5, 5: 15})
+        shards = shard_plan(plan, 2)
+        self.assertEqual(
+            sorted(itertools.chain(*(s.sensors for s in shards))), [1, 2, 3]
+        )
+        self.assertEqual(
+            sorted(itertools.chain(*(s.user_plants for s in shards))), [4, 5]
+        )
+        self.assertEqual(sum(shard.rows for shard in shards), plan.rows)
+
+    def test_largest_first_onto_the_lightest_shard(self):
+        shards = shard_plan(_plan({1: 50, 2: 30, 3: 20, 4: 20, 5: 10, 6: 10}), 3)
+        self.assertEqual([shard.sensors for shard in shards], [[1], [2, 5, 6], [3, 4]])
+        self.assertEqual([shard.rows for shard in shards], [50, 50, 40])
+
+    def test_within_four_thirds_of_the_optimum(self):
+        rows = {id_: (id_ * 7919) % 1000 + 1 for id_ in range(1, 200)}
+        for count in (2, 3, 5, 8):
+            with self.subTest(shards=count):
+                shards = shard_plan(_plan(rows), count)
+                optimum = max(sum(rows.values()) / count, max(rows.values()))
+                self.assertLessEqual(max(s.rows for s in shards), optimum * 4 / 3)
+                self.assertLess(skew([s.rows for s in shards]), 1.05)
+
+    def test_more_shards_than_entities(self):
+        shards = shard_plan(_plan({1: 5, 2: 5}), 4)
+        self.assertEqual(len(shards), 2)
+
+    def test_at_least_one_shard(self):
+        with self.assertRaises(exc.WillowException):
+            shard_plan(_plan({1: 5}), 0)
+
+
+class _Client:
+    """Lambda client answering every worker, but those told to wait only
+    once released"""
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        event = json.loads(Payload)
+        if event.get("wait"):
+            self.release.wait(5)
+        body = {"complete": True, "sensors": {}, "user_plants": {}}
+        return {"Payload": io.BytesIO(json.dumps(body).encode())}
+
+
+class LambdaBackendTest(unittest.TestCase):
+    def test_running_shards_are_pending_at_the_deadline(self):
+        client = _Client()
+        self.addCleanup(client.release.set)
+        backend = LambdaBackend("worker", client=client)
+        results = list(
+            backend.run([{}, {"wait": True}, {}], Deadline.in_ms(200, margin_ms=100))
+        )
+        self.assertEqual(
+            [(index, error, pending) for index, _, _, error, pending in results],
+            [(0, None, False), (1, None, True), (2, None, False)],
+        )
+        self.assertIsNone(results[1][2])
+        self.assertTrue(results[0][2]["complete"])
+
+    def test_waits_for_every_shard_without_deadline(self):
+        client = _Client()
+        client.release.set()
+        results = list(LambdaBackend("worker", client=client).run([{"wait": True}]))
+        self.assertFalse(results[0][4])
+        self.assertTrue(results[0][2]["complete"])
@@ -0,0 +1,166 @@
+import gzip
+import json
+import math
+import os
+import tempfile
+import unittest
+import zlib
+from core import exceptions as exc
+from migrator.adapters import orm as o
+from migrator.domain.columnar import SensorDataBatch
+from migrator.repository import spool
+from migrator.services import ArchiveOptions, replay_spool
+from tests import rows
+
+
+def _record(payload: bytes) -> bytes:
+    return spool._HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def _same(left, right) -> bool:
+    """Equal, NaN included"""
+    if isinstance(left, float) and isinstance(right, float):
+        return left == right or (math.isnan(left) and math.isnan(right))
+    return left == right
+
+
+class EncodeTest(unittest.TestCase):
+    def assertSameRows(self, left, right):
+        self.assertEqual(len(left), len(right))
+        for expected, actual in zip(left, right):
+            for name in type(expected).__dataclass_fields__:
+                a, b = getattr(expected, name), getattr(actual, name)
+                self.assertTrue(_same(a, b), f"{name}: {a!r} != {b!r}")
+
+    def test_rows_round_trip(self):
+        scores = rows.plant_scores(20)
+        source, decoded = spool.decode(spool.encode(o.user_plant_score_source, scores))
+        self.assertIs(source, o.user_plant_score_source)
+        self.assertEqual(decoded, scores)
+
+    def test_batch_round_trip(self):
+        batch = rows.batch(50)
+        source, decoded = spool.decode(spool.encode(o.sensor_data_source, batch))
+        self.assertIs(source, o.sensor_data_source)
+        self.assertIsInstance(decoded, SensorDataBatch)
+        self.assertSameRows(list(batch), list(decoded))
+
+    def test_changed_fields_fail(self):
+        payload = spool.encode(o.user_plant_score_source, rows.plant_scores(2))
+        (length,) = spool._LENGTH.unpack_from(payload)
+        header = json.loads(payload[spool._LENGTH.size : spool._LENGTH.size + length])
+        header["fields"][-1] = "renamed"
+        raw = json.dumps(header).encode()
+        changed = (
+            spool._LENGTH.pack(len(raw)) + raw + payload[spool._LENGTH.size + length :]
+        )
+        with self.assertRaises(exc.WillowException):
+            spool.decode(changed)
+
+
+class ReadRecordsTest(unittest.TestCase):
+    payloads = [b"first", b"second" * 100, b"third"]
+
+    def segment(self) -> bytes:
+        return spool.MAGIC + b"".join(map(_record, self.payloads))
+
+    def test_all_records(self):
+        self.assertEqual(list(spool.read_records(self.segment())), self.payloads)
+
+    def test_torn_tail_is_skipped(self):
+        buffer = self.segment()
+        # Cut short inside the last record, or inside its header
+        for cut in (3, len(self.payloads[-1]) + 2):
+            with self.subTest(cut=cut):
+                records = list(spool.read_records(buffer[:-cut]))
+                self.assertEqual(records, self.payloads[:-1])
+
+    def test_bad_checksum_of_last_record_is_skipped(self):
+        buffer = bytearray(self.segment())
+        buffer[-1] ^= 0xFF
+        self.assertEqual(list(spool.read_records(bytes(buffer))), self.payloads[:-1])
+
+    def test_corruption_before_the_tail_raises(self):
+        buffer = bytearray(self.segment())
+        # Inside the second payload, the third record is intact
+        buffer[len(spool.MAGIC) + len(_record(b"first")) + spool._HEADER.size] ^= 0xFF
+        with self.assertRaises(exc.WillowException):
+            list(spool.read_records(bytes(buffer)))
+
+    def test_not_a_segment(self):
+        with self.assertRaises(exc.WillowException):
+            list(spool.read_records(b"something else"))
+
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.spool = os.path.join(directory.name, "spool")
+        self.archive = os.path.join(directory.name, "archive")
+        os.makedirs(self.spool)
+
+    def leave_segment(self, *payloads: bytes, sequence: int = 0) -> str:
+        """A segment as a crashed run leaves it"""
+        segment = spool.Segment.create(self.spool, sequence)
+        for payload in payloads:
+            os.write(segment.fd, _record(payload))
+        segment.release()
+        return segment.path
+
+    def archived(self, table: str):
+        found = []
+        for directory, _, names in os.walk(os.path.join(self.archive, table)):
+            for name in names:
+                with gzip.open(os.path.join(directory, name)) as archived:
+                    found.extend(json.loads(line) for line in archived)
+        return sorted(found, key=lambda item: item["id"])
+
+    def replay(self):
+        return replay_spool(
+            ArchiveOptions(sink=f"file://{self.archive}", spool=self.spool)
+        )
+
+    def test_claim_skips_held_segments(self):
+        held = spool.Segment.create(self.spool, 0)
+        self.addCleanup(held.remove)
+        left = self.leave_segment(b"", sequence=1)
+        claimed = spool.claim_segments(self.spool)
+        self.assertEqual([segment.path for segment in claimed], [left])
+        for segment in claimed:
+            segment.release()
+
+    def test_replay_uploads_and_removes(self):
+        scores = rows.plant_scores(10)
+        batch = rows.batch(30)
+        self.leave_segment(
+            spool.encode(o.user_plant_score_source, scores[:6]),
+            spool.encode(o.user_plant_score_source, scores[6:]),
+        )
+        path = self.leave_segment(spool.encode(o.sensor_data_source, batch), sequence=1)
+        # Torn by the crash, never acknowledged
+        with open(path, "ab") as segment:
+            segment.write(_record(b"lost")[:-2])
+        report = self.replay()
+        self.assertEqual(report["replayed"], 2)
+        self.assertEqual(report["uploaded"], 40)
+        self.assertIsNone(report["error"])
+        self.assertEqual(os.listdir(self.spool), [])
+        self.assertEqual(
+            [item["id"] for item in self.archived("user_plant_score")],
+            [score.id for score in scores],
+        )
+        self.assertEqual(
+            [item["id"] for item in self.archived("sensor_data")], list(batch.ids)
+        )
+
+    def test_corrupt_segment_stays(self):
+        first = spool.encode(o.user_plant_score_source, rows.plant_scores(3))
+        second = spool.encode(o.user_plant_score_source, rows.plant_scores(6)[3:])
+        path = self.leave_segment(first, second)
+        with open(path, "r+b") as segment:
+            segment.seek(len(spool.MAGIC) + spool._HEADER.size + 10)
+            segment.write(b"\xff\xff")
+        report = self.replay()
+        self.assertIsNotNone(report["error"])
+        self.assertEqual(os.listdir(self.spool), [os.path.basename(path)])